@@ -8,6 +8,16 @@
 
 # History:
 #
+# 1.2.1rc1   Performance improvements for seeders and set-top boxes:
+#            - DownloadConfig.[s/g]et_upload_sendfile()
+#            - DownloadConfig.[s/g]et_hashcheck_workers()
+#            - DownloadConfig.[s/g]et_resume_index()
+#            - DownloadConfig.[s/g]et_storage_mmap()
+#            - DownloadConfig.[s/g]et_vod_rebuffer_target()
+#            - Session.set_download_state_changes_callback()
+#            - SessionConfig.[s/g]et_hashcheck_concurrency()
+#            - Session.get_hashcheck_stats()
+#
 # 1.2.0      Released with Next-Share M48
 #
 # 1.2.0rc1   Support for swift Downloads in Core API:
@@ -326,6 +326,46 @@ class DownloadImpl:
             self.dllock.release()
 
 
+    def network_get_state_summary(self):
+        """ Returns a dict with the status, error, progress, current up and 
+        download speed (in KB/s) and number of (non-seed) peers, as 
+        returned by the DownloadState getters, without creating a 
+        DownloadState. See Session.set_download_state_changes_callback().
+        
+        Called by network thread """
+        self.dllock.acquire()
+        try:
+            summary = {'status':DLSTATUS_STOPPED,'error':self.error,
+                       'progress':self.progressbeforestop,
+                       'upspeed':0.0,'downspeed':0.0,
+                       'numpeers':0,'numnonseeds':0}
+            if self.sd is not None:
+                (status,stats) = self.sd.get_stats_summary()
+                if status == DLSTATUS_WAITING4HASHCHECK:
+                    summary['status'] = status
+                    summary['progress'] = 0.0
+                elif status == DLSTATUS_HASHCHECKING:
+                    summary['status'] = status
+                    summary['progress'] = stats['frac']
+                else:
+                    if stats['frac'] == 1.0:
+                        summary['status'] = DLSTATUS_SEEDING
+                    else:
+                        summary['status'] = DLSTATUS_DOWNLOADING
+                    if status == DLSTATUS_REPEXING:
+                        summary['status'] = status
+                    summary['progress'] = stats['frac']
+                    summary['upspeed'] = stats['up']/1024.0
+                    summary['downspeed'] = stats['down']/1024.0
+                    summary['numpeers'] = stats['numpeers']
+                    summary['numnonseeds'] = stats['numnonseeds']
+                    self.progressbeforestop = stats['frac']
+            if self.error is not None:
+                summary['status'] = DLSTATUS_STOPPED_ON_ERROR
+            return summary
+        finally:
+            self.dllock.release()
+
     def sesscb_get_state_returncallback(self,usercallback,when,newgetpeerlist):
         """ Called by SessionCallbackThread """
         self.dllock.acquire()
@@ -66,9 +66,14 @@ class TriblerLaunchMany(Thread):
         # Orig
         self.sessdoneflag = Event()
         
-        # Following two attributes set/get by network thread ONLY
+        # Following attributes set/get by network thread ONLY
         self.hashcheck_queue = []
-        self.sdownloadtohashcheck = None
+        self.sdownloadstohashcheck = []
+        self.hashcheck_concurrency = max(1,config['hashcheck_concurrency'])
+        self.hashcheck_checked = 0
+        self.hashcheck_bytes = 0
+        self.hashcheck_busytime = 0.0
+        self.hashcheck_busysince = None
         
         # Following 2 attributes set/get by UPnPThread
         self.upnp_thread = None
@@ -489,31 +494,70 @@ class TriblerLaunchMany(Thread):
         
         self.hashcheck_queue.append(sd)
         
-        # Check SEEDING and then smallest torrents first
-        self.hashcheck_queue.sort(singledownload_size_cmp)
+        # Check VOD, SEEDING and then smallest torrents first
+        self.hashcheck_queue.sort(singledownload_hashcheck_cmp)
             
-        if not self.sdownloadtohashcheck:
-            self.dequeue_and_start_hashcheck()
+        self.dequeue_and_start_hashcheck()
 
     def dequeue_and_start_hashcheck(self):
-        """ Start integriy check for first SingleDownload in queue
+        """ Start integrity checks for SingleDownloads in queue, as long as
+        less than hashcheck_concurrency are running. A disk is checked by one
+        SingleDownload at a time to avoid seeking between them, except for 
+        VOD Downloads which the user is waiting for.
         
         Called by network thread """
-        self.sdownloadtohashcheck = self.hashcheck_queue.pop(0)
-        self.sdownloadtohashcheck.perform_hashcheck(self.hashcheck_done)
-
-    def hashcheck_done(self,success=True):
-        """ Integrity check for first SingleDownload in queue done
+        while len(self.sdownloadstohashcheck) < self.hashcheck_concurrency:
+            busydisks = [get_hashcheck_disk(sd) for sd in self.sdownloadstohashcheck]
+            for sd in self.hashcheck_queue:
+                if sd.videoinfo is not None or get_hashcheck_disk(sd) not in busydisks:
+                    break
+            else:
+                return
+            self.hashcheck_queue.remove(sd)
+            if not self.sdownloadstohashcheck:
+                self.hashcheck_busysince = timemod.time()
+            self.sdownloadstohashcheck.append(sd)
+            sd.perform_hashcheck(self.hashcheck_done)
+
+    def hashcheck_done(self,sd,success=True):
+        """ Integrity check for SingleDownload done, or SingleDownload was
+        shutdown while waiting or being checked.
         
         Called by network thread """
         if DEBUG:
-            print >>sys.stderr,"tlm: hashcheck_done, success",success,self.sdownloadtohashcheck.b64_infohash
+            print >>sys.stderr,"tlm: hashcheck_done, success",success,sd.b64_infohash
+        if sd in self.hashcheck_queue:
+            self.hashcheck_queue.remove(sd)
+            return
+        if sd not in self.sdownloadstohashcheck:
+            return
+        self.sdownloadstohashcheck.remove(sd)
+        if not self.sdownloadstohashcheck:
+            self.hashcheck_busytime += timemod.time()-self.hashcheck_busysince
+            self.hashcheck_busysince = None
         if success:
-            self.sdownloadtohashcheck.hashcheck_done()
-        if self.hashcheck_queue:
-            self.dequeue_and_start_hashcheck()
+            self.hashcheck_checked += 1
+            dow = sd.get_bt1download()
+            if dow is not None:
+                self.hashcheck_bytes += dow.get_datalength()
+            sd.hashcheck_done()
+        self.dequeue_and_start_hashcheck()
+
+    def get_hashcheck_stats(self):
+        """ Called by any thread """
+        busytime = self.hashcheck_busytime
+        busysince = self.hashcheck_busysince
+        if busysince is not None:
+            busytime += timemod.time()-busysince
+        if busytime > 0.0:
+            speed = self.hashcheck_bytes/busytime
         else:
-            self.sdownloadtohashcheck = None
+            speed = 0.0
+        return {'queued':len(self.hashcheck_queue),
+                'active':len(self.sdownloadstohashcheck),
+                'checked':self.hashcheck_checked,
+                'bytes':self.hashcheck_bytes,
+                'speed':speed}
 
     #
     # State retrieval
@@ -552,6 +596,56 @@ class TriblerLaunchMany(Thread):
             # reschedule
             self.set_download_states_callback(usercallback,newgetpeerlist,when=when)
 
+    def set_download_state_changes_callback(self,usercallback,laststates=None,when=0.0):
+        """ Called by any thread """
+        if laststates is None:
+            laststates = {}
+        network_set_download_state_changes_callback_lambda = lambda:self.network_set_download_state_changes_callback(usercallback,laststates,when)
+        self.rawserver.add_task(network_set_download_state_changes_callback_lambda,when)
+
+    def network_set_download_state_changes_callback(self,usercallback,laststates,lastwhen):
+        """ Called by network thread """
+        self.sesslock.acquire()
+        try:
+            dllist = self.downloads.values()
+        finally:
+            self.sesslock.release()
+
+        # Only the fields that differ from the states reported last time
+        changes = {}
+        states = {}
+        for d in dllist:
+            summary = d.network_get_state_summary()
+            states[d] = summary
+            last = laststates.get(d)
+            if last is None:
+                changes[d] = summary
+            else:
+                delta = {}
+                for key,value in summary.iteritems():
+                    if last[key] != value:
+                        delta[key] = value
+                if delta:
+                    changes[d] = delta
+        for d in laststates:
+            if d not in states:
+                # Removed
+                changes[d] = None
+
+        if not changes and lastwhen > 0.0:
+            # Nothing to report, look again as the user asked last time
+            self.set_download_state_changes_callback(usercallback,laststates,lastwhen)
+            return
+
+        def session_statechanges_usercallback_target():
+            try:
+                when = usercallback(changes)
+                if when > 0.0:
+                    self.set_download_state_changes_callback(usercallback,states,when)
+            except:
+                print_exc()
+        self.session.uch.perform_usercallback(session_statechanges_usercallback_target)
+
     #
     # Persistence methods
     #
@@ -984,6 +1078,27 @@ class TriblerLaunchMany(Thread):
 
     
         
+def singledownload_hashcheck_cmp(x,y):
+    """ Method that compares 2 SingleDownload objects for hash checking: VOD
+    Downloads first, as the user is waiting for them, then as 
+    singledownload_size_cmp.
+    """
+    if x is not None and y is not None:
+        if x.videoinfo is not None and y.videoinfo is None:
+            return -1
+        elif y.videoinfo is not None and x.videoinfo is None:
+            return 1
+    return singledownload_size_cmp(x,y)
+
+def get_hashcheck_disk(sd):
+    """ Returns the device the content of the SingleDownload is stored on,
+    or None if unknown.
+    """
+    try:
+        return os.stat(sd.get_bt1download().config['saveas']).st_dev
+    except:
+        return None
+
 def singledownload_size_cmp(x,y):
     """ Method that compares 2 SingleDownload objects based on their status
     (SEEDING Downloads first) and then size of the content of the BT1Download 
@@ -41,6 +41,7 @@ class SingleDownload:
         self.logmsgs = []
         self._hashcheckfunc = None
         self._getstatsfunc = None
+        self._getsummaryfunc = None
         self.infohash = infohash
         self.b64_infohash = b64encode(infohash)
         self.repexer = None
@@ -167,7 +168,7 @@ class SingleDownload:
             self._getstatsfunc = SPECIAL_VALUE # signal we're hashchecking
             # Already set, should be same
             self.lmhashcheckcompletecallback = complete_callback
-            self._hashcheckfunc(self.lmhashcheckcompletecallback)
+            self._hashcheckfunc(lambda success=True:self.lmhashcheckcompletecallback(self,success=success))
         except Exception,e:
             self.fatalerrorfunc(e)
             
@@ -182,6 +183,7 @@ class SingleDownload:
         try:
             self.dow.startEngine(vodeventfunc = self.lmvodeventcallback)
             self._getstatsfunc = self.dow.startStats() # not possible earlier
+            self._getsummaryfunc = self.dow.get_stats_summary
             
             # RePEX: don't start the Rerequester in RePEX mode
             repexer = self.repexer
@@ -254,6 +256,20 @@ class SingleDownload:
                 status = None
             return (status,self._getstatsfunc(getpeerlist=getpeerlist),logmsgs,coopdl_helpers,coopdl_coordinator)
 
+    def get_stats_summary(self):
+        """ Like get_stats() but returns only (status,stats) with the few
+        stats of DownloaderFeedback.gather_summary() """
+        if self._getstatsfunc is None:
+            return (DLSTATUS_WAITING4HASHCHECK,None)
+        elif self._getstatsfunc == SPECIAL_VALUE:
+            return (DLSTATUS_HASHCHECKING,{'frac':self.hashcheckfrac})
+        else:
+            if self.repexer is not None:
+                status = DLSTATUS_REPEXING
+            else:
+                status = None
+            return (status,self._getsummaryfunc())
+
     def get_infohash(self):
         return self.infohash
 
@@ -286,7 +302,7 @@ class SingleDownload:
         if self._getstatsfunc is None or self._getstatsfunc == SPECIAL_VALUE:
             # Hashchecking or waiting for while being shutdown, signal LaunchMany
             # so it can schedule a new one.
-            self.lmhashcheckcompletecallback(success=False)
+            self.lmhashcheckcompletecallback(self,success=False)
                 
         return resumedata
     
@@ -87,6 +87,7 @@ class UserCallbackHandler:
                 return
             
             dlpstatedir = os.path.join(self.sessconfig['state_dir'],STATEDIR_DLPSTATE_DIR)
+            resumeindexdir = os.path.join(self.sessconfig['state_dir'],STATEDIR_RESUMEINDEX_DIR)
         finally:
             self.sesslock.release()
 
@@ -110,6 +111,18 @@ class UserCallbackHandler:
             # Show must go on
             print_exc()
 
+        # Remove fast-resume index
+        try:
+            basename = hexinfohash+'.resume'
+            filename = os.path.join(resumeindexdir,basename)
+            if DEBUG:
+                print >>sys.stderr,"Session: sesscb_removestate: removing resume index",filename
+            if os.access(filename,os.F_OK):
+                os.remove(filename)
+        except:
+            # Show must go on
+            print_exc()
+
         # Remove downloaded content from disk
         if removecontent:
             if DEBUG:
@@ -2,6 +2,7 @@
 # see LICENSE.txt for license information
 
 from random import randrange, shuffle
+from heapq import nsmallest
 import sys
 
 from Tribler.Core.BitTornado.clock import clock
@@ -107,83 +108,74 @@ class Choker:
         if DEBUG:
             print >>sys.stderr,"choker: _rechoke: checkinternalbias",checkinternalbias
             
-        # 0. Construct candidate list
-        preferred = []
+        # 0. Take one snapshot of the interested, eligible connections and
+        # their rates, so each is asked only once per rechoke
+        done = self.done()
         maxuploads = self.config['max_uploads']
-        if maxuploads > 1:
-            
-            # 1. Get some regular candidates
-            for c in self.connections:
-
-                # g2g: unchoke some g2g peers later
-                if c.use_g2g:
-                    continue
+        interested = {}
+        preferred = []
+        g2g_preferred = []
+        for i in xrange(len(self.connections)):
+            c = self.connections[i]
+            u = c.get_upload()
+            if not u.is_interested():
+                continue
 
-                # SelectiveSeeding
-                if self.seeding_manager is None or self.seeding_manager.is_conn_eligible(c):
-                    u = c.get_upload()
-                    if not u.is_interested():
-                        continue
-                    
-                    if self.done():
-                        r = u.get_rate()
-                        #print >>sys.stderr,"choker: I am seed, candidate",c.get_ip(),r
-                    else:
-                        d = c.get_download()
-                        r = d.get_rate()
-                        #print >>sys.stderr,"choker: I am not seed, candidate",c.get_ip(),r
-                        if r < 1000 or d.is_snubbed():
-                            continue
-                       
-                       
-                    # NETWORK AWARENESS 
-                    if checkinternalbias and c.na_get_address_distance() == 0:
-                        r += checkinternalbias
-                        if DEBUG:
-                            print >>sys.stderr,"choker: _rechoke: BIASING",c.get_ip(),c.get_port()
+            # SelectiveSeeding
+            if self.seeding_manager is not None and not self.seeding_manager.is_conn_eligible(c):
+                continue
+            interested[c] = True
+            if maxuploads <= 1:
+                continue
 
-                    preferred.append((-r, c))
-                    
-            self.last_preferred = len(preferred)
-            preferred.sort()
-            del preferred[maxuploads-1:]
-            if DEBUG:
-                print >>sys.stderr,"choker: _rechoke: NORMAL UNCHOKE",[(x[0],x[1].get_ip()) for x in preferred]
-            preferred = [x[1] for x in preferred]
+            if c.use_g2g:
+                # 2. g2g candidates
+                r = c.g2g_score()
+                if checkinternalbias and c.na_get_address_distance() == 0:
+                    r[0] += checkinternalbias
+                    r[1] += checkinternalbias
+                    if DEBUG:
+                        print >>sys.stderr,"choker: _rechoke: G2G BIASING",c.get_ip(),c.get_port()
+                g2g_preferred.append((-r[0], -r[1], i, c))
+                continue
 
-            # 2. Get some g2g candidates 
-            g2g_preferred = []
-            for c in self.connections:
-                if not c.use_g2g:
+            # 1. Regular candidates
+            if done:
+                r = u.get_rate()
+                #print >>sys.stderr,"choker: I am seed, candidate",c.get_ip(),r
+            else:
+                d = c.get_download()
+                r = d.get_rate()
+                #print >>sys.stderr,"choker: I am not seed, candidate",c.get_ip(),r
+                if r < 1000 or d.is_snubbed():
                     continue
 
-                # SelectiveSeeding
-                if self.seeding_manager is None or self.seeding_manager.is_conn_eligible(c):
-
-                    u = c.get_upload()
-                    if not u.is_interested():
-                        continue
-    
-                    r = c.g2g_score()
-                    if checkinternalbias and c.na_get_address_distance() == 0:
-                        r[0] += checkinternalbias
-                        r[1] += checkinternalbias
-                        if DEBUG:
-                            print >>sys.stderr,"choker: _rechoke: G2G BIASING",c.get_ip(),c.get_port()
-                   
-                    g2g_preferred.append((-r[0], -r[1], c))
-                    
-            g2g_preferred.sort()
-            del g2g_preferred[maxuploads-1:]
-            if DEBUG:
-                print  >>sys.stderr,"choker: _rechoke: G2G UNCHOKE",[(x[0],x[1],x[2].get_ip()) for x in g2g_preferred]
-            g2g_preferred = [x[2] for x in g2g_preferred]
+            # NETWORK AWARENESS 
+            if checkinternalbias and c.na_get_address_distance() == 0:
+                r += checkinternalbias
+                if DEBUG:
+                    print >>sys.stderr,"choker: _rechoke: BIASING",c.get_ip(),c.get_port()
 
-            preferred += g2g_preferred
+            preferred.append((-r, i, c))
 
+        # Pick the fastest of each, ties go to the connection that comes 
+        # first in the round robin order
+        unchoked = {}
+        if maxuploads > 1:
+            self.last_preferred = len(preferred)
+            preferred = nsmallest(maxuploads-1, preferred)
+            if DEBUG:
+                print >>sys.stderr,"choker: _rechoke: NORMAL UNCHOKE",[(x[0],x[2].get_ip()) for x in preferred]
+            g2g_preferred = nsmallest(maxuploads-1, g2g_preferred)
+            if DEBUG:
+                print  >>sys.stderr,"choker: _rechoke: G2G UNCHOKE",[(x[0],x[1],x[3].get_ip()) for x in g2g_preferred]
+            for x in preferred:
+                unchoked[x[-1]] = True
+            for x in g2g_preferred:
+                unchoked[x[-1]] = True
 
         # 
-        count = len(preferred)
+        count = len(unchoked)
         hit = False
         to_unchoke = []
         
@@ -201,26 +193,28 @@ class Choker:
         # 4. Select from candidate lists, aux seeders always selected
         for c in self.connections:
             u = c.get_upload()
-            if c in preferred:
+            if c in unchoked:
                 to_unchoke.append(u)
             else:
                 if count < maxuploads or not hit:
-                    if self.seeding_manager is None or self.seeding_manager.is_conn_eligible(c):
-                        if u.is_interested():
-                            to_unchoke.append(u)
-                            count += 1
-                            if DEBUG and not hit: print  >>sys.stderr,"choker: OPTIMISTIC UNCHOKE",c.get_ip()
-                            hit = True
+                    if c in interested:
+                        to_unchoke.append(u)
+                        count += 1
+                        if DEBUG and not hit: print  >>sys.stderr,"choker: OPTIMISTIC UNCHOKE",c.get_ip()
+                        hit = True
                         
                 else:
                     if not c.connection.is_coordinator_con() and not c.connection.is_helper_con():
-                        u.choke()
+                        # Only touch connections whose state changes
+                        if not u.is_choked():
+                            u.choke()
                     elif u.is_choked():
                         to_unchoke.append(u)
 
         # 5. Unchoke selected candidates
         for u in to_unchoke:
-            u.unchoke()
+            if u.is_choked():
+                u.unchoke()
 
     # Arno: Njaal CS
     def add_connection(self, connection, p = None):
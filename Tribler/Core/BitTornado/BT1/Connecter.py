@@ -17,6 +17,8 @@ from Tribler.Core.BitTornado.clock import clock
 from Tribler.Core.BitTornado.bencode import bencode,bdecode
 from Tribler.Core.BitTornado.__init__ import version_short,decodePeerID,TRIBLER_PEERID_LETTER
 from Tribler.Core.BitTornado.BT1.convert import tobinary,toint
+from Tribler.Core.BitTornado.filesender import FileRegion, FilePiece
+from Tribler.Core.BitTornado.piecebuffer import MappedBuffer
 
 from Tribler.Core.BitTornado.BT1.MessageID import *
 from Tribler.Core.DecentralizedTracking.MagnetLink.__init__ import *
@@ -123,6 +125,7 @@ class Connection:
         self.next_upload = None
         self.outqueue = []
         self.partial_message = None
+        self.partial_length = 0
         self.download = None
         self.upload = None
         self.send_choke_queued = False
@@ -341,7 +344,10 @@ class Connection:
         if not self.can_send_to():
             return 0
         if self.partial_message is None:
-            s = self.upload.get_upload_chunk()
+            # sendfile: Merkle hashes and ECS encryption need the data itself
+            regions_ok = not (self.connecter.merkle_torrent or 
+                              (self.is_closed_swarm and self.connecter.cs_version == ENHANCED_CLOSED_SWARMS))
+            s = self.upload.get_upload_chunk(regions_ok)
             if s is None:
                 return 0
             # Merkle: send hashlist along with piece in HASHPIECE message
@@ -368,44 +374,74 @@ class Connection:
 
                     c.queue_g2g_piece_xfer( index, begin, piece )
 
+            # The message is kept as a list of parts so the piece payload is
+            # handed to the socket without being joined with its header.
             if self.connecter.merkle_torrent:
                 hashpiece_msg_id = self.his_extend_msg_name_to_id(EXTEND_MSG_HASHPIECE)
                 bhashlist = bencode(hashlist)
                 if hashpiece_msg_id is None:
                     # old Tribler <= 4.5.2 style
-                    self.partial_message = ''.join((
+                    header = ''.join((
                                     tobinary(1+4+4+4+len(bhashlist)+len(piece)), HASHPIECE,
-                                    tobinary(index), tobinary(begin), tobinary(len(bhashlist)), bhashlist, piece.tostring() ))
+                                    tobinary(index), tobinary(begin), tobinary(len(bhashlist)), bhashlist ))
                 else:
                     # Merkle BEP
-                    self.partial_message = ''.join((
+                    header = ''.join((
                                     tobinary(2+4+4+4+len(bhashlist)+len(piece)), EXTEND, hashpiece_msg_id,
-                                    tobinary(index), tobinary(begin), tobinary(len(bhashlist)), bhashlist, piece.tostring() ))
+                                    tobinary(index), tobinary(begin), tobinary(len(bhashlist)), bhashlist ))
                     
             else:
-                self.partial_message = ''.join((
+                header = ''.join((
                             tobinary(len(piece) + 9), PIECE, 
-                            tobinary(index), tobinary(begin), piece.tostring()))
+                            tobinary(index), tobinary(begin)))
+            if isinstance(piece, FilePiece):
+                self.partial_message = [header] + piece.regions
+            elif isinstance(piece, MappedBuffer):
+                # mmap: socket reads the data straight from the page cache
+                self.partial_message = [header, piece.getbuffer()]
+            else:
+                self.partial_message = [header, piece.tostring()]
+            self.partial_length = len(header) + len(piece)
             if DEBUG_NORMAL_MSGS:
                 print >>sys.stderr,'sending chunk: '+str(index)+': '+str(begin)+'-'+str(begin+len(piece))
 
-        if bytes < len(self.partial_message):
-            self.connection.send_message_raw(self.partial_message[:bytes])
-            self.partial_message = self.partial_message[bytes:]
+        if bytes < self.partial_length:
+            q = []
+            left = bytes
+            while left > 0:
+                part = self.partial_message[0]
+                if len(part) <= left:
+                    q.append(part)
+                    left -= len(part)
+                    del self.partial_message[0]
+                elif isinstance(part, FileRegion):
+                    head, self.partial_message[0] = part.split(left)
+                    q.append(head)
+                    left = 0
+                else:
+                    # buffer() slices share memory with the original string
+                    q.append(buffer(part, 0, left))
+                    self.partial_message[0] = buffer(part, left)
+                    left = 0
+            self.partial_length -= bytes
+            self.connection.send_messages_raw(q)
             return bytes
 
-        q = [self.partial_message]
+        q = self.partial_message
+        sent = self.partial_length
         self.partial_message = None
+        self.partial_length = 0
         if self.send_choke_queued:
             self.send_choke_queued = False
             self.outqueue.append(tobinary(1)+CHOKE)
             self.upload.choke_sent()
             self.just_unchoked = 0
+        for m in self.outqueue:
+            sent += len(m)
         q.extend(self.outqueue)
         self.outqueue = []
-        q = ''.join(q)
-        self.connection.send_message_raw(q)
-        return len(q)
+        self.connection.send_messages_raw(q)
+        return sent
 
     def get_upload(self):
         return self.upload
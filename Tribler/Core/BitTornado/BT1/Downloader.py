@@ -583,7 +583,7 @@ class SingleDownload(SingleDownloadHelperInterface):
         #
         # Aggregate the haves bitfields and send them to the coordinator
         # If I am a coordinator, i will exit shortly
-        self.downloader.aggregate_and_send_haves()
+        self.downloader.aggregate_have(index)
         #
         # _ProxyService
         
@@ -667,27 +667,22 @@ class SingleDownload(SingleDownloadHelperInterface):
                     print >>sys.stderr,"Downloader: got_have_field: live or normal filter"
                 # Transfer HAVE knowledge to PiecePicker and filter pieces if live
                 validhave = Bitfield(self.downloader.numpieces)
+                pieces = []
                 for iterator in activerangeiterators:
                     for i in iterator:
                         if have[i]:
                             validhave[i] = True
-                            self.downloader.picker.got_have(i,self.connection)
+                            pieces.append(i)
+                self.downloader.picker.got_haves(pieces,self.connection)
             else: # VOD
                 if DEBUGBF:
                     print >>sys.stderr,"Downloader: got_have_field: VOD filter" 
                 validhave = Bitfield(self.downloader.numpieces)
                 (first,last) = self.downloader.picker.videostatus.download_range()
-                for i in xrange(first,last):
-                    if have[i]:
-                        validhave[i] = True
-                        self.downloader.picker.got_have(i,self.connection)
-            # ProxyService_
-            #
-            # Aggregate the haves bitfields and send them to the coordinator
-            # ARNOPS: Shouldn't this be done after have = validhave?
-            self.downloader.aggregate_and_send_haves()
-            #
-            # _ProxyService
+                pieces = have.get_true_pieces(first,last)
+                for i in pieces:
+                    validhave[i] = True
+                self.downloader.picker.got_haves(pieces,self.connection)
 
             """
             # SANITY CHECK
@@ -711,6 +706,13 @@ class SingleDownload(SingleDownloadHelperInterface):
         self.have = have
         
         #print >>sys.stderr,"Downloader: got_have_bitfield: valid",`have.toboollist()`
+
+        # ProxyService_
+        #
+        # Aggregate the haves bitfields and send them to the coordinator
+        self.downloader.aggregate_bitfield(have)
+        #
+        # _ProxyService
                     
         if self.downloader.endgamemode and not self.downloader.paused:
             for piece, begin, length in self.downloader.all_requests:
@@ -770,6 +772,9 @@ class Downloader:
         self.endgame_queued_pieces = []
         self.all_requests = []
         self.discarded = 0L
+        # ProxyService: haves of all connections ORed together, as returned
+        # by Bitfield.tolong(), or None if they must be aggregated again
+        self.aggregated_haves = None
         self.download_rate = 0
 #        self.download_rate = 25000  # 25K/s test rate
         self.bytes_requested = 0
@@ -895,6 +900,7 @@ class Downloader:
             pass
         
         self.downloads.remove(download)
+        self.aggregated_haves = None
         if self.endgamemode and not self.downloads: # all peers gone
             self._reset_endgame()
 
@@ -1135,65 +1141,43 @@ class Downloader:
         #print >>sys.stderr,"Downloader: live_invalidate",piece
         for d in self.downloads:
             d.have[piece] = False
+        self.aggregated_haves = None
         # STBSPEED: If I have no pieces yet, no need to loop to invalidate them.
         if not mevirgin:
             self.storage.live_invalidate(piece)
         
     def live_invalidate_ranges(self,toinvalidateranges,toinvalidateset):
-        """ STBPEED: Faster version of live_invalidate that copies have arrays
-        rather than iterate over them for clearing
+        """ STBPEED: Faster version of live_invalidate that clears ranges in
+        the have arrays rather than iterate over them
         """
-        if len(toinvalidateranges) == 1:
-            (s,e) = toinvalidateranges[0]
-            emptyrange = [False for piece in xrange(s,e+1)]
-            assert len(emptyrange) == e+1-s
-            
-            for d in self.downloads:
-                newhave = d.have[0:s] + emptyrange + d.have[e+1:]
-
-                #oldhave = d.have
-                d.have = Bitfield(length=len(newhave),fromarray=newhave)
-                #assert oldhave.tostring() == d.have.tostring()
-                """
-                for piece in toinvalidateset:
-                    d.have[piece] = False
-                print >>sys.stderr,"d len",len(d.have)
-                print >>sys.stderr,"new len",len(newhave)
-                    
-                for i in xrange(0,len(newhave)):
-                    if d.have[i] != newhave[i]:
-                        print >>sys.stderr,"newhave diff",i
-                        assert False
-                """
-                
-        else:
-            (s1,e1) = toinvalidateranges[0]
-            (s2,e2) = toinvalidateranges[1]
-            emptyrange1 = [False for piece in xrange(s1,e1+1)]
-            emptyrange2 = [False for piece in xrange(s2,e2+1)]
-            
-            assert len(emptyrange1) == e1+1-s1
-            assert len(emptyrange2) == e2+1-s2
-            
-            for d in self.downloads:
-                newhave = emptyrange1 + d.have[e1+1:s2] + emptyrange2
-                
-                #oldhave = d.have
-                d.have = Bitfield(length=len(newhave),fromarray=newhave)
-                #assert oldhave.tostring() == d.have.tostring()
-                """
-                for piece in toinvalidateset:
-                    d.have[piece] = False
-                print >>sys.stderr,"d len",len(d.have)
-                print >>sys.stderr,"new len",len(newhave)
-                for i in xrange(0,len(newhave)):
-                    if d.have[i] != newhave[i]:
-                        print >>sys.stderr,"newhave diff",i
-                        assert False
-                """
+        for d in self.downloads:
+            for (s,e) in toinvalidateranges:
+                d.have.clear_range(s,e+1)
+        self.aggregated_haves = None
                 
     # ProxyService_
     #
+    def aggregate_have(self, index):
+        """ Adds a HAVE received on a connection to the aggregated haves and
+        sends them if this is a new piece
+        """
+        if self.picker.helper:
+            if self.aggregated_haves is not None:
+                bit = 1L << (self.numpieces-1-index)
+                if self.aggregated_haves & bit:
+                    return
+                self.aggregated_haves |= bit
+            self.aggregate_and_send_haves()
+
+    def aggregate_bitfield(self, have):
+        """ Adds a BITFIELD received on a connection to the aggregated haves
+        and sends them
+        """
+        if self.picker.helper:
+            if self.aggregated_haves is not None:
+                self.aggregated_haves |= have.tolong()
+            self.aggregate_and_send_haves()
+
     def aggregate_and_send_haves(self):
         """ Aggregates the information from the haves bitfields for all the active connections,
         then calls the helper class to send the aggregated information as a PROXY_HAVE message 
@@ -1203,20 +1187,13 @@ class Downloader:
             if DEBUG:
                 print >> sys.stderr,"Downloader: aggregate_and_send_haves: helper None or helper conn"
             
-            # haves_vector is a matrix, having on each line a Bitfield
-            haves_vector = [None] * len(self.downloads)
-            for i in range(0, len(self.downloads)):
-                haves_vector[i] = self.downloads[i].have
-            
-            #Calculate the aggregated haves
-            aggregated_haves = Bitfield(self.numpieces)
-            for piece in range (0, self.numpieces):
-                aggregated_value = False
-                # For every column in the haves_vector matrix
-                for d in range(0, len(self.downloads)):
-                    # For every active connection
-                    aggregated_value = aggregated_value or haves_vector[d][piece] # Logical OR operation 
-                aggregated_haves[piece] = aggregated_value
+            if self.aggregated_haves is None:
+                # Logical OR of the haves bitfields of all active connections
+                aggregated = 0L
+                for d in self.downloads:
+                    aggregated |= d.have.tolong()
+                self.aggregated_haves = aggregated
+            aggregated_haves = Bitfield(self.numpieces, fromlong = self.aggregated_haves)
             
             self.picker.helper.send_proxy_have(aggregated_haves)
     #
@@ -196,6 +196,28 @@ class DownloaderFeedback:
         return s        
 
 
+    def gather_summary(self):
+        """ Called by SingleDownload to obtain the statistics that are 
+        reported as state changes, see Session.set_download_state_changes_callback().
+        Unlike gather() this is O(1). """
+        statistics = self.statistics
+        numseeds = statistics.picker.seeds_connected
+        s = {}
+        s['numpeers'] = len(statistics.downloader.downloads) + statistics.ghttpdl.seedsfound + statistics.hhttpdl.seedsfound
+        s['numnonseeds'] = len(statistics.downloader.downloads) - numseeds
+        s['up'] = self.upfunc()
+        if self.finflag.isSet():
+            s['down'] = 0.0
+            s['frac'] = 1.0
+            return s
+        s['down'] = self.downfunc()
+        obtained, desired, have = self.leftfunc()
+        if desired > 0:
+            s['frac'] = float(obtained)/desired
+        else:
+            s['frac'] = 1.0
+        return s
+
     def display(self, displayfunc):
         if not self.doneprocessing.isSet():
             return
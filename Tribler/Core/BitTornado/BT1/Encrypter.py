@@ -3,7 +3,6 @@
 
 import sys
 from base64 import b64encode
-from cStringIO import StringIO
 from binascii import b2a_hex
 from socket import error as socketerror
 from urllib import quote
@@ -134,7 +133,9 @@ class Connection:
         self.complete = False
         self.keepalive = lambda: None
         self.closed = False
-        self.buffer = StringIO()
+        # Start of a partially received message, as a list of strings
+        self.buffer = []
+        self.buffered = 0
 # overlay        
         self.dns = dns
         self.support_extend_messages = False
@@ -389,20 +390,35 @@ class Connection:
         if not self.closed:
             self.connection.write(message)    # SingleSocket
 
+    def send_messages_raw(self, messages):
+        """ Send a list of strings or buffers as a single write """
+        if not self.closed:
+            self.connection.writev(messages)    # SingleSocket
+
     def data_came_in(self, connection, s):
         self.Encoder.measurefunc(len(s))
+        # Walk s with an offset rather than reslicing it after each message,
+        # so each byte is copied once (when the message is sliced out), or
+        # twice if the message spans more than one read.
+        pos = 0
+        n = len(s)
         while 1:
             if self.closed:
                 return
-            i = self.next_len - self.buffer.tell()
-            if i > len(s):
-                self.buffer.write(s)
+            i = self.next_len - self.buffered
+            if pos + i > n:
+                if pos < n:
+                    self.buffer.append(s[pos:])
+                    self.buffered += n - pos
                 return
-            self.buffer.write(s[:i])
-            s = s[i:]
-            m = self.buffer.getvalue()
-            self.buffer.reset()
-            self.buffer.truncate()
+            if self.buffered:
+                self.buffer.append(s[pos:pos+i])
+                m = ''.join(self.buffer)
+                self.buffer = []
+                self.buffered = 0
+            else:
+                m = s[pos:pos+i]
+            pos += i
             try:
                 x = self.next_func(m)
             except:
@@ -0,0 +1,145 @@
+# see LICENSE.txt for license information
+#
+# Multi-threaded initial hash check for StorageWrapper. Worker threads read
+# runs of consecutive pieces with large sequential reads through their own
+# file handles and hash them (hashlib releases the GIL while hashing and the
+# reads release it while waiting for the disk). The results are collected by
+# StorageWrapper.hashcheckfunc on the network thread, which does all the
+# bookkeeping, so no StorageWrapper state is touched from the workers.
+
+from threading import Thread, Event
+from Queue import Queue, Empty
+from traceback import print_exc
+
+from Tribler.Core.Utilities.Crypto import sha
+
+DEBUG = False
+
+# Amount of consecutive data a worker reads and hashes in one go
+HASHCHECK_RUN_SIZE = 4 * 1048576
+HASHCHECK_READ_SIZE = 1048576
+# Per worker
+HASHCHECK_MAX_FILES_OPEN = 10
+
+
+class HashChecker:
+    def __init__(self, storage, piece_size, piecelenfunc, lastlen, numworkers, flag):
+        """
+        @param storage  The Storage holding the data.
+        @param piecelenfunc  Function returning the length of a piece.
+        @param lastlen  Length of the last piece. For each piece the hash of
+        its first lastlen bytes is reported as well, for detecting an
+        out-of-place last piece.
+        @param flag  The download's doneflag, workers stop when it is set.
+        """
+        self.storage = storage
+        self.piece_size = piece_size
+        self.piecelenfunc = piecelenfunc
+        self.lastlen = lastlen
+        self.numworkers = max(1, numworkers)
+        self.jobs = Queue()
+        self.results = Queue()
+        self.flag = flag
+        self.stopped = Event()
+        self.threads = []
+
+    def start(self, pieces):
+        """ Start checking the given pieces. Pieces are handed out to the
+        workers in runs of consecutive pieces. """
+        run = []
+        runlen = 0
+        for i in pieces:
+            if run and (i != run[-1] + 1 or runlen >= HASHCHECK_RUN_SIZE):
+                self.jobs.put(run)
+                run = []
+                runlen = 0
+            run.append(i)
+            runlen += self.piecelenfunc(i)
+        if run:
+            self.jobs.put(run)
+
+        for n in xrange(self.numworkers):
+            t = Thread(target = self._worker, name = "HashChecker"+str(n))
+            t.setDaemon(True)
+            self.threads.append(t)
+            t.start()
+
+    def shutdown(self):
+        self.stopped.set()
+
+    def get_results(self):
+        """ Returns a list of (piece, sp, s) tuples for the pieces checked
+        since the last call, where s is the SHA1 of the piece and sp the SHA1
+        of its first lastlen bytes. s is None when reading the piece failed.
+        Called by the network thread. """
+        r = []
+        while True:
+            try:
+                r.append(self.results.get_nowait())
+            except Empty:
+                return r
+
+    def _is_stopped(self):
+        return self.stopped.isSet() or self.flag.isSet()
+
+    def _worker(self):
+        handles = {}
+        try:
+            while not self._is_stopped():
+                try:
+                    run = self.jobs.get_nowait()
+                except Empty:
+                    break
+                self._check_run(run, handles)
+        finally:
+            for h in handles.itervalues():
+                try:
+                    h.close()
+                except:
+                    pass
+
+    def _check_run(self, run, handles):
+        pos = self.piece_size * run[0]
+        length = 0
+        for i in run:
+            length += self.piecelenfunc(i)
+        try:
+            data = self._read(pos, length, handles)
+        except (IOError, OSError):
+            if DEBUG:
+                print_exc()
+            for i in run:
+                self.results.put((i, None, None))
+            return
+
+        offset = 0
+        for i in run:
+            piecelen = self.piecelenfunc(i)
+            sh = sha(buffer(data, offset, self.lastlen))
+            sp = sh.digest()
+            sh.update(buffer(data, offset + self.lastlen, piecelen - self.lastlen))
+            self.results.put((i, sp, sh.digest()))
+            offset += piecelen
+
+    def _read(self, pos, amount, handles):
+        r = []
+        for file, begin, end in self.storage._intervals(pos, amount):
+            h = handles.get(file)
+            if h is None:
+                if len(handles) >= HASHCHECK_MAX_FILES_OPEN:
+                    for old in handles.values():
+                        old.close()
+                    handles.clear()
+                h = open(file, 'rb')
+                handles[file] = h
+            h.seek(begin)
+            while begin < end:
+                length = min(end - begin, HASHCHECK_READ_SIZE)
+                data = h.read(length)
+                if len(data) != length:
+                    raise IOError('error reading data from '+ file)
+                r.append(data)
+                begin += length
+        if len(r) == 1:
+            return r[0]
+        return ''.join(r)
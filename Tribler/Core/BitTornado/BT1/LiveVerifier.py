@@ -0,0 +1,63 @@
+# see LICENSE.txt for license information
+#
+# Checks the signatures of live pieces for StorageWrapper on worker threads,
+# so the network thread doesn't stall on SHA-1 and public key operations
+# (hashlib releases the GIL while hashing). The result of each check is
+# handed back through the rawserver's add_task, so StorageWrapper does all
+# bookkeeping on the network thread, as for the HashChecker.
+
+from threading import Thread, Lock
+from traceback import print_exc
+
+DEBUG = False
+
+
+class LiveVerifier:
+    def __init__(self, checkfunc, numworkers, schedulefunc, flag):
+        """
+        @param checkfunc  Function(data, index) returning True when the
+        signature of the piece is correct. Called on the worker threads.
+        @param schedulefunc  The rawserver's add_task, which may be called
+        from other threads.
+        @param flag  The download's doneflag, workers stop when it is set.
+        """
+        self.checkfunc = checkfunc
+        self.numworkers = max(1, numworkers)
+        self.schedulefunc = schedulefunc
+        self.flag = flag
+        self.jobs = []
+        self.lock = Lock()
+        self.running = 0
+
+    def verify(self, index, data, callback):
+        """ Check piece index. callback(index, data, ok) is called on the
+        network thread when done. Workers are started as needed and exit when there
+        is nothing left to check. """
+        self.lock.acquire()
+        try:
+            self.jobs.append((index, data, callback))
+            if self.running < self.numworkers:
+                self.running += 1
+                t = Thread(target = self._worker, name = "LiveVerifier"+str(self.running))
+                t.setDaemon(True)
+                t.start()
+        finally:
+            self.lock.release()
+
+    def _worker(self):
+        while True:
+            self.lock.acquire()
+            try:
+                if not self.jobs or self.flag.isSet():
+                    self.running -= 1
+                    return
+                index, data, callback = self.jobs.pop(0)
+            finally:
+                self.lock.release()
+            try:
+                ok = self.checkfunc(data, index)
+            except:
+                if DEBUG:
+                    print_exc()
+                ok = False
+            self.schedulefunc(lambda index=index, data=data, ok=ok, callback=callback: callback(index, data, ok))
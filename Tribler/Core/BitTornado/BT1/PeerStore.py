@@ -0,0 +1,91 @@
+# see LICENSE.txt for license information
+#
+# Compact peer list of a swarm for the tracker
+#
+from random import randrange
+
+class CompactPeerStore:
+    """ Keeps the compact (6-byte IPv4 address and port) entries of the peers
+    in a swarm in one buffer, in random order, such that an announce can be
+    answered with a random selection of peers by taking a slice of it.
+
+    Used by the Tracker instead of a dictionary that maps peer id to compact
+    entry, so it supports the dictionary operations the Tracker uses.
+    Adding and removing a peer takes O(1) time.
+    """
+    def __init__(self):
+        self.buf = bytearray()
+        self.peerids = []   # peer id of each entry in buf
+        self.slots = {}     # peer id -> index of its entry in buf
+        self.other = {}     # peer id -> entry not 6 bytes, e.g. a DNS name
+
+    def __len__(self):
+        return len(self.peerids) + len(self.other)
+
+    def has_key(self, peerid):
+        return peerid in self.slots or peerid in self.other
+
+    __contains__ = has_key
+
+    def values(self):
+        buf = self.buf
+        return [str(buf[i:i+6]) for i in xrange(0,len(buf),6)] + self.other.values()
+
+    def __getitem__(self, peerid):
+        i = self.slots.get(peerid)
+        if i is None:
+            return self.other[peerid]
+        return str(self.buf[i*6:i*6+6])
+
+    def __setitem__(self, peerid, entry):
+        if self.has_key(peerid):
+            del self[peerid]
+        if len(entry) != 6:
+            self.other[peerid] = entry
+            return
+
+        # Insert at a random position by swapping with the entry there,
+        # which keeps the order of the entries random.
+        n = len(self.peerids)
+        j = randrange(n+1)
+        if j == n:
+            self.buf += entry
+            self.peerids.append(peerid)
+        else:
+            self.buf += self.buf[j*6:j*6+6]
+            self.buf[j*6:j*6+6] = entry
+            moved = self.peerids[j]
+            self.peerids[j] = peerid
+            self.peerids.append(moved)
+            self.slots[moved] = n
+        self.slots[peerid] = j
+
+    def __delitem__(self, peerid):
+        i = self.slots.pop(peerid, None)
+        if i is None:
+            del self.other[peerid]
+            return
+
+        # Move last entry into the freed slot
+        last = len(self.peerids)-1
+        if i != last:
+            self.buf[i*6:i*6+6] = self.buf[last*6:]
+            moved = self.peerids[last]
+            self.peerids[i] = moved
+            self.slots[moved] = i
+        del self.buf[last*6:]
+        del self.peerids[last]
+
+    def sample(self, n):
+        """ Returns the compact entries of at most n peers, starting at a
+        random position, as a string. """
+        count = len(self.peerids)
+        if n >= count:
+            return str(self.buf)
+        if n <= 0:
+            return ''
+        start = randrange(count)
+        end = start+n
+        if end <= count:
+            return str(self.buf[start*6:end*6])
+        return str(self.buf[start*6:]) + str(self.buf[:(end-count)*6])
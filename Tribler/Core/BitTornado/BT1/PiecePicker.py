@@ -1,7 +1,7 @@
 # Written by Bram Cohen and Pawel Garbacki, George Milescu
 # see LICENSE.txt for license information
 
-from random import randrange, shuffle
+from random import randrange, shuffle, random
 from Tribler.Core.BitTornado.clock import clock
 # 2fastbt_
 from traceback import extract_tb,print_stack
@@ -175,6 +175,62 @@ class PiecePicker:
         self._shift_over(piece, self.interests[numint], self.interests[numint + 1])
         return False
 
+    def got_haves(self, pieces, connection = None):
+        """ A peer reports to have the given pieces, e.g. in a BITFIELD 
+        message. Same as calling got_have() for each piece, but cheaper. """
+        if self.superseed or self.done:
+            for piece in pieces:
+                PiecePicker.got_have(self, piece, connection)
+            return
+
+        numhaves = self.numhaves
+        has = self.has
+        priority = self.priority
+        crosscount = self.crosscount
+        crosscount2 = self.crosscount2
+        interests = self.interests
+        level_in_interests = self.level_in_interests
+        parray = self.pos_in_interests
+        self.totalcount += len(pieces)
+        for piece in pieces:
+            numint = numhaves[piece]
+            numhaves[piece] = numint + 1
+            crosscount[numint] -= 1
+            if numint+1 == len(crosscount):
+                crosscount.append(0)
+            crosscount[numint+1] += 1
+            numintplus = numint+has[piece]
+            crosscount2[numintplus] -= 1
+            if numintplus+1 == len(crosscount2):
+                crosscount2.append(0)
+            crosscount2[numintplus+1] += 1
+            numint = level_in_interests[piece]
+            level_in_interests[piece] = numint + 1
+            if has[piece] or priority[piece] == -1:
+                continue
+            if numint == len(interests) - 1:
+                interests.append([])
+
+            # Inlined _shift_over(piece, interests[numint], interests[numint+1])
+            l1 = interests[numint]
+            p = parray[piece]
+            q = l1[-1]
+            l1[p] = q
+            parray[q] = p
+            del l1[-1]
+            l2 = interests[numint+1]
+            n = len(l2)
+            newp = int(random() * (n+1))
+            if newp == n:
+                parray[piece] = n
+                l2.append(piece)
+            else:
+                old = l2[newp]
+                parray[old] = n
+                l2.append(old)
+                l2[newp] = piece
+                parray[piece] = newp
+
     # ProxyService_
     #
     def redirect_haves_to_coordinator(self, connection = None, helper_con = False, piece = None):
@@ -225,6 +281,56 @@ class PiecePicker:
             return
         self._shift_over(piece, self.interests[numint], self.interests[numint - 1])
 
+    def lost_haves(self, pieces):
+        """ We lost a peer owning the given pieces. Same as calling 
+        lost_have() for each piece, but cheaper. """
+        if self.superseed or self.done:
+            for piece in pieces:
+                PiecePicker.lost_have(self, piece)
+            return
+
+        numhaves = self.numhaves
+        has = self.has
+        priority = self.priority
+        crosscount = self.crosscount
+        crosscount2 = self.crosscount2
+        interests = self.interests
+        level_in_interests = self.level_in_interests
+        parray = self.pos_in_interests
+        self.totalcount -= len(pieces)
+        for piece in pieces:
+            numint = numhaves[piece]
+            numhaves[piece] = numint - 1
+            crosscount[numint] -= 1
+            crosscount[numint-1] += 1
+            numintplus = numint+has[piece]
+            crosscount2[numintplus] -= 1
+            crosscount2[numintplus-1] += 1
+            numint = level_in_interests[piece]
+            level_in_interests[piece] = numint - 1
+            if has[piece] or priority[piece] == -1:
+                continue
+
+            # Inlined _shift_over(piece, interests[numint], interests[numint-1])
+            l1 = interests[numint]
+            p = parray[piece]
+            q = l1[-1]
+            l1[p] = q
+            parray[q] = p
+            del l1[-1]
+            l2 = interests[numint-1]
+            n = len(l2)
+            newp = int(random() * (n+1))
+            if newp == n:
+                parray[piece] = n
+                l2.append(piece)
+            else:
+                old = l2[newp]
+                parray[old] = n
+                l2.append(old)
+                l2[newp] = piece
+                parray[piece] = newp
+
 
     # Arno: LIVEWRAP
     def is_valid_piece(self, piece):
@@ -302,8 +408,8 @@ class PiecePicker:
         parray[q] = p
         del l1[-1]
 
-        # add piece to a random place in l2
-        newp = randrange(len(l2)+1)
+        # add piece to a random place in l2 (cheaper than randrange)
+        newp = int(random() * (len(l2)+1))
         if newp == len(l2):
             parray[piece] = len(l2)
             l2.append(piece)
@@ -754,9 +860,7 @@ class PiecePicker:
             self.lost_seed()
         else:
             has = connection.download.have
-            for i in xrange(0, self.numpieces):
-                if has[i]:
-                    self.lost_have(i)
+            self.lost_haves([i for i in xrange(0, self.numpieces) if has[i]])
 
         if connection in self.seed_connections:
             del self.seed_connections[connection]
@@ -86,7 +86,7 @@ class Rerequester:
             connect, externalsched, amount_left, up, down, 
             port, ip, myid, infohash, timeout, errorfunc, excfunc, 
             maxpeers, doneflag, upratefunc, downratefunc, 
-            unpauseflag = fakeflag(True), config=None):
+            unpauseflag = fakeflag(True), config=None, trackerclient=None):
 
         self.excfunc = excfunc
         newtrackerlist = []        
@@ -136,6 +136,7 @@ class Rerequester:
         self.dht = mainlineDHT.dht
         self.config = config
         self.notifiers = [] # Diego : warn who is interested about peers returned (only) by tracker
+        self.trackerclient = trackerclient # HTTPTrackerClient or None to use threads
 
 
     def start(self):
@@ -255,6 +256,9 @@ class Rerequester:
             self.sched(retry, 5)         # retry in 5 seconds
             return
         self.lock.reset()
+        if self.trackerclient is not None and self.can_rerequest_async():
+            self._rerequest_async(s, callback)
+            return
         rq = Thread(target = self._rerequest, args = [s, callback])
         rq.setName( "TrackerRerequestA"+rq.getName() )
         # Arno: make this a daemon thread so the client closes sooner.
@@ -267,16 +271,7 @@ class Rerequester:
                 self._fail(callback)
             if self.ip:
                 try:
-                    # IPVSIX
-                    if ':' in self.ip:
-                        # TODO: support for ipv4= field
-                        urlip = "["+self.ip+"]" # URL encoding for IPv6, see RFC3986
-                        field = "ipv6"
-                    else:
-                        urlip = self.ip
-                        field = "ip"
-                        
-                    s += '&' + field + '=' + urlip  
+                    s += self.get_ip_param()
                 except:
                     self.errorcodes['troublecode'] = 'unable to resolve: '+self.ip
                     self.externalsched(fail)
@@ -315,6 +310,95 @@ class Rerequester:
             self.exception(callback)
 
 
+    def get_ip_param(self):
+        # IPVSIX
+        if ':' in self.ip:
+            # TODO: support for ipv4= field
+            urlip = "["+self.ip+"]" # URL encoding for IPv6, see RFC3986
+            field = "ipv6"
+        else:
+            urlip = self.ip
+            field = "ip"
+        return '&' + field + '=' + urlip
+
+    def can_rerequest_async(self):
+        if self.special is not None:
+            return self.trackerclient.can_handle(self.special)
+        for tier in self.trackerlist:
+            for tracker in tier:
+                if not tracker.startswith('udp:') and not self.trackerclient.can_handle(tracker):
+                    return False
+        return True
+
+    def _rerequest_async(self, s, callback):
+        """ Event-driven version of _rerequest() using the HTTPTrackerClient.
+        Called by network thread """
+        try:
+            if self.ip:
+                s += self.get_ip_param()
+            self.errorcodes = {}
+            if self.special is None:
+
+                #Do dht request
+                if self.dht:
+                    self._dht_rerequest()
+                elif DEBUG_DHT:
+                    print >>sys.stderr,"Rerequester: No DHT support loaded"
+
+                trackers = []
+                for t in range(len(self.trackerlist)):
+                    for tr in range(len(self.trackerlist[t])):
+                        tracker = self.trackerlist[t][tr]
+                        # Arno: no udp support yet
+                        if not tracker.startswith( 'udp:' ):
+                            trackers.append((t,tr,tracker))
+            else:
+                trackers = [(None,None,self.special)]
+                self.special = None
+            self._rerequest_next(trackers, s, callback)
+        except:
+            self.exception(callback)
+
+    def _rerequest_next(self, trackers, s, callback):
+        """ Announce to the next tracker in the list """
+        if not trackers:
+            # no success from any tracker
+            self._fail(callback)
+            return
+        (t,tr,tracker) = trackers.pop(0)
+        if DEBUG:
+            print >>sys.stderr,"Rerequest tracker:"
+            print >>sys.stderr,merge_announce(tracker, s+get_key(tracker))
+        def done(data, err):
+            done_lambda = lambda:self._rerequest_async_done(trackers, t, tr, tracker, s, callback, data, err)
+            self.externalsched(done_lambda)
+        self.trackerclient.get(merge_announce(tracker, s+get_key(tracker)), done, self.timeout)
+
+    def _rerequest_async_done(self, trackers, t, tr, tracker, s, callback, data, err):
+        try:
+            (r,code,msg) = self.decode_response(data, err)
+            if r is None:
+                self.errorcodes[code] = msg
+                if not self.last_failed and self.lastsuccessful == tracker:
+                    # See rerequest_single()
+                    self.last_failed = True
+                    self.lock.give_up()
+                    callback()
+                else:
+                    self._rerequest_next(trackers, s, callback)
+                return
+            
+            self.lock.succeed()
+            self.lastsuccessful = tracker
+            self.last_failed = False
+            self.never_succeeded = False
+            if t is not None and tr != 0:
+                del self.trackerlist[t][tr]
+                self.trackerlist[t] = [tracker] + self.trackerlist[t]
+            self.postrequest(r, callback, self.notifiers)
+        except:
+            self.exception(callback)
+
     def _fail(self, callback):
         if ( (self.upratefunc() < 100 and self.downratefunc() < 100)
              or not self.amount_left() ):
@@ -393,37 +477,11 @@ class Rerequester:
                 h.close()
             except:
                 pass
-            if err:        
-                if self.lock.trip(l):
-                    self.errorcodes['troublecode'] = err
-                    self.lock.unwait(l)
-                return
 
-            if not data:
+            (r,code,msg) = self.decode_response(data, err)
+            if r is None:
                 if self.lock.trip(l):
-                    self.errorcodes['troublecode'] = 'no data from tracker'
-                    self.lock.unwait(l)
-                return
-            
-            try:
-                r = bdecode(data, sloppy=1)
-                if DEBUG:
-                    print >>sys.stderr,"Rerequester: Tracker returns:", r
-                check_peers(r)
-                
-                #print >>sys.stderr,"Rerequester: Tracker returns, post check done"
-                
-            except ValueError, e:
-                if DEBUG:
-                    print_exc()
-                if self.lock.trip(l):
-                    self.errorcodes['bad_data'] = 'bad data from tracker - ' + str(e)
-                    self.lock.unwait(l)
-                return
-            
-            if r.has_key('failure reason'):
-                if self.lock.trip(l):
-                    self.errorcodes['rejected'] = self.rejectedmessage + r['failure reason']
+                    self.errorcodes[code] = msg
                     self.lock.unwait(l)
                 return
                 
@@ -445,6 +503,26 @@ class Rerequester:
             
             self.exception(callback)
 
+    def decode_response(self, data, err):
+        """ Returns (response,None,None) for a valid tracker response or
+        (None,errorcode,message) """
+        if err:
+            return (None,'troublecode',err)
+        if not data:
+            return (None,'troublecode','no data from tracker')
+        try:
+            r = bdecode(data, sloppy=1)
+            if DEBUG:
+                print >>sys.stderr,"Rerequester: Tracker returns:", r
+            check_peers(r)
+        except ValueError, e:
+            if DEBUG:
+                print_exc()
+            return (None,'bad_data','bad data from tracker - ' + str(e))
+        if r.has_key('failure reason'):
+            return (None,'rejected',self.rejectedmessage + r['failure reason'])
+        return (r,None,None)
+
     def _dht_rerequest(self):
         if DEBUG_DHT:
             print >>sys.stderr,"Rerequester: _dht_rerequest",`self.infohash`
@@ -618,6 +696,12 @@ class SuccessLock:
         finally:
             self.lock.release()
 
+    def succeed(self):
+        self.lock.acquire()
+        self.success = True
+        self.finished = True
+        self.lock.release()
+
     def give_up(self):
         self.lock.acquire()
         self.success = False
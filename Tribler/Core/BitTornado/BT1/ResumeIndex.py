@@ -0,0 +1,172 @@
+# see LICENSE.txt for license information
+#
+# Per-download fast-resume index. Unlike the engineresumedata in the
+# download checkpoint, which is only written by Session.checkpoint(), the
+# index is updated on disk as pieces complete, so a restart after a crash or
+# lost checkpoint doesn't have to hash check all content again.
+#
+# File layout:
+#
+#    MAGIC
+#    4 bytes   number of pieces
+#    4 bytes   number of files
+#    4 bytes   length of the header
+#    header    bencoded dict with the 'priority' and 'partial files' lists,
+#              as in FileSelector.pickle() and Storage.pickle()
+#    8+8 bytes size and mtime for each file, size -1 if not in use
+#    have      bitfield of pieces we have, as in a BITFIELD message
+#    verified  bitfield of pieces whose hash was checked
+#
+# All integers are big-endian. The file records and the bitfields are at
+# fixed offsets, so a completed piece is recorded by rewriting the records
+# of the files it is in and a byte in each bitfield. At startup only the
+# file records are checked (by Storage.unpickle), which is O(files). Files
+# written to after their record was last updated fail that check, and the
+# pieces in them are hash checked as usual.
+
+import os
+from struct import pack, unpack, calcsize
+from traceback import print_exc
+
+from Tribler.Core.BitTornado.bencode import bencode, bdecode
+from Tribler.Core.BitTornado.bitfield import Bitfield
+
+DEBUG = False
+
+MAGIC = 'TRIBRES1'
+HEADER_FORMAT = '>LLL'
+FILE_RECORD_FORMAT = '>qq'
+FILE_RECORD_SIZE = calcsize(FILE_RECORD_FORMAT)
+
+
+class ResumeIndex:
+    def __init__(self, filename, storage, numpieces):
+        self.filename = filename
+        self.storage = storage
+        self.numpieces = numpieces
+        self.numfiles = len(storage.files)
+        self.bitfieldlen = (numpieces + 7) / 8
+        self.fileindex = {}
+        for i in xrange(self.numfiles):
+            self.fileindex[storage.files[i][0]] = i
+        self.have = None
+        self.verified = None
+        self.filesoffset = None
+        self.bitsoffset = None
+        self.f = None
+
+    def load(self):
+        """ Returns the index as resumedata for FileSelector.unpickle(), with
+        an extra 'verified' key, or None if there is no valid index. """
+        try:
+            f = open(self.filename, 'rb')
+            try:
+                data = f.read()
+            finally:
+                f.close()
+            if data[:len(MAGIC)] != MAGIC:
+                return None
+            p = len(MAGIC)
+            numpieces, numfiles, hlen = unpack(HEADER_FORMAT, data[p:p+calcsize(HEADER_FORMAT)])
+            if numpieces != self.numpieces or numfiles != self.numfiles:
+                return None
+            p += calcsize(HEADER_FORMAT)
+            header = bdecode(data[p:p+hlen])
+            p += hlen
+            files = []
+            for i in xrange(numfiles):
+                size, mtime = unpack(FILE_RECORD_FORMAT, data[p:p+FILE_RECORD_SIZE])
+                p += FILE_RECORD_SIZE
+                if size >= 0:
+                    files.extend([i, size, mtime])
+            have = data[p:p+self.bitfieldlen]
+            verified = data[p+self.bitfieldlen:p+2*self.bitfieldlen]
+            # Bitfield raises ValueError when the index is truncated
+            if Bitfield(self.numpieces, have).complete():
+                pieces = 1
+            else:
+                pieces = have
+            Bitfield(self.numpieces, verified)
+        except:
+            if DEBUG:
+                print_exc()
+            return None
+        return { 'priority': header['priority'],
+                 'files': files,
+                 'partial files': header['partial files'],
+                 'pieces': pieces,
+                 'places': [],
+                 'partials': [],
+                 'verified': verified }
+
+    def save(self, priority, have, verified):
+        """ Write the complete index.
+        @param priority  List of file priorities, see FileSelector
+        @param have  Bitfield of the pieces we have in their own place
+        @param verified  List of booleans, True for hash checked pieces
+        """
+        self.close()
+        s = self.storage.pickle()
+        header = bencode({ 'priority': priority,
+                           'partial files': s['partial files'] })
+        records = [(-1, 0)] * self.numfiles
+        l = s['files']
+        for x in xrange(0, len(l), 3):
+            records[l[x]] = (l[x+1], l[x+2])
+        self.have = Bitfield(self.numpieces, have.tostring())
+        self.verified = Bitfield(self.numpieces)
+        for i in xrange(self.numpieces):
+            if verified[i] and have[i]:
+                self.verified[i] = True
+        self.filesoffset = len(MAGIC) + calcsize(HEADER_FORMAT) + len(header)
+        self.bitsoffset = self.filesoffset + self.numfiles * FILE_RECORD_SIZE
+
+        tmpfilename = self.filename + '.new'
+        f = open(tmpfilename, 'wb')
+        try:
+            f.write(MAGIC)
+            f.write(pack(HEADER_FORMAT, self.numpieces, self.numfiles, len(header)))
+            f.write(header)
+            for size, mtime in records:
+                f.write(pack(FILE_RECORD_FORMAT, size, mtime))
+            f.write(self.have.tostring())
+            f.write(self.verified.tostring())
+        finally:
+            f.close()
+        if os.path.exists(self.filename):
+            # Not atomic on win32
+            os.remove(self.filename)
+        os.rename(tmpfilename, self.filename)
+
+    def piece_verified(self, index, pos, length):
+        """ Record that piece index, stored at [pos,pos+length) in the
+        Storage, was written and passed the hash check. """
+        if self.have is None:
+            return
+        if self.f is None:
+            self.f = open(self.filename, 'rb+')
+        for file, size, mtime in self.storage.flush_range(pos, length):
+            i = self.fileindex[file]
+            self.f.seek(self.filesoffset + i * FILE_RECORD_SIZE)
+            self.f.write(pack(FILE_RECORD_FORMAT, size, mtime))
+        self.have[index] = True
+        self.verified[index] = True
+        byte = index / 8
+        self.f.seek(self.bitsoffset + byte)
+        self.f.write(self._getbyte(self.have, byte))
+        self.f.seek(self.bitsoffset + self.bitfieldlen + byte)
+        self.f.write(self._getbyte(self.verified, byte))
+        self.f.flush()
+
+    def _getbyte(self, bitfield, byte):
+        """ Returns tostring()[byte] without packing the whole bitfield """
+        v = 0
+        for i in xrange(byte * 8, min(byte * 8 + 8, self.numpieces)):
+            if bitfield[i]:
+                v |= 0x80 >> (i % 8)
+        return chr(v)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
@@ -1,7 +1,8 @@
 # Written by Bram Cohen
 # see LICENSE.txt for license information
 
-from Tribler.Core.BitTornado.piecebuffer import BufferPool
+from Tribler.Core.BitTornado.piecebuffer import BufferPool, MappedBuffer
+from Tribler.Core.BitTornado.filesender import FileRegion
 from threading import Lock
 from time import strftime, localtime
 import os
@@ -13,6 +14,10 @@ except ImportError:
     fsync = lambda x: None
 from bisect import bisect
 import sys
+try:
+    import mmap
+except ImportError:
+    mmap = None
     
 try:
     True
@@ -26,6 +31,11 @@ DEBUG = False
 MAXREADSIZE = 2 ** 16 # Arno: speed opt
 MAXLOCKSIZE = 1000000000L
 MAXLOCKRANGE = 3999999999L   # only lock first 4 gig of file
+# Files are mapped in windows of MMAP_WINDOW bytes starting at multiples of
+# MMAP_WINDOW_STEP, so any range of up to MMAP_WINDOW-MMAP_WINDOW_STEP bytes
+# lies within a single window. Must be multiples of mmap.ALLOCATIONGRANULARITY.
+MMAP_WINDOW = 2 ** 25
+MMAP_WINDOW_STEP = 2 ** 24
 
 _pool = BufferPool()
 PieceBuffer = _pool.new
@@ -56,6 +66,12 @@ class Storage:
         self.tops = {}
         self.sizes = {}
         self.mtimes = {}
+        self.mappings = {}
+        self.mapbuffer = []
+        self.use_mmap = config.get('storage_mmap', False) and mmap is not None
+        if self.use_mmap and os.name == 'nt' and config.get('lock_files', True):
+            # msvcrt locks are mandatory, reads through a mapping would fail
+            self.use_mmap = False
         if config.get('lock_files', True):
             self.lock_file, self.unlock_file = self._lock_file, self._unlock_file
         else:
@@ -268,7 +284,55 @@ class Storage:
         return self.handles[file]
 
 
+    def _get_mapping(self, file, begin, end):
+        """ Returns (mapping, offset of the mapping in file) for a window
+        holding bytes [begin,end) of file, or None when they can't be
+        mapped. Caller must hold self.lock. """
+        if end - begin > MMAP_WINDOW - MMAP_WINDOW_STEP:
+            return None
+        # The mapping shares the page cache, but not the buffer of our own
+        # write handle
+        if self.whandles.has_key(file):
+            self.handles[file].flush()
+        start = begin - begin % MMAP_WINDOW_STEP
+        key = (file, start)
+        m = self.mappings.get(key)
+        if m is not None and len(m) >= end - start:
+            if self.mapbuffer[-1] != key:
+                self.mapbuffer.remove(key)
+                self.mapbuffer.append(key)
+            return (m, start)
+        # Not mapped yet, or the file has grown since
+        size = min(getsize(file) - start, MMAP_WINDOW)
+        if size < end - start:
+            return None
+        if m is not None:
+            del self.mappings[key]
+            self.mapbuffer.remove(key)
+        try:
+            f = open(file, 'rb')
+            try:
+                m = mmap.mmap(f.fileno(), size, access = mmap.ACCESS_READ, 
+                              offset = start)
+            finally:
+                f.close()
+        except (EnvironmentError, ValueError, OverflowError):
+            if DEBUG:
+                print_exc()
+            return None
+        self.mappings[key] = m
+        self.mapbuffer.append(key)
+        if self.max_files_open > 0 and len(self.mapbuffer) > self.max_files_open:
+            # Not closed explicitly, MappedBuffers may still refer to it
+            del self.mappings[self.mapbuffer.pop(0)]
+        return (m, start)
+
+    def _drop_mappings(self):
+        self.mappings = {}
+        self.mapbuffer = []
+
     def _reset_ranges(self):
+        self._drop_mappings()
         self.ranges = []
         for l in self.working_ranges:
             self.ranges.extend(l)
@@ -296,6 +360,17 @@ class Storage:
                 print >>sys.stderr,'reading '+file+' from '+str(pos)+' to '+str(end)+' amount '+str(amount)
             try:
                 self.lock.acquire()
+                m = None
+                if self.use_mmap:
+                    m = self._get_mapping(file, pos, end)
+                if m is not None:
+                    # No read() calls, a single copy from the page cache
+                    mm, start = m
+                    if flush_first and self.whandles.has_key(file):
+                        fsync(self.handles[file])
+                    r.append(mm[pos-start:end-start])
+                    self.lock.release()
+                    continue
                 h = self._get_file_handle(file, False)
                 if flush_first and self.whandles.has_key(file):
                     h.flush()
@@ -314,6 +389,65 @@ class Storage:
                 raise IOError('error reading data from '+ file)
         return r
 
+    def read_view(self, pos, amount):
+        """ Returns a MappedBuffer for the given range, which refers to the
+        data in the page cache instead of copying it, or None when the range
+        can't be mapped, e.g. because mmap is not enabled or it spans 
+        multiple files. """
+        if not self.use_mmap:
+            return None
+        intervals = self._intervals(pos, amount)
+        if len(intervals) != 1:
+            return None
+        file, begin, end = intervals[0]
+        self.lock.acquire()
+        try:
+            try:
+                m = self._get_mapping(file, begin, end)
+            except (IOError, OSError):
+                return None
+        finally:
+            self.lock.release()
+        if m is None:
+            return None
+        mm, start = m
+        return MappedBuffer(mm, begin-start, end-begin)
+
+    def get_regions(self, pos, amount):
+        """ Returns the FileRegions holding the given range, for sending 
+        it with sendfile(). Pending writes are flushed to the OS first. """
+        r = []
+        for file, begin, end in self._intervals(pos, amount):
+            self.lock.acquire()
+            try:
+                if self.whandles.has_key(file):
+                    self.handles[file].flush()
+            finally:
+                self.lock.release()
+            r.append(FileRegion(self, file, begin, end))
+        return r
+
+    def get_file_fileno(self, file):
+        # might raise an IOError
+        self.lock.acquire()
+        try:
+            return self._get_file_handle(file, False).fileno()
+        finally:
+            self.lock.release()
+
+    def read_region(self, file, pos, end):
+        # might raise an IOError
+        self.lock.acquire()
+        try:
+            h = self._get_file_handle(file, False)
+            h.seek(pos)
+            data = h.read(end-pos)
+        finally:
+            self.lock.release()
+        if len(data) != end-pos:
+            raise IOError('error reading data from '+ file)
+        return data
+
     def write(self, pos, s):
         # might raise an IOError
         total = 0
@@ -344,6 +478,21 @@ class Storage:
             self.handles[file].flush()
             self.lock.release()
 
+    def flush_range(self, pos, amount):
+        """ Flushes pending writes to the files holding the given range and
+        returns (file, size, mtime) for each of them, as in pickle(). """
+        # may raise IOError or OSError
+        r = []
+        for file, begin, end in self._intervals(pos, amount):
+            self.lock.acquire()
+            try:
+                if self.whandles.has_key(file):
+                    self.handles[file].flush()
+            finally:
+                self.lock.release()
+            r.append((file, getsize(file), getmtime(file)))
+        return r
+
     def close(self):
         for file, f in self.handles.items():
             try:
@@ -357,6 +506,7 @@ class Storage:
         self.handles = {}
         self.whandles = {}
         self.handlebuffer = None
+        self._drop_mappings()
 
 
     def _get_disabled_ranges(self, f):
@@ -8,12 +8,16 @@ from copy import deepcopy
 import pickle
 import traceback
 import time
+from time import sleep
 
 from Tribler.Core.Merkle.merkle import MerkleTree
 from Tribler.Core.Utilities.Crypto import sha
 from Tribler.Core.BitTornado.bitfield import Bitfield
 from Tribler.Core.BitTornado.clock import clock
 from Tribler.Core.BitTornado.bencode import bencode
+from Tribler.Core.BitTornado.filesender import FilePiece
+from Tribler.Core.BitTornado.BT1.HashChecker import HashChecker
+from Tribler.Core.BitTornado.BT1.LiveVerifier import LiveVerifier
 
 try:
     True
@@ -26,6 +30,14 @@ DEBUG = False
 
 STATS_INTERVAL = 0.2
 RARE_RAWSERVER_TASKID = -481  # This must be a rawserver task ID that is never valid.
+# How often to collect results from the HashChecker workers
+HASHCHECK_POLL_INTERVAL = 0.05
+# Max bytes of early blocks a PieceHasher keeps, per piece and in total.
+# A piece whose hasher would exceed them is checked by reading it back.
+PIECEHASHER_MAX_PENDING = 256*1024
+PIECEHASHERS_MAX_PENDING = 4*1048576
+# Number of threads checking the signatures of live pieces
+LIVE_VERIFY_WORKERS = 2
 
 
 def dummy_status(fractionDone = None, activity = None):
@@ -61,6 +73,40 @@ class Olist:
         if self.d.has_key(i):
             del self.d[i]
 
+class PieceHasher:
+    """ Computes the SHA1 of a piece while its blocks come in. Blocks are
+    hashed in order, blocks that arrive early are kept until it's their 
+    turn. """
+    def __init__(self):
+        self.sh = sha()
+        self.pos = 0
+        self.pending = {}
+        self.pendingsize = 0
+
+    def add(self, begin, data):
+        """ Returns the change in the number of bytes kept """
+        oldsize = self.pendingsize
+        if begin != self.pos:
+            if begin > self.pos and not self.pending.has_key(begin):
+                self.pending[begin] = data
+                self.pendingsize += len(data)
+            return self.pendingsize - oldsize
+        self.sh.update(data)
+        self.pos += len(data)
+        while self.pending.has_key(self.pos):
+            data = self.pending.pop(self.pos)
+            self.pendingsize -= len(data)
+            self.sh.update(data)
+            self.pos += len(data)
+        return self.pendingsize - oldsize
+
+    def digest(self, length):
+        """ Returns the hash if exactly length bytes were hashed, None 
+        otherwise """
+        if self.pos != length:
+            return None
+        return self.sh.digest()
+
 class fakeflag:
     def __init__(self, state=False):
         self.state = state
@@ -140,6 +186,13 @@ class StorageWrapper:
         self.write_buf_size = 0L
         self.write_buf = {}   # structure:  piece: [(start, data), ...]
         self.write_buf_list = []
+        self.piece_hashers = {}
+        self.piece_hashers_pending = 0   # bytes kept by all PieceHashers
+        # LIVESOURCEAUTH: see set_live_authenticator()
+        self.live_authenticator = None
+        self.live_verifier = None
+        self.live_piece_checked = None
+        self.live_pending = {}   # piece: (data, baddataguard) being checked
         # Arno, 2010-04-23: STBSPEED: the piece that were correct on disk at start
         self.pieces_on_disk_at_startup = []
 
@@ -163,6 +216,9 @@ class StorageWrapper:
             # Normal BT
             self.hashes_unpickled = True
 
+        self.hashchecker = None
+        self.check_pending = 0
+        self.resumeindex = None
         self.initialize_tasks = [
             ['checking existing data', 0, self.init_hashcheck, self.hashcheckfunc], 
             ['moving data', 1, self.init_movedata, self.movedatafunc], 
@@ -180,6 +236,7 @@ class StorageWrapper:
 
 
     def old_style_init(self):
+        self.initialize_delay = 0
         while self.initialize_tasks:
             msg, done, init, next = self.initialize_tasks.pop(0)
             if init():
@@ -194,6 +251,9 @@ class StorageWrapper:
                     if self.flag.isSet():
                         return False
                     x = next()
+                    if self.initialize_delay:
+                        sleep(self.initialize_delay)
+                        self.initialize_delay = 0
 
         self.statusfunc(fractionDone = 0)
         return True
@@ -208,6 +268,7 @@ class StorageWrapper:
             statusfunc = self.statusfunc
         self.initialize_status = statusfunc
         self.initialize_next = None
+        self.initialize_delay = 0
             
         """
         Arno: 2007-01-02:
@@ -302,7 +363,9 @@ class StorageWrapper:
         # the SingleDownload gets killed, and thus the queue to which backfunc
         # queues tasks is also closed, so this code does nothing then.
         #
-        self.backfunc(self._initialize)
+        delay = self.initialize_delay
+        self.initialize_delay = 0
+        self.backfunc(self._initialize, delay)
 
 
     def init_hashcheck(self):
@@ -430,6 +493,8 @@ class StorageWrapper:
                 return None
             if self.flag.isSet():
                 return None
+            if self.check_hashes and self.config.get('hashcheck_workers', 2) > 0:
+                return self._parallel_hashcheck()
             if not self.check_list:
                 return None
 
@@ -449,59 +514,101 @@ class StorageWrapper:
                 sh.update(d2[:])
                 d2.release()
                 s = sh.digest()
-
-
-                if DEBUG:
-                    if s != self.hashes[i]:
-                        print >>sys.stderr,"StorageWrapper: hashcheckfunc: piece corrupt",i
-
-                # Merkle: If we didn't read the hashes from persistent storage then
-                # we can't check anything. Exception is the case where we are the
-                # initial seeder. In that case we first calculate all hashes, 
-                # and then compute the hash tree. If the root hash equals the
-                # root hash in the .torrent we're a seeder. Otherwise, we are
-                # client with messed up data and no (local) way of checking it.
-                #
-                if not self.hashes_unpickled:
-                    if DEBUG:
-                        print "StorageWrapper: Merkle torrent, saving calculated hash",i
-                    self.initial_hashes[i] = s
-                    self._markgot(i, i)
-                elif s == self.hashes[i]:
-                    self._markgot(i, i)
-                elif (self.check_targets.get(s)
-                       and self._piecelen(i) == self._piecelen(self.check_targets[s][-1])):
-                    self._markgot(self.check_targets[s].pop(), i)
-                    self.out_of_place += 1
-                elif (not self.have[-1] and sp == self.hashes[-1]
-                       and (i == len(self.hashes) - 1
-                            or not self._waspre(len(self.hashes) - 1))):
-                    self._markgot(len(self.hashes) - 1, i)
-                    self.out_of_place += 1
-                else:
-                    self.places[i] = i
-            self.numchecked += 1
-            if self.amount_left == 0:
-                if not self.hashes_unpickled:
-                    # Merkle: The moment of truth. Are we an initial seeder?
-                    self.merkletree = MerkleTree(self.piece_size,self.total_length,None,self.initial_hashes)
-                    if self.merkletree.compare_root_hashes(self.root_hash):
-                        if DEBUG:
-                            print "StorageWrapper: Merkle torrent, initial seeder!"
-                        self.hashes = self.initial_hashes
-                    else:
-                        # Bad luck
-                        if DEBUG:
-                            print "StorageWrapper: Merkle torrent, NOT a seeder!"
-                        self.failed('download corrupted, hash tree does not compute; please delete and restart')
-                        return 1
-                self.finished()
-                
+                self._hashcheck_piece(i, sp, s)
+            if not self._hashcheck_piece_done():
+                return 1
             return (self.numchecked / self.check_total)
 
         except Exception, e:
             print_exc()
             self.failed('download corrupted: '+str(e)+'; please delete and restart')
+
+    def _parallel_hashcheck(self):
+        """ Hash check using a pool of worker threads that read and hash the
+        pieces, see HashChecker. The results are processed here, on the 
+        network thread. """
+        if self.hashchecker is None:
+            if not self.check_list:
+                return None
+            self.hashchecker = HashChecker(self.storage, self.piece_size, 
+                                           self._piecelen, self.lastlen, 
+                                           self.config.get('hashcheck_workers', 2),
+                                           self.flag)
+            self.check_pending = len(self.check_list)
+            self.hashchecker.start(self.check_list)
+            self.check_list = []
+
+        results = self.hashchecker.get_results()
+        if not results:
+            # Don't spin on the network thread while the workers are busy
+            self.initialize_delay = HASHCHECK_POLL_INTERVAL
+        for i, sp, s in results:
+            self.check_pending -= 1
+            if s is None:
+                self.hashchecker.shutdown()
+                self.hashchecker = None
+                self.failed('IO Error: error reading data of piece '+str(i))
+                return None
+            self._hashcheck_piece(i, sp, s)
+            if not self._hashcheck_piece_done():
+                self.hashchecker.shutdown()
+                return 1
+        if self.check_pending == 0:
+            self.hashchecker = None
+        return (self.numchecked / self.check_total)
+
+    def _hashcheck_piece(self, i, sp, s):
+        """ Process the hash s of piece i on disk, where sp is the hash of its
+        first self.lastlen bytes. """
+        if DEBUG:
+            if s != self.hashes[i]:
+                print >>sys.stderr,"StorageWrapper: hashcheckfunc: piece corrupt",i
+
+        # Merkle: If we didn't read the hashes from persistent storage then
+        # we can't check anything. Exception is the case where we are the
+        # initial seeder. In that case we first calculate all hashes, 
+        # and then compute the hash tree. If the root hash equals the
+        # root hash in the .torrent we're a seeder. Otherwise, we are
+        # client with messed up data and no (local) way of checking it.
+        #
+        if not self.hashes_unpickled:
+            if DEBUG:
+                print "StorageWrapper: Merkle torrent, saving calculated hash",i
+            self.initial_hashes[i] = s
+            self._markgot(i, i)
+        elif s == self.hashes[i]:
+            self._markgot(i, i)
+        elif (self.check_targets.get(s)
+               and self._piecelen(i) == self._piecelen(self.check_targets[s][-1])):
+            self._markgot(self.check_targets[s].pop(), i)
+            self.out_of_place += 1
+        elif (not self.have[-1] and sp == self.hashes[-1]
+               and (i == len(self.hashes) - 1
+                    or not self._waspre(len(self.hashes) - 1))):
+            self._markgot(len(self.hashes) - 1, i)
+            self.out_of_place += 1
+        else:
+            self.places[i] = i
+
+    def _hashcheck_piece_done(self):
+        """ Returns False if the download turned out to be corrupt """
+        self.numchecked += 1
+        if self.amount_left == 0:
+            if not self.hashes_unpickled:
+                # Merkle: The moment of truth. Are we an initial seeder?
+                self.merkletree = MerkleTree(self.piece_size,self.total_length,None,self.initial_hashes)
+                if self.merkletree.compare_root_hashes(self.root_hash):
+                    if DEBUG:
+                        print "StorageWrapper: Merkle torrent, initial seeder!"
+                    self.hashes = self.initial_hashes
+                else:
+                    # Bad luck
+                    if DEBUG:
+                        print "StorageWrapper: Merkle torrent, NOT a seeder!"
+                    self.failed('download corrupted, hash tree does not compute; please delete and restart')
+                    return False
+            self.finished()
+        return True
     
 
     def init_movedata(self):
@@ -743,6 +850,7 @@ class StorageWrapper:
         
         self.inactive_requests[index] = 1  # number 1, not letter L
         self.amount_inactive += self._piecelen(index)
+        self._drop_hasher(index)
 
 
     def write_raw(self, index, begin, data):
@@ -771,20 +879,53 @@ class StorageWrapper:
         self.write_buf[piece].append((start, data))
         return True
 
-    def _flush_buffer(self, piece, popped = False):
+    def _flush_buffer(self, piece, popped = False, data = None):
+        """ Write the buffered blocks of piece to disk. Adjacent blocks are
+        joined and written together. If the caller already joined all 
+        blocks, it can pass them as data. """
         if not self.write_buf.has_key(piece):
             return True
         if not popped:
             self.write_buf_list.remove(piece)
         l = self.write_buf[piece]
         del self.write_buf[piece]
+        for start, block in l:
+            self.write_buf_size -= len(block)
+        if data is not None:
+            return self.write_raw(self.places[piece], 0, data)
         l.sort()
-        for start, data in l:
-            self.write_buf_size -= len(data)
-            if not self.write_raw(self.places[piece], start, data):
+        runs = []
+        for start, block in l:
+            if runs and runs[-1][0] + runs[-1][1] == start:
+                runs[-1][1] += len(block)
+                runs[-1][2].append(block)
+            else:
+                runs.append([start, len(block), [block]])
+        for start, length, blocks in runs:
+            if len(blocks) == 1:
+                block = blocks[0]
+            else:
+                block = ''.join(blocks)
+            if not self.write_raw(self.places[piece], start, block):
                 return False
         return True
 
+    def _get_buffered_piece(self, piece):
+        """ Returns the complete piece as a string if all its blocks are in
+        the write buffer, None otherwise. """
+        l = self.write_buf.get(piece)
+        if not l:
+            return None
+        l.sort()
+        pos = 0
+        for start, block in l:
+            if start != pos:
+                return None
+            pos += len(block)
+        if pos != self._piecelen(piece):
+            return None
+        return ''.join([block for start, block in l])
+
     def sync(self):
         spots = {}
         for p in self.write_buf_list:
@@ -923,6 +1064,20 @@ class StorageWrapper:
             old.release()
         self.download_history.setdefault(index, {})[begin] = source
         
+        if not self.live_streaming and not self.triple_check:
+            # Hash the blocks as they arrive, so the piece can be checked
+            # right away when it completes. Pieces that already have data
+            # on disk, e.g. restored partials, are checked as before.
+            if not self.dirty.has_key(index):
+                self._drop_hasher(index)
+                self.piece_hashers[index] = PieceHasher()
+            hasher = self.piece_hashers.get(index)
+            if hasher is not None:
+                self.piece_hashers_pending += hasher.add(begin, piece)
+                if (hasher.pendingsize > PIECEHASHER_MAX_PENDING
+                    or self.piece_hashers_pending > PIECEHASHERS_MAX_PENDING):
+                    self._drop_hasher(index)
+
         if not self._write_to_buffer(index, begin, piece):
             return True
         
@@ -939,55 +1094,89 @@ class StorageWrapper:
             return True
         
         del self.dirty[index]
-        if not self._flush_buffer(index):
-            return True
-        
         length = self._piecelen(index)
-        # Check hash
-        data = self.read_raw(self.places[index], 0, length, 
-                                     flush_first = self.triple_check)
-        if data is None:
-            return True
+        hash = None
+        hasher = self._drop_hasher(index)
+        if hasher is not None:
+            hash = hasher.digest(length)
+        data = None
+        if hash is None and not self.live_streaming and not self.triple_check:
+            # Write-back cache: if all blocks are still buffered, write the
+            # piece in one go and check it without reading it back
+            data = self._get_buffered_piece(index)
+        if hash is not None:
+            # Already hashed, just write what's still buffered
+            if not self._flush_buffer(index):
+                return True
+        elif data is not None:
+            if not self._flush_buffer(index, data = data):
+                return True
+        else:
+            if not self._flush_buffer(index):
+                return True
+            # Check hash
+            data = self.read_raw(self.places[index], 0, length, 
+                                         flush_first = self.triple_check)
+            if data is None:
+                return True
         
         pieceok = False
-        if self.live_streaming:
+        if self.live_streaming and self.live_verifier is not None:
+            # LIVESOURCEAUTH: check on the LiveVerifier threads, the piece
+            # has no requests left, so it is not picked again meanwhile.
+            # The buffer is released when the check is done.
+            self.live_pending[index] = (data, baddataguard)
+            self.live_verifier.verify(index, data, self._live_verify_done)
+            return True
+        elif self.live_streaming:
             # LIVESOURCEAUTH
             if self.piece_from_live_source_func(index,data[:]):
                 pieceok = True
+            if not isinstance(data, str):
+                data.release()
         else:
-            hash = sha(data[:]).digest()
-            data.release()
+            if hash is None:
+                hash = sha(data[:]).digest()
+                if not isinstance(data, str):
+                    data.release()
             if hash == self.hashes[index]:
                 pieceok = True
                 
         if not pieceok: 
-            self.amount_obtained -= length
-            self.data_flunked(length, index)
-            self.inactive_requests[index] = 1  # number 1, not letter L
-            self.amount_inactive += length
-            self.stat_numflunked += 1
-
-            self.failed_pieces[index] = {}
-            allsenders = {}
-            for d in self.download_history[index].values():
-                allsenders[d] = 1
-            if len(allsenders) == 1:
-                culprit = allsenders.keys()[0]
-                if culprit is not None:
-                    culprit.failed(index, bump = True)
-                del self.failed_pieces[index] # found the culprit already
-                
+            self._piece_flunked(index, length)
             if self.live_streaming:
                 # TODO: figure out how to use the Download.BadDataGuard
                 # cf. the culprit business above.
                 print >>sys.stderr,"////////////////////////////////////////////////////////////// kicking peer"
                 raise ValueError("Arno quick fix: Unauth data unacceptable")
-                
             return False
 
+        self._piece_passed(index, length)
+        return True
+
+    def _piece_flunked(self, index, length):
+        self.amount_obtained -= length
+        self.data_flunked(length, index)
+        self.inactive_requests[index] = 1  # number 1, not letter L
+        self.amount_inactive += length
+        self.stat_numflunked += 1
+
+        self.failed_pieces[index] = {}
+        allsenders = {}
+        for d in self.download_history[index].values():
+            allsenders[d] = 1
+        if len(allsenders) == 1:
+            culprit = allsenders.keys()[0]
+            if culprit is not None:
+                culprit.failed(index, bump = True)
+            del self.failed_pieces[index] # found the culprit already
+
+    def _piece_passed(self, index, length):
         self.have[index] = True
         self.inactive_requests[index] = None
         self.waschecked[index] = True
+        if self.resumeindex is not None:
+            self._update_resumeindex(index)
         
         self.amount_left -= length
         self.stat_numdownloaded += 1
@@ -1004,14 +1193,60 @@ class StorageWrapper:
 
         if self.amount_left == 0:
             self.finished()
-        return True
 
+    def set_live_authenticator(self, authenticator, checkedfunc):
+        """ LIVESOURCEAUTH: Check the signatures of live pieces that come in
+        on LiveVerifier threads. When a piece has been checked, 
+        checkedfunc(index, ok, baddataguard) is called on the network 
+        thread, with the guard of the connection that completed the piece.
+        Until then piece_came_in() treats the piece as in progress.
+        """
+        self.live_authenticator = authenticator
+        self.live_piece_checked = checkedfunc
+        self.live_verifier = LiveVerifier(self._live_verify_signature, 
+                                          LIVE_VERIFY_WORKERS, self.backfunc, 
+                                          self.flag)
+
+    def _live_verify_signature(self, data, index):
+        """ Called on the LiveVerifier threads """
+        return self.live_authenticator.verify_signature(data[:], index)
+
+    def _live_verify_done(self, index, data, sigok):
+        """ Called on the network thread by the LiveVerifier """
+        entry = self.live_pending.get(index)
+        if self.flag.isSet() or entry is None or entry[0] is not data:
+            # Invalidated while being checked
+            if not isinstance(data, str):
+                data.release()
+            return
+        del self.live_pending[index]
+        guard = entry[1]
+        # The seqnum checks change the authenticator state, so they are
+        # done here and in the order the checks finish.
+        ok = sigok and self.live_authenticator.verify_seqnum(data[:], index)
+        if not isinstance(data, str):
+            data.release()
+        length = self._piecelen(index)
+        if ok:
+            self._piece_passed(index, length)
+        else:
+            self._piece_flunked(index, length)
+        self.live_piece_checked(index, ok, guard)
+
+    def _drop_hasher(self, index):
+        """ Removes and returns the PieceHasher of the piece, if any """
+        hasher = self.piece_hashers.pop(index, None)
+        if hasher is not None:
+            self.piece_hashers_pending -= hasher.pendingsize
+        return hasher
 
     def request_lost(self, index, begin, length):
         
         if DEBUG:
             print >>sys.stderr,"StorageWrapper: request_lost",index,"#"
         
+        # The piece may stall, don't keep its early blocks around
+        self._drop_hasher(index)
         assert not (begin, length) in self.inactive_requests[index]
         insort(self.inactive_requests[index], (begin, length))
         self.amount_inactive += length
@@ -1032,6 +1267,23 @@ class StorageWrapper:
             hashlist = []
         return [pb,hashlist]
 
+    def get_piece_regions(self, index, begin, length):
+        """ Returns a FilePiece describing where the block is stored on disk, 
+        or None when it must be read through get_piece(). Only verified 
+        pieces at their final place qualify, as those will not be moved or
+        overwritten while the block is queued for sending. """
+        if (not self.have[index] or not self.waschecked[index] 
+            or self.live_streaming or self.places.get(index) != index):
+            return None
+        if begin + length > self._piecelen(index):
+            return None
+        try:
+            regions = self.storage.get_regions(self.piece_size * index + begin, length)
+        except IOError, e:
+            self.failed('IO Error: ' + str(e))
+            return None
+        return FilePiece(regions)
+
     def do_get_piece(self, index, begin, length):
         if not self.have[index]:
             return None
@@ -1046,18 +1298,26 @@ class StorageWrapper:
             self.waschecked[index] = True
             if length == -1 and begin == 0:
                 return data     # optimization
+        wholepiece = False
         if length == -1:
             if begin > self._piecelen(index):
                 return None
             length = self._piecelen(index)-begin
-            if begin == 0:
-                return self.read_raw(self.places[index], 0, length)
+            wholepiece = (begin == 0)
         elif begin + length > self._piecelen(index):
             return None
         if data is not None:
             s = data[begin:begin+length]
             data.release()
             return s
+        if self.places[index] == index and not self.live_streaming:
+            # mmap: verified pieces at their own place are not overwritten,
+            # so they can be handed out without copying
+            view = self.storage.read_view(self.piece_size * index + begin, length)
+            if view is not None:
+                return view
+        if wholepiece:
+            return self.read_raw(self.places[index], 0, length)
         data = self.read_raw(self.places[index], begin, length)
         if data is None:
             return None
@@ -1223,6 +1483,35 @@ class StorageWrapper:
             return {'pieces': pieces.tostring(), 'places': places, 'partials': partials }
 
 
+    def set_resumeindex(self, resumeindex):
+        self.resumeindex = resumeindex
+
+    def save_resumeindex(self, priority):
+        """ Write the current state to the fast-resume index, if any. Only
+        pieces stored at their own place are recorded, see ResumeIndex. """
+        if self.resumeindex is None or self.live_streaming:
+            return
+        have = Bitfield(len(self.hashes))
+        for p in xrange(len(self.hashes)):
+            if self.have[p] and self.places.get(p) == p:
+                have[p] = True
+        try:
+            self.resumeindex.save(priority, have, self.waschecked)
+        except (IOError, OSError), e:
+            # Not fatal, we just have to hash check on the next start
+            print >>sys.stderr,"StorageWrapper: cannot write resume index",str(e)
+            self.resumeindex = None
+
+    def _update_resumeindex(self, index):
+        if self.places.get(index) != index:
+            return
+        try:
+            self.resumeindex.piece_verified(index, self.piece_size * index, self._piecelen(index))
+        except (IOError, OSError), e:
+            print >>sys.stderr,"StorageWrapper: cannot update resume index",str(e)
+            self.resumeindex.close()
+            self.resumeindex = None
+
     def unpickle(self, data, valid_places):
         got = {}
         places = {}
@@ -1235,6 +1524,8 @@ class StorageWrapper:
         amount_left = self.amount_left
         inactive_requests = [x for x in self.inactive_requests]
         restored_partials = []
+        waschecked = [x for x in self.waschecked]
+        verified = None
 
         try:
             if data.has_key('merkletree'):
@@ -1266,6 +1557,9 @@ class StorageWrapper:
                 assert len(_partials) % 2 == 0
                 _partials = [_partials[x:x+2] for x in xrange(0, len(_partials), 2)]
                 
+            if data.has_key('verified'):
+                # Pieces recorded as hash checked by the fast-resume index
+                verified = Bitfield(len(self.hashes), data['verified'])
             for index, place in _places:
                 if place not in valid_places:
                     continue
@@ -1294,6 +1588,8 @@ class StorageWrapper:
                     inactive_requests[index] = None
                     # Arno, 2010-09-28: Fix checkpointing.
                     self.pieces_on_disk_at_startup.append(index)
+                    if verified is not None and verified[index]:
+                        waschecked[index] = True
 
 
             for index, plist in _partials:
@@ -1353,6 +1649,7 @@ class StorageWrapper:
         self.amount_inactive = amount_inactive
         self.amount_left = amount_left
         self.inactive_requests = inactive_requests
+        self.waschecked = waschecked
                 
         return restored_partials
     
@@ -1368,6 +1665,7 @@ class StorageWrapper:
     def live_invalidate(self,piece): # Arno: LIVEWRAP
         # Assumption: not outstanding requests
         length = self._piecelen(piece)
+        self.live_pending.pop(piece, None)
         oldhave = self.have[piece]
         self.have[piece] = False
         #self.waschecked[piece] = False
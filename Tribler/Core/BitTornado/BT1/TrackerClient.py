@@ -0,0 +1,391 @@
+# see LICENSE.txt for license information
+#
+# Event-driven HTTP client for tracker announces. Runs on the
+# network thread of a RawServer, so announcing for many torrents needs no
+# threads. Connections to a tracker are kept alive and reused, and a tracker
+# that cannot be reached is not contacted again for a while.
+#
+import sys
+from urlparse import urlparse
+from socket import gethostbyname, inet_aton, error as socketerror
+from threading import Thread
+from thread import get_ident
+from traceback import print_exc
+
+from Tribler.Core.BitTornado.clock import clock
+from Tribler.Core.BitTornado.__init__ import product_name, version_short
+from Tribler.Core.Utilities.timeouturlopen import find_proxy
+
+try:
+    True
+except:
+    True = 1
+    False = 0
+
+DEBUG = False
+
+VERSION = product_name+'/'+version_short
+MAX_CONNECTIONS_PER_TRACKER = 2
+MAX_REDIRECTS = 10
+DNS_CACHE_TIME = 1800.0
+BACKOFF_MIN = 15.0     # seconds to not contact a tracker after a failure,
+BACKOFF_MAX = 1800.0   # doubling with each subsequent failure.
+
+_clients = {}
+
+def get_tracker_client(rawserver):
+    """ Returns the HTTPTrackerClient for the RawServer, creating it if
+    needed. """
+    client = _clients.get(rawserver)
+    if client is None:
+        client = HTTPTrackerClient(rawserver)
+        _clients[rawserver] = client
+    return client
+
+class HTTPTrackerClient:
+    """ Performs HTTP GETs to trackers. Called by network thread, results
+    are reported via callbacks on the network thread. """
+
+    def __init__(self, rawserver):
+        self.rawserver = rawserver
+        self.trackers = {}  # (host,port) -> TrackerHost
+
+    def can_handle(self, url):
+        """ Returns whether the URL can be retrieved by this client, i.e.,
+        it is a HTTP URL and no proxy must be used. """
+        return url.startswith('http://') and find_proxy(url) is None
+
+    def get(self, url, callback, timeout, redirects=0):
+        """ Retrieves the URL and calls callback(data,None) or
+        callback(None,errormessage), at the latest after timeout seconds """
+        if get_ident() != self.rawserver.thread_ident:
+            get_lambda = lambda:self.get(url,callback,timeout,redirects)
+            self.rawserver.add_task(get_lambda,0)
+            return
+
+        (scheme, netloc, path, pars, query, fragment) = urlparse(url)
+        if pars:
+            path += ';'+pars
+        if query:
+            path += '?'+query
+        if not path:
+            path = '/'
+        if ':' in netloc:
+            (host,port) = netloc.rsplit(':',1)
+            try:
+                port = int(port)
+            except ValueError:
+                callback(None,'Problem connecting to tracker - bad port in '+url)
+                return
+        else:
+            (host,port) = (netloc,80)
+
+        tracker = self.trackers.get((host,port))
+        if tracker is None:
+            tracker = TrackerHost(self,host,port)
+            self.trackers[(host,port)] = tracker
+
+        def done(data,err,location=None):
+            if location is not None:
+                if redirects >= MAX_REDIRECTS:
+                    callback(None,'Problem connecting to tracker - redirect recursion')
+                elif not self.can_handle(location):
+                    callback(None,'Problem connecting to tracker - redirect to unsupported URL')
+                else:
+                    self.get(location,callback,timeout,redirects+1)
+                return
+            callback(data,err)
+        tracker.submit(HTTPRequest(netloc,path,done,timeout))
+
+class HTTPRequest:
+    def __init__(self, netloc, path, callback, timeout):
+        self.netloc = netloc
+        self.path = path
+        self.callback = callback
+        self.timeout = timeout
+        self.deadline = None
+        self.tries = 0
+
+    def tostring(self):
+        return ('GET '+self.path+' HTTP/1.1\r\n'
+                +'Host: '+self.netloc+'\r\n'
+                +'User-Agent: '+VERSION+'\r\n'
+                +'Connection: keep-alive\r\n\r\n')
+
+
+class TrackerHost:
+    """ The connections to and queued requests for one tracker """
+
+    def __init__(self, client, host, port):
+        self.client = client
+        self.rawserver = client.rawserver
+        self.host = host
+        self.port = port
+        self.ip = None
+        self.resolvetime = None
+        self.resolving = False
+        self.queue = []
+        self.idle = []
+        self.nconnections = 0
+        self.failures = 0
+        self.backoffuntil = 0.0
+        self.lasterror = None
+
+    def submit(self, request):
+        if self.backoffuntil > clock():
+            request.callback(None,self.lasterror)
+            return
+        # The timeout also covers waiting for a connection or the DNS lookup
+        request.deadline = clock()+request.timeout
+        self.queue.append(request)
+        timeout_lambda = lambda:self.queue_timed_out(request)
+        self.rawserver.add_task(timeout_lambda,request.timeout)
+        self.dispatch()
+
+    def queue_timed_out(self, request):
+        """ Fails request if it is still waiting to be sent. A slow tracker
+        is not backed off, as it is answering. """
+        if request in self.queue:
+            self.queue.remove(request)
+            request.callback(None,'Problem connecting to tracker - timeout exceeded')
+
+    def dispatch(self):
+        if self.ip is None or self.resolvetime+DNS_CACHE_TIME < clock():
+            self.resolve()
+            if self.ip is None:
+                return
+        while self.queue:
+            if self.idle:
+                conn = self.idle.pop()
+            elif self.nconnections < MAX_CONNECTIONS_PER_TRACKER:
+                try:
+                    conn = TrackerConnection(self)
+                except (socketerror,IOError), e:
+                    self.failed('Problem connecting to tracker - '+str(e))
+                    return
+            else:
+                return
+            conn.send(self.queue.pop(0))
+
+    def resolve(self):
+        """ Resolve the tracker's hostname on a separate thread, as it may
+        block for a long time, see SocketHandler.start_connection() """
+        try:
+            inet_aton(self.host)
+            self.ip = self.host
+            self.resolvetime = clock()
+            return
+        except socketerror:
+            pass
+        if self.resolving:
+            return
+        self.resolving = True
+        def resolve_thread():
+            try:
+                ip = gethostbyname(self.host)
+                err = None
+            except Exception,e:
+                ip = None
+                err = 'Problem connecting to tracker - '+str(e)
+            self.rawserver.add_task(lambda:self.resolved(ip,err),0)
+        t = Thread(target = resolve_thread)
+        t.setName("TrackerResolve"+t.getName())
+        t.setDaemon(True)
+        t.start()
+
+    def resolved(self, ip, err):
+        self.resolving = False
+        if ip is None:
+            if self.ip is None:
+                self.failed(err)
+                return
+            # Keep using the old address
+        else:
+            self.ip = ip
+        self.resolvetime = clock()
+        self.dispatch()
+
+    def failed(self, err):
+        """ Fail all queued requests and don't contact the tracker for a
+        while """
+        self.failures += 1
+        self.lasterror = err
+        self.backoffuntil = clock()+min(BACKOFF_MAX,BACKOFF_MIN*(2**(self.failures-1)))
+        if DEBUG:
+            print >>sys.stderr,"TrackerClient:",self.host,"failed",self.failures,"times:",err
+        queue = self.queue
+        self.queue = []
+        for request in queue:
+            request.callback(None,err)
+
+    def request_done(self, conn, request, data, err, location=None, keepalive=False, httperror=False):
+        """ Reports the result of request to its callback. When the tracker
+        could not be reached all queued requests fail and the tracker is
+        backed off. An HTTP error status means the tracker is up, so it
+        only fails this request. """
+        if err is None or httperror:
+            self.failures = 0
+        if keepalive:
+            self.idle.append(conn)
+        try:
+            request.callback(data,err,location)
+        except:
+            print_exc()
+        if err is not None and not httperror:
+            self.failed(err)
+        else:
+            self.dispatch()
+
+    def connection_closed(self, conn):
+        self.nconnections -= 1
+        if conn in self.idle:
+            self.idle.remove(conn)
+
+
+class TrackerConnection:
+    """ A keep-alive HTTP connection to a tracker, handler for a SingleSocket """
+
+    def __init__(self, tracker):
+        self.tracker = tracker
+        self.connection = tracker.rawserver.start_connection((tracker.ip,tracker.port),self)
+        tracker.nconnections += 1
+        self.closed = False
+        self.request = None
+        self.nrequests = 0
+        self.buffer = ''
+
+    def send(self, request):
+        self.request = request
+        self.nrequests += 1
+        request.tries += 1
+        self.buffer = ''
+        self.connection.write(request.tostring())
+        timeout_lambda = lambda:self.timed_out(request)
+        self.tracker.rawserver.add_task(timeout_lambda,max(0.0,request.deadline-clock()))
+
+    def timed_out(self, request):
+        if self.request is request:
+            self.close()
+            self.done(None,'Problem connecting to tracker - timeout exceeded')
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                self.connection.close()
+            except:
+                pass
+            self.tracker.connection_closed(self)
+
+    def done(self, data, err, location=None, keepalive=False, httperror=False):
+        request = self.request
+        self.request = None
+        self.buffer = ''
+        self.tracker.request_done(self,request,data,err,location,keepalive,httperror)
+
+    def data_came_in(self, connection, s):
+        if self.request is None:
+            # Unexpected data, drop connection
+            self.close()
+            return
+        self.buffer += s
+        self.parse(False)
+
+    def parse(self, eof):
+        """ Checks if the response to the current request is complete and
+        reports it. """
+        i = self.buffer.find('\r\n\r\n')
+        if i == -1:
+            if eof:
+                self.done(None,'Problem connecting to tracker - incomplete reply')
+            return
+        lines = self.buffer[:i].split('\r\n')
+        body = self.buffer[i+4:]
+        try:
+            status = int(lines[0].split(' ',2)[1])
+        except:
+            self.close()
+            self.done(None,'Problem connecting to tracker - bad HTTP reply')
+            return
+        headers = {}
+        for line in lines[1:]:
+            j = line.find(':')
+            if j != -1:
+                headers[line[:j].strip().lower()] = line[j+1:].strip()
+        keepalive = lines[0].startswith('HTTP/1.1') and headers.get('connection','').lower() != 'close'
+
+        if headers.get('transfer-encoding','').lower() == 'chunked':
+            body = decode_chunked(body)
+            if body is None:
+                if eof:
+                    self.done(None,'Problem connecting to tracker - incomplete reply')
+                return
+        elif headers.has_key('content-length'):
+            try:
+                length = int(headers['content-length'])
+            except ValueError:
+                length = -1
+            if length < 0:
+                self.close()
+                self.done(None,'Problem connecting to tracker - bad HTTP reply')
+                return
+            if len(body) < length:
+                if eof:
+                    self.done(None,'Problem connecting to tracker - incomplete reply')
+                return
+            body = body[:length]
+        elif not eof:
+            # Body ends when the connection is closed
+            return
+        else:
+            keepalive = False
+
+        if not keepalive:
+            self.close()
+        if status in (301,302,303,307) and headers.has_key('location'):
+            self.done(None,None,headers['location'],keepalive)
+        elif status != 200:
+            self.done(None,'Problem connecting to tracker - HTTP Error - %d' % status,None,keepalive,True)
+        else:
+            self.done(body,None,None,keepalive)
+
+    def connection_lost(self, connection):
+        if self.closed:
+            return
+        self.closed = True
+        self.tracker.connection_closed(self)
+        request = self.request
+        if request is None:
+            return
+        if self.buffer:
+            self.parse(True)
+        elif self.nrequests > 1 and request.tries == 1:
+            # Tracker closed the idle connection just as we sent the request
+            self.request = None
+            self.tracker.queue.insert(0,request)
+            self.tracker.dispatch()
+        else:
+            self.done(None,'Problem connecting to tracker - connection closed')
+
+    def connection_flushed(self, connection):
+        pass
+
+
+def decode_chunked(body):
+    """ Returns the decoded chunked body, or None if incomplete """
+    data = []
+    pos = 0
+    while True:
+        i = body.find('\r\n',pos)
+        if i == -1:
+            return None
+        try:
+            size = int(body[pos:i].split(';',1)[0],16)
+        except ValueError:
+            return ''
+        if size == 0:
+            return ''.join(data)
+        if i+2+size+2 > len(body):
+            return None
+        data.append(body[i+2:i+2+size])
+        pos = i+2+size+2
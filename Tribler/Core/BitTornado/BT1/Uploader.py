@@ -2,6 +2,7 @@
 # see LICENSE.txt for license information
 
 from Tribler.Core.BitTornado.CurrentRateMeasure import Measure,TimeKeeper
+from Tribler.Core.BitTornado.filesender import sendfile_supported
 from Tribler.Core.Statistics.Status.Status import get_status_holder, TRIALLOG
 
 import sys
@@ -19,6 +20,7 @@ class Upload:
         self.picker = picker
         self.config = config
         self.max_slice_length = config['max_slice_length']
+        self.upload_sendfile = config.get('upload_sendfile', False) and sendfile_supported()
         self.choked = True
         self.cleared = True
         self.interested = False
@@ -95,11 +97,21 @@ class Upload:
             self.was_ever_interested = True
             self.choker.interested(self.connection)
 
-    def get_upload_chunk(self):
+    def get_upload_chunk(self, regions_ok = False):
+        """ Returns (index, begin, hashlist, piece) for the next requested 
+        block. When regions_ok is set and the block is stored on disk 
+        in verified form, piece is a FilePiece to be sent with sendfile() 
+        instead of an array with the data. """
         if self.choked or not self.buffer:
             return None
         index, begin, length = self.buffer.pop(0)
-        if self.config['buffer_reads']:
+        piece = None
+        if regions_ok and self.upload_sendfile:
+            piece = self.storage.get_piece_regions(index, begin, length)
+            hashlist = []
+        if piece is not None:
+            pass
+        elif self.config['buffer_reads']:
             if index != self.piecedl:
                 if self.piecebuf:
                     self.piecebuf.release()
@@ -23,6 +23,7 @@ from Tribler.Core.BitTornado.parsedir import parsedir
 from NatCheck import NatCheck
 from T2T import T2TList
 from Filter import Filter
+from PeerStore import CompactPeerStore
 from Tribler.Core.BitTornado.subnetparse import IP_List, ipv6_to_ipv4, to_ipv4, is_valid_ip, is_ipv4
 from Tribler.Core.BitTornado.iprangeparse import IP_List as IP_Range_List
 from Tribler.Core.BitTornado.torrentlistparse import parsetorrentlist
@@ -148,6 +149,14 @@ def compact_peer_info(ip, port):
         s = ''  # not a valid IP, must be a domain name
     return s
 
+# bencode() of an announce reply with just these keys and compact peers
+COMPACT_REPLY_TEMPLATE = 'd8:completei%de10:incompletei%de8:intervali%de5:peers%d:%se'
+
+def bencode_compact_reply(data):
+    return COMPACT_REPLY_TEMPLATE % (data['complete'], data['incomplete'], 
+                                     data['interval'], len(data['peers']), 
+                                     data['peers'])
+
 def compact_ip(ip):
     return ''.join([chr(int(i)) for i in ip.split('.')])
 
@@ -220,7 +229,7 @@ class Tracker:
         self.downloads = self.state.setdefault('peers', {})
         self.completed = self.state.setdefault('completed', {})
 
-        self.becache = {}   # format: infohash: [[l1, s1], [l2, s2], [l3, s3]]
+        self.becache = {}   # format: infohash: [[l1, s1], [l2, s2], [l3, s3]], l3 and s3 are CompactPeerStores
         for infohash, ds in self.downloads.items():
             self.seedcount[infohash] = 0
             for x,y in ds.items():
@@ -717,7 +726,7 @@ class Tracker:
             cache = self.cached_t.setdefault(infohash, None)
             if ( not cache or len(cache[1]) < rsize
                  or cache[0] + self.config['tracker_min_time_between_cache_refreshes'] < clock() ):
-                bc = self.becache.setdefault(infohash,[[{}, {}], [{}, {}], [{}, {}]])
+                bc = self.get_becache(infohash)
                 cache = [ clock(), bc[0][0].values() + bc[0][1].values() ]
                 self.cached_t[infohash] = cache
                 shuffle(cache[1])
@@ -732,55 +741,63 @@ class Tracker:
             data['peers'] = []
             return data
 
-        bc = self.becache.setdefault(infohash,[[{}, {}], [{}, {}], [{}, {}]])
+        bc = self.get_becache(infohash)
         len_l = len(bc[0][0])
         len_s = len(bc[0][1])
         if not (len_l+len_s):   # caches are empty!
             data['peers'] = []
             return data
         l_get_size = int(float(rsize)*(len_l)/(len_l+len_s))
-        cache = self.cached.setdefault(infohash,[None,None,None])[return_type]
-        if cache and ( not cache[1]
-                       or (is_seed and len(cache[1]) < rsize)
-                       or len(cache[1]) < l_get_size
-                       or cache[0]+self.config['tracker_min_time_between_cache_refreshes'] < self.cachetime ):
-            cache = None
-        if not cache:
-            peers = self.downloads[infohash]
-            vv = [[],[],[]]
-            for key, ip, port in self.t2tlist.harvest(infohash):   # empty if disabled
-                if not peers.has_key(key):
-                    vv[0].append({'ip': ip, 'port': port, 'peer id': key})
-                    vv[1].append({'ip': ip, 'port': port})
-                    vv[2].append(compact_peer_info(ip, port))
-            cache = [ self.cachetime,
-                      bc[return_type][0].values()+vv[return_type],
-                      bc[return_type][1].values() ]
-            shuffle(cache[1])
-            shuffle(cache[2])
-            self.cached[infohash][return_type] = cache
-            for rr in xrange(len(self.cached[infohash])):
-                if rr != return_type:
-                    try:
-                        self.cached[infohash][rr][1].extend(vv[rr])
-                    except:
-                        pass
-        if len(cache[1]) < l_get_size:
-            peerdata = cache[1]
-            if not is_seed:
-                peerdata.extend(cache[2])
-            cache[1] = []
-            cache[2] = []
+        if return_type == 2 and not self.t2tlist.enabled:
+            # Compact peers are kept in random order, just take a slice 
+            # instead of building and shuffling a cache of them.
+            if is_seed:
+                peerdata = [bc[2][0].sample(rsize)]
+            else:
+                peerdata = [bc[2][0].sample(l_get_size), bc[2][1].sample(rsize-l_get_size)]
         else:
-            if not is_seed:
-                peerdata = cache[2][l_get_size-rsize:]
-                del cache[2][l_get_size-rsize:]
-                rsize -= len(peerdata)
+            cache = self.cached.setdefault(infohash,[None,None,None])[return_type]
+            if cache and ( not cache[1]
+                           or (is_seed and len(cache[1]) < rsize)
+                           or len(cache[1]) < l_get_size
+                           or cache[0]+self.config['tracker_min_time_between_cache_refreshes'] < self.cachetime ):
+                cache = None
+            if not cache:
+                peers = self.downloads[infohash]
+                vv = [[],[],[]]
+                for key, ip, port in self.t2tlist.harvest(infohash):   # empty if disabled
+                    if not peers.has_key(key):
+                        vv[0].append({'ip': ip, 'port': port, 'peer id': key})
+                        vv[1].append({'ip': ip, 'port': port})
+                        vv[2].append(compact_peer_info(ip, port))
+                cache = [ self.cachetime,
+                          bc[return_type][0].values()+vv[return_type],
+                          bc[return_type][1].values() ]
+                shuffle(cache[1])
+                shuffle(cache[2])
+                self.cached[infohash][return_type] = cache
+                for rr in xrange(len(self.cached[infohash])):
+                    if rr != return_type:
+                        try:
+                            self.cached[infohash][rr][1].extend(vv[rr])
+                        except:
+                            pass
+            if len(cache[1]) < l_get_size:
+                peerdata = cache[1]
+                if not is_seed:
+                    peerdata.extend(cache[2])
+                cache[1] = []
+                cache[2] = []
             else:
-                peerdata = []
-            if rsize:
-                peerdata.extend(cache[1][-rsize:])
-                del cache[1][-rsize:]
+                if not is_seed:
+                    peerdata = cache[2][l_get_size-rsize:]
+                    del cache[2][l_get_size-rsize:]
+                    rsize -= len(peerdata)
+                else:
+                    peerdata = []
+                if rsize:
+                    peerdata.extend(cache[1][-rsize:])
+                    del cache[1][-rsize:]
 
         # PREDEFSEED
         if 'tracker_send_predefseeds' in self.config and self.config['tracker_send_predefseeds'] == True:
@@ -935,20 +952,30 @@ class Tracker:
 
         if paramslist.has_key('scrape'):
             data['scrape'] = self.scrapedata(infohash, False)
-            
+        
+        if len(data) == 4 and type(data['peers']) == StringType:
+            # Usual compact reply
+            return (200, 'OK', {'Content-Type': 'text/plain', 'Pragma': 'no-cache'}, bencode_compact_reply(data))
         return (200, 'OK', {'Content-Type': 'text/plain', 'Pragma': 'no-cache'}, bencode(data))
 
 
     def natcheckOK(self, infohash, peerid, ip, port, not_seed):
         if DEBUG:
             print >>sys.stderr,"tracker: natcheck: Recorded succes"
-        bc = self.becache.setdefault(infohash,[[{}, {}], [{}, {}], [{}, {}]])
+        bc = self.get_becache(infohash)
         bc[0][not not_seed][peerid] = Bencached(bencode({'ip': ip, 'port': port,
                                               'peer id': peerid}))
         bc[1][not not_seed][peerid] = Bencached(bencode({'ip': ip, 'port': port}))
         bc[2][not not_seed][peerid] = compact_peer_info(ip, port)
 
 
+    def get_becache(self, infohash):
+        bc = self.becache.get(infohash)
+        if bc is None:
+            bc = [[{}, {}], [{}, {}], [CompactPeerStore(), CompactPeerStore()]]
+            self.becache[infohash] = bc
+        return bc
+
     def natchecklog(self, peerid, ip, port, result):
         year, month, day, hour, minute, second, a, b, c = localtime(time())
         print '%s - %s [%02d/%3s/%04d:%02d:%02d:%02d] "!natcheck-%s:%i" %i 0 - -' % (
@@ -1,7 +1,7 @@
 # Written by Bram Cohen and Pawel Garbacki
 # see LICENSE.txt for license information
 
-from bisect import insort
+from heapq import heappush, heappop, heapify
 from SocketHandler import SocketHandler
 import socket
 from cStringIO import StringIO
@@ -61,7 +61,14 @@ class RawServer:
         self.failfunc = failfunc
         self.errorfunc = errorfunc
         self.exccount = 0
+        # Heap of [when, seqno, func, id] entries. The sequence number keeps
+        # tasks scheduled for the same time in FIFO order. Cancelled entries
+        # get their func set to None and are dropped when they surface.
         self.funcs = []
+        self.funcseq = 0
+        # {id: {seqno: entry}} for O(1) cancellation of all tasks with an id
+        self.funcids = {}
+        self.ncancelled = 0
         self.externally_added = []
         self.finished = Event()
         self.tasks_to_kill = []
@@ -83,7 +90,38 @@ class RawServer:
     def _add_task(self, func, delay, id = None):
         if delay < 0:
             delay = 0
-        insort(self.funcs, (clock() + delay, func, id))
+        self.funcseq += 1
+        entry = [clock() + delay, self.funcseq, func, id]
+        if id is not None:
+            self.funcids.setdefault(id, {})[self.funcseq] = entry
+        heappush(self.funcs, entry)
+
+    def _pop_task(self):
+        """ Returns the (func, id) of the first live task in the queue or 
+        None when no task is due. Cancelled entries are discarded. """
+        now = clock()
+        while self.funcs and self.funcs[0][0] <= now:
+            entry = heappop(self.funcs)
+            func, id = entry[2], entry[3]
+            if func is None:
+                self.ncancelled -= 1
+                continue
+            if id is not None:
+                ids = self.funcids.get(id)
+                if ids is not None:
+                    ids.pop(entry[1], None)
+                    if not ids:
+                        del self.funcids[id]
+            return func, id
+        return None
+
+    def _next_task_time(self):
+        while self.funcs and self.funcs[0][2] is None:
+            heappop(self.funcs)
+            self.ncancelled -= 1
+        if self.funcs:
+            return self.funcs[0][0]
+        return None
 
     def add_task(self, func, delay = 0, id = None):
         #if DEBUG:
@@ -123,10 +161,11 @@ class RawServer:
 
     def pop_external(self):
         self.lock.acquire()
-        while self.externally_added:
-            (a, b, c) = self.externally_added.pop(0)
-            self._add_task(a, b, c)
+        added = self.externally_added
+        self.externally_added = []
         self.lock.release()
+        for (a, b, c) in added:
+            self._add_task(a, b, c)
 
     def listen_forever(self, handler):
         if DEBUG:
@@ -139,8 +178,9 @@ class RawServer:
                 try:
                     self.pop_external()
                     self._kill_tasks()
-                    if self.funcs:
-                        period = self.funcs[0][0] + 0.001 - clock()
+                    when = self._next_task_time()
+                    if when is not None:
+                        period = when + 0.001 - clock()
                     else:
                         period = 2 ** 30
                     if period < 0:
@@ -158,10 +198,11 @@ class RawServer:
                     
                     #print >>sys.stderr,"RawServer: funcs is",`self.funcs`
                     
-                    while self.funcs and self.funcs[0][0] <= clock():
-                        garbage1, func, id = self.funcs.pop(0)
-                        if id in self.tasks_to_kill:
-                            pass
+                    while True:
+                        task = self._pop_task()
+                        if task is None:
+                            break
+                        func, id = task
                         try:
 #                            print func.func_name
                             if DEBUG:
@@ -229,12 +270,20 @@ class RawServer:
 
     def _kill_tasks(self):
         if self.tasks_to_kill:
-            new_funcs = []
-            for (t, func, id) in self.funcs:
-                if id not in self.tasks_to_kill:
-                    new_funcs.append((t, func, id))
-            self.funcs = new_funcs
+            tokill = self.tasks_to_kill
             self.tasks_to_kill = []
+            for id in tokill:
+                ids = self.funcids.pop(id, None)
+                if ids is None:
+                    continue
+                for entry in ids.itervalues():
+                    entry[2] = None
+                self.ncancelled += len(ids)
+            # Rebuild when the heap is mostly garbage
+            if self.ncancelled > 1024 and self.ncancelled > len(self.funcs) / 2:
+                self.funcs = [entry for entry in self.funcs if entry[2] is not None]
+                heapify(self.funcs)
+                self.ncancelled = 0
 
     def kill_tasks(self, id):
         self.tasks_to_kill.append(id)
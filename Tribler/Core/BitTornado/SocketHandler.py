@@ -4,13 +4,19 @@
 import socket
 import errno
 try:
-    from select import poll, POLLIN, POLLOUT, POLLERR, POLLHUP
+    # Linux: epoll scales with the number of active, not registered, sockets
+    from epollpoll import poll, POLLIN, POLLOUT, POLLERR, POLLHUP
     timemult = 1000
 except ImportError:
-    from selectpoll import poll, POLLIN, POLLOUT, POLLERR, POLLHUP
-    timemult = 1
+    try:
+        from select import poll, POLLIN, POLLOUT, POLLERR, POLLHUP
+        timemult = 1000
+    except ImportError:
+        from selectpoll import poll, POLLIN, POLLOUT, POLLERR, POLLHUP
+        timemult = 1
 from time import sleep
 from clock import clock
+from filesender import FileRegion
 import sys
 from random import shuffle, randrange
 from traceback import print_exc
@@ -25,6 +31,11 @@ DEBUG = False
 
 all = POLLIN | POLLOUT
 
+# SingleSocket.try_write: consecutive queued messages shorter than SMALL_WRITE
+# are merged into a single send() of at most COALESCE_WRITE bytes
+SMALL_WRITE = 1024
+COALESCE_WRITE = 16384
+
 if sys.platform == 'win32':
     SOCKET_BLOCK_ERRORCODE=10035    # WSAEWOULDBLOCK
 else:
@@ -93,6 +104,8 @@ class SingleSocket:
         self.socket = sock
         self.handler = handler
         self.buffer = []
+        # Bytes of self.buffer[0] that have already been sent
+        self.bufferoffset = 0
         self.last_hit = clock()
         self.fileno = sock.fileno()
         self.connected = False
@@ -167,6 +180,7 @@ class SingleSocket:
         sock = self.socket
         self.socket = None
         self.buffer = []
+        self.bufferoffset = 0
         del self.socket_handler.single_sockets[self.fileno]
         self.socket_handler.poll.unregister(sock)
         sock.close()
@@ -192,23 +206,76 @@ class SingleSocket:
             if len(self.buffer) == 1:
                 self.try_write()
 
+    def writev(self, parts):
+        """ Queue a list of strings, buffers or FileRegions, e.g. a message 
+        header and a piece payload, without concatenating them first. """
+        if self.socket is None:
+            return
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return
+        wasempty = not self.buffer
+        self.buffer.extend(parts)
+        if self.socket_handler.socketwritealways or wasempty:
+            self.try_write()
+
+    def _next_chunk(self):
+        """ Returns the data to pass to send(). Runs of small queued 
+        messages (HAVEs, REQUESTs, headers) are coalesced to save syscalls, 
+        large payloads are sent from a buffer() without copying. """
+        buf = self.buffer[0]
+        if isinstance(buf, FileRegion):
+            return buf
+        if self.bufferoffset:
+            buf = buffer(buf, self.bufferoffset)
+        if len(buf) >= SMALL_WRITE or len(self.buffer) == 1:
+            return buf
+        parts = [buf]
+        total = len(buf)
+        for i in xrange(1, len(self.buffer)):
+            nxt = self.buffer[i]
+            if (len(nxt) >= SMALL_WRITE or total + len(nxt) > COALESCE_WRITE
+                or isinstance(nxt, FileRegion)):
+                break
+            parts.append(nxt)
+            total += len(nxt)
+        if len(parts) == 1:
+            return buf
+        return ''.join([str(p) for p in parts])
+
+    def _consume(self, amount):
+        """ Drop amount bytes from the head of the send queue """
+        while amount:
+            left = len(self.buffer[0]) - self.bufferoffset
+            if amount < left:
+                self.bufferoffset += amount
+                return
+            amount -= left
+            del self.buffer[0]
+            self.bufferoffset = 0
+
     def try_write(self):
         
         if self.connected:
             dead = False
             try:
                 while self.buffer:
-                    buf = self.buffer[0]
-                    amount = self.socket.send(buf)
+                    buf = self._next_chunk()
+                    if isinstance(buf, FileRegion):
+                        # sendfile: from disk to socket without copying
+                        want = len(buf) - self.bufferoffset
+                        amount = buf.send(self.socket, self.bufferoffset)
+                    else:
+                        want = len(buf)
+                        amount = self.socket.send(buf)
                     self.data_sent += amount # RePEX: Measurement TODO: Remove when measurement test has been done
                     if amount == 0:
                         self.skipped += 1
                         break
                     self.skipped = 0
-                    if amount != len(buf):
-                        self.buffer[0] = buf[amount:]
+                    self._consume(amount)
+                    if amount != want:
                         break
-                    del self.buffer[0]
             except socket.error, e:
                 #if DEBUG:
                 #    print_exc(file=sys.stderr)
@@ -2,6 +2,9 @@
 # see LICENSE.txt for license information
 
 import sys
+import re
+from binascii import hexlify, unhexlify
+from string import maketrans
 
 try:
     True
@@ -10,29 +13,46 @@ except:
     False = 0
     bool = lambda x: not not x
 
-try:
-    sum([1])
-    negsum = lambda a: len(a) - sum(a)
-except:
-    negsum = lambda a: reduce(lambda x, y: x + (not y), a, 0)
-    
-def _int_to_booleans(x):
-    r = []
-    for i in range(8):
-        r.append(bool(x & 0x80))
-        x <<= 1
-    return tuple(r)
-
-lookup_table = []
-reverse_lookup_table = {}
-for i in xrange(256):
-    x = _int_to_booleans(i)
-    lookup_table.append(x)
-    reverse_lookup_table[x] = chr(i)
+# The bits are kept unpacked, one byte per piece with value 0 or 1, in a
+# bytearray. That keeps indexing as cheap as with a list of booleans, while
+# counting, searching and converting from and to the packed wire format
+# are done by C code instead of a Python loop per piece. For the latter the
+# bytes are translated to a string of '0' and '1' characters, which
+# int(x, 2) and bin() convert from and to a long.
+_tochars = maketrans('\x00\x01', '01')
+_fromchars = maketrans('01', '\x00\x01')
+_nonzero = re.compile('[^\x00]+')
+
+
+def _pack(array):
+    """ Returns the bytes as a bitstring in the format of a BITFIELD 
+    message. """
+    if not array:
+        return ''
+    extra = -len(array) % 8
+    h = '%x' % int(str(array).translate(_tochars) + '0' * extra, 2)
+    return unhexlify(h.zfill((len(array) + extra) / 4))
+
+def _unpack(bitstring):
+    """ Returns the bits in the bitstring as a bytearray """
+    if not bitstring:
+        return bytearray()
+    b = bin(int(hexlify(bitstring), 16))[2:]
+    return bytearray(b.zfill(len(bitstring) * 8).translate(_fromchars))
+
+def _tolong(array):
+    if not array:
+        return 0
+    return int(str(array).translate(_tochars), 2)
+
+def _fromlong(x, length):
+    if not length:
+        return bytearray()
+    return bytearray(bin(x)[2:].zfill(length).translate(_fromchars))
 
 
 class Bitfield:
-    def __init__(self, length = None, bitstring = None, copyfrom = None, fromarray = None, calcactiveranges=False):
+    def __init__(self, length = None, bitstring = None, copyfrom = None, fromarray = None, calcactiveranges=False, fromlong = None):
         """
         STBSPEED 
         @param calcactivetanges   Calculate which parts of the piece-space 
@@ -41,11 +61,13 @@ class Bitfield:
         """
         
         self.activeranges = []
+        self.bitstring = None
         
         if copyfrom is not None:
             self.length = copyfrom.length
             self.array = copyfrom.array[:]
             self.numfalse = copyfrom.numfalse
+            self.bitstring = copyfrom.bitstring
             return
         if length is None:
             raise ValueError, "length must be provided unless copying from another array"
@@ -54,61 +76,40 @@ class Bitfield:
             extra = len(bitstring) * 8 - length
             if extra < 0 or extra >= 8:
                 raise ValueError
-            t = lookup_table
-            r = []
-            
-            chr0 = chr(0)
-            inrange = False
-            startpiece = 0
-            countpiece = 0
-            for c in bitstring:
-                r.extend(t[ord(c)])
-        
-                # STBSPEED        
-                if calcactiveranges:
-                    if c != chr0:
-                        # Non-zero value, either start or continuation of range
-                        if inrange:
-                            # Stay in activerange
-                            pass
-                        else:
-                            # Start activerange
-                            startpiece = countpiece
-                            inrange = True
-                    else:
-                        # Zero, either end or continuation of zeroness
-                        if inrange:
-                            # End of activerange
-                            self.activeranges.append((startpiece,countpiece))
-                            inrange = False
-                        else:
-                            # Stay in zero
-                            pass
-                    countpiece += 8
+            if extra > 0 and ord(bitstring[-1]) & ((1 << extra) - 1):
+                raise ValueError
 
+            # STBSPEED
             if calcactiveranges:
-                if inrange:
-                    # activerange ended at end of piece space 
-                    self.activeranges.append((startpiece,min(countpiece,self.length-1)))
-                       
+                for m in _nonzero.finditer(bitstring):
+                    if m.end() == len(bitstring):
+                        # activerange ended at end of piece space 
+                        self.activeranges.append((m.start()*8,min(m.end()*8,self.length-1)))
+                    else:
+                        self.activeranges.append((m.start()*8,m.end()*8))
+
+            r = _unpack(bitstring)
             if extra > 0:
-                if r[-extra:] != [0] * extra:
-                    raise ValueError
                 del r[-extra:]
             self.array = r
-            self.numfalse = negsum(r)
+            self.numfalse = length - r.count('\x01')
+            self.bitstring = str(bitstring)
             
         elif fromarray is not None:
-            self.array = fromarray
-            self.numfalse = negsum(self.array)
+            self.array = bytearray(map(bool, fromarray))
+            self.numfalse = len(self.array) - self.array.count('\x01')
+        elif fromlong:
+            self.array = _fromlong(fromlong, length)
+            self.numfalse = length - self.array.count('\x01')
         else:
-            self.array = [False] * length
+            self.array = bytearray(length)
             self.numfalse = length
 
     def __setitem__(self, index, val):
         val = bool(val)
         self.numfalse += self.array[index]-val
         self.array[index] = val
+        self.bitstring = None
 
     def __getitem__(self, index):
         return self.array[index]
@@ -117,25 +118,19 @@ class Bitfield:
         return self.length
 
     def tostring(self):
-        booleans = self.array
-        t = reverse_lookup_table
-        s = len(booleans) % 8
-        r = [ t[tuple(booleans[x:x+8])] for x in xrange(0, len(booleans)-s, 8) ]
-        if s:
-            r += t[tuple(booleans[-s:] + ([0] * (8-s)))]
-        return ''.join(r)
+        # Cached, so sending our bitfield to many peers packs it only once
+        if self.bitstring is None:
+            self.bitstring = _pack(self.array)
+        return self.bitstring
 
     def complete(self):
         return not self.numfalse
 
     def copy(self):
-        return self.array[:self.length]
+        return map(bool, self.array)
 
     def toboollist(self):
-        bools = [False] * self.length
-        for piece in range(0,self.length):
-            bools[piece] = self.array[piece]
-        return bools
+        return map(bool, self.array)
 
     def get_active_ranges(self):
         # STBSPEED
@@ -144,6 +139,60 @@ class Bitfield:
     def get_numtrue(self):
         return self.length - self.numfalse
 
+    def tolong(self):
+        """ Returns the Bitfield as a long, with piece 0 as the most 
+        significant bit. """
+        if self.numfalse == self.length:
+            return 0
+        if self.bitstring is not None:
+            extra = len(self.bitstring) * 8 - self.length
+            return int(hexlify(self.bitstring), 16) >> extra
+        return _tolong(self.array)
+
+    def union(self, other):
+        """ Returns a Bitfield with the pieces in this or the other
+        Bitfield, which must have the same length. """
+        return Bitfield(self.length, fromlong = self.tolong() | other.tolong())
+
+    def intersection(self, other):
+        """ Returns a Bitfield with the pieces in both this and the other
+        Bitfield, which must have the same length. """
+        return Bitfield(self.length, fromlong = self.tolong() & other.tolong())
+
+    def difference(self, other):
+        """ Returns a Bitfield with the pieces in this but not in the other
+        Bitfield, which must have the same length. """
+        return Bitfield(self.length, fromlong = self.tolong() & ~other.tolong())
+
+    def first_missing(self, start = 0, end = None):
+        """ Returns the first piece in [start,end) that is not in the 
+        Bitfield, or -1 if there is none. """
+        if end is None:
+            end = self.length
+        return self.array.find('\x00', start, end)
+
+    def get_true_pieces(self, start = 0, end = None):
+        """ Returns a list of the pieces in [start,end) that are in the 
+        Bitfield. """
+        if end is None:
+            end = self.length
+        pieces = []
+        find = self.array.find
+        i = find('\x01', start, end)
+        while i != -1:
+            pieces.append(i)
+            i = find('\x01', i+1, end)
+        return pieces
+
+    def clear_range(self, start, end):
+        """ Removes the pieces in [start,end) from the Bitfield. """
+        start, end, _ = slice(start, end).indices(self.length)
+        if start >= end:
+            return
+        self.numfalse += self.array.count('\x01', start, end)
+        self.array[start:end] = bytearray(end - start)
+        self.bitstring = None
+
 
 def test_bitfield():
     try:
@@ -224,3 +273,19 @@ def test_bitfield():
     assert len(x) == 8
     assert x.numfalse == 5
     assert x.tostring() == chr(0xC4)
+    y = Bitfield(8, chr(0x0F))
+    assert x.intersection(y).tostring() == chr(0x04)
+    assert x.difference(y).tostring() == chr(0xC0)
+    assert x.difference(y).numfalse == 6
+    assert x.union(y).tostring() == chr(0xCF)
+    assert x.tolong() == 0xC4
+    assert Bitfield(9, chr(0x80) + chr(0x80)).tolong() == 0x101
+    assert Bitfield(9, fromlong = 0x101).tostring() == chr(0x80) + chr(0x80)
+    assert x.first_missing() == 2
+    assert x.first_missing(3, 5) == 3
+    assert x.first_missing(0, 2) == -1
+    assert x.get_true_pieces() == [0, 1, 5]
+    assert x.get_true_pieces(1, 5) == [1]
+    x.clear_range(0, 2)
+    assert x.numfalse == 7
+    assert x.tostring() == chr(0x04)
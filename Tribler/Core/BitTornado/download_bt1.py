@@ -11,6 +11,7 @@ from BT1.Choker import Choker
 from BT1.Storage import Storage
 from BT1.StorageWrapper import StorageWrapper
 from BT1.FileSelector import FileSelector
+from BT1.ResumeIndex import ResumeIndex
 from BT1.Uploader import Upload
 from BT1.Downloader import Downloader
 from BT1.GetRightHTTPDownloader import GetRightHTTPDownloader
@@ -20,6 +21,7 @@ from RateLimiter import RateLimiter
 from BT1.Encrypter import Encoder
 from RawServer import RawServer, autodetect_socket_style
 from BT1.Rerequester import Rerequester
+from BT1.TrackerClient import get_tracker_client
 from BT1.DownloaderFeedback import DownloaderFeedback
 from RateMeasure import RateMeasure
 from CurrentRateMeasure import Measure,TimeKeeper
@@ -31,6 +33,7 @@ from os import path, makedirs, listdir
 from parseargs import parseargs, formatDefinitions, defaultargs
 from socket import error as socketerror
 from random import seed
+from binascii import hexlify
 from threading import Event
 from clock import clock
 import re
@@ -97,6 +100,7 @@ class BT1Download:
         self.downloader = None
         self.storagewrapper = None
         self.fileselector = None
+        self.resumeindex = None
         self.super_seeding_active = False
         self.filedatflag = Event()
         self.spewflag = Event()
@@ -308,6 +312,7 @@ class BT1Download:
             self.storage.set_readonly()
         except (IOError, OSError), e:
             self.errorfunc('trouble setting readonly at end - ' + str(e))
+        self._save_resumeindex()
         if self.superseedflag.isSet():
             self._set_super_seed()
         self.choker.set_round_robin_period(
@@ -328,6 +333,25 @@ class BT1Download:
         else:
             return True
 
+    def _live_piece_checked(self,index,ok,guard):
+        """ Called by the StorageWrapper when the signature check of a live
+        piece has finished. Does what Downloader and Connecter do when a 
+        piece completes or fails right away. """
+        if self.doneflag.isSet():
+            return
+        if ok:
+            self.picker.complete(index)
+            self.downloader.check_complete(index)
+            self.connecter.got_piece(index)
+        else:
+            self.downloader.piece_flunked(index)
+            if guard is not None and guard.download is not None:
+                connection = guard.download.connection
+                if connection.is_live_source():
+                    print >>sys.stderr,"BT1Download: Got piece from live source that failed check, but keeping connection"
+                else:
+                    connection.close()
+
     def _failed(self, reason):
         self.failed = True
         self.doneflag.set()
@@ -383,6 +407,12 @@ class BT1Download:
                                              self.rawserver.add_task, 
                                              self._failed)
 
+            self.resumeindex = self._make_resumeindex()
+            if not resumedata and self.resumeindex is not None:
+                resumedata = self.resumeindex.load()
+                if DEBUG and resumedata:
+                    print >>sys.stderr,"BT1Download: initFiles: restored from resume index"
+
             if resumedata:
                 self.fileselector.unpickle(resumedata)
                 
@@ -392,6 +422,21 @@ class BT1Download:
         return self.storagewrapper.initialize
 
 
+    def _make_resumeindex(self):
+        if not self.config.get('resume_index', True) or self.info.has_key('live'):
+            return None
+        dir = os.path.join(self.config['state_dir'], STATEDIR_RESUMEINDEX_DIR)
+        if not os.path.isdir(dir):
+            return None
+        filename = os.path.join(dir, hexlify(self.infohash)+'.resume')
+        resumeindex = ResumeIndex(filename, self.storage, len(self.pieces))
+        self.storagewrapper.set_resumeindex(resumeindex)
+        return resumeindex
+
+    def _save_resumeindex(self):
+        if self.resumeindex is not None:
+            self.storagewrapper.save_resumeindex(self.fileselector.get_priorities())
+
     def _make_upload(self, connection, ratelimiter, totalup):
         return Upload(connection, ratelimiter, totalup, 
                       self.choker, self.storagewrapper, self.picker, 
@@ -436,6 +481,9 @@ class BT1Download:
             return
         
         self.checking = False
+        # Record the result of the hash check, further pieces are added as 
+        # they come in
+        self._save_resumeindex()
 
         # Arno, 2010-08-11: STBSPEED: if at all, loop only over pieces I have, 
         # not piece range.
@@ -562,6 +610,9 @@ class BT1Download:
                 if DEBUG:
                     print >>sys.stderr,"BT1Download: startEngine: Going into VOD mode",self.videoinfo
                 self.voddownload = MovieOnDemandTransporter(self,self.videostatus,self.videoinfo,self.videoanalyserpath,vodeventfunc,self.ghttpdownloader)
+                if self.videostatus.live_streaming and self.voddownload.authenticator is not None:
+                    # LIVESOURCEAUTH: check signatures off the network thread
+                    self.storagewrapper.set_live_authenticator(self.voddownload.authenticator, self._live_piece_checked)
                 
         elif DEBUG:
             print >>sys.stderr,"BT1Download: startEngine: Going into standard mode"
@@ -632,7 +683,8 @@ class BT1Download:
             self.myid, self.infohash, self.config['http_timeout'], 
             self.logerrorfunc, self.excfunc, self.config['max_initiate'], 
             self.doneflag, self.upmeasure.get_rate, self.downmeasure.get_rate, 
-            self.unpauseflag,self.config)
+            self.unpauseflag,self.config,
+            get_tracker_client(self.rawserver.rawserver))
 
         if self.play_video and self.voddownload is not None:
             rerequest.add_notifier( lambda x: self.voddownload.peers_from_tracker_report( len( x ) ) )
@@ -667,8 +719,12 @@ class BT1Download:
             self.ratemeasure, self.storagewrapper.get_stats, 
             self.datalength, self.finflag, self.spewflag, self.statistics, 
             infohash = self.infohash,voddownload=self.voddownload)
+        self.feedback = d
         return d.gather
 
+    def get_stats_summary(self):
+        return self.feedback.gather_summary()
+
 
     def getPortHandler(self):
         return self.encoder
@@ -679,6 +735,7 @@ class BT1Download:
         if self.fileselector and self.started:
             # self.fileselector.finish() does nothing at the moment, so as
             # long as the network thread calls this, it should be OK.
+            self._save_resumeindex()
             return self.fileselector.pickle()
         else:
             return None
@@ -687,6 +744,10 @@ class BT1Download:
         if self.checking or self.started:
             self.storagewrapper.sync()
             self.storage.close()
+            if self.started and not self.failed:
+                self._save_resumeindex()
+            if self.resumeindex is not None:
+                self.resumeindex.close()
             self.rerequest_stopped()
         resumedata = None
         if self.fileselector and self.started:
@@ -0,0 +1,103 @@
+# see LICENSE.txt for license information
+#
+# poll() replacement on top of Linux epoll. select.poll() makes the kernel
+# walk the complete descriptor set on every call, which is expensive for
+# seeders with thousands of mostly idle connections. This class offers the
+# same register/unregister/poll interface as select.poll (timeouts in
+# milliseconds) so SocketHandler can use it as a drop-in replacement.
+
+import sys
+import errno
+import select
+
+if not sys.platform.startswith('linux') or not hasattr(select, 'epoll'):
+    raise ImportError('epoll not available on this platform')
+
+from select import POLLIN, POLLOUT, POLLERR, POLLHUP, error
+
+DEBUG = False
+
+# epoll uses the same bit values as poll on Linux, but be explicit
+_POLL2EPOLL = [ (POLLIN, select.EPOLLIN),
+                (POLLOUT, select.EPOLLOUT),
+                (POLLERR, select.EPOLLERR),
+                (POLLHUP, select.EPOLLHUP) ]
+
+
+def _to_epoll(t):
+    m = 0
+    for (p, e) in _POLL2EPOLL:
+        if t & p:
+            m |= e
+    return m
+
+def _from_epoll(m):
+    t = 0
+    for (p, e) in _POLL2EPOLL:
+        if m & e:
+            t |= p
+    return t
+
+
+class poll:
+    def __init__(self):
+        self.epoll = select.epoll()
+        # {fileno: epoll mask}
+        self.registered = {}
+
+    def register(self, f, t):
+        if not isinstance(f, (int, long)):
+            f = f.fileno()
+        m = _to_epoll(t)
+        # Always tell the kernel, even if the mask looks unchanged: a socket
+        # closed without unregister() leaves a stale entry in self.registered
+        # that a new socket may reuse the fileno of.
+        if f not in self.registered:
+            self._register(f, m)
+        else:
+            try:
+                self.epoll.modify(f, m)
+            except IOError, e:
+                # The kernel drops a descriptor from the epoll set when it is
+                # closed, so a reused fileno may not be known anymore.
+                if e.errno != errno.ENOENT:
+                    raise
+                self._register(f, m)
+        self.registered[f] = m
+
+    def _register(self, f, m):
+        try:
+            self.epoll.register(f, m)
+        except IOError, e:
+            if e.errno != errno.EEXIST:
+                raise
+            self.epoll.modify(f, m)
+
+    def unregister(self, f):
+        if not isinstance(f, (int, long)):
+            f = f.fileno()
+        # Same semantics as select.poll
+        del self.registered[f]
+        try:
+            self.epoll.unregister(f)
+        except (IOError, ValueError):
+            # Already closed, kernel removed it for us
+            if DEBUG:
+                print >>sys.stderr,"epollpoll: unregister of closed fileno",f
+
+    def poll(self, timeout = None):
+        if timeout is None or timeout < 0:
+            timeout = -1
+        else:
+            timeout = timeout / 1000.0
+        try:
+            events = self.epoll.poll(timeout)
+        except IOError, e:
+            # Make EINTR and friends look like select.poll() errors, which
+            # RawServer knows how to handle.
+            raise error(e.errno, e.strerror)
+        return [(f, _from_epoll(m)) for (f, m) in events]
+
+    def close(self):
+        self.epoll.close()
+        self.registered = {}
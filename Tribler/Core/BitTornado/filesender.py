@@ -0,0 +1,113 @@
+# see LICENSE.txt for license information
+#
+# Support for uploading piece data straight from the files in which it is
+# stored, using the sendfile() system call where available. A FileRegion
+# can be queued on a SingleSocket like a string; when it reaches the head of
+# the queue the kernel copies the data from the page cache to the socket
+# without it passing through Python.
+
+import os
+import sys
+import errno
+import socket
+from traceback import print_exc
+
+DEBUG = False
+
+_sendfile = None
+if hasattr(os, 'sendfile'):
+    def _sendfile(out_fd, in_fd, offset, count):
+        return os.sendfile(out_fd, in_fd, offset, count)
+elif sys.platform.startswith('linux'):
+    try:
+        import ctypes
+        import ctypes.util
+
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        try:
+            _libc_sendfile = _libc.sendfile64
+        except AttributeError:
+            _libc_sendfile = _libc.sendfile
+        _libc_sendfile.argtypes = [ ctypes.c_int, ctypes.c_int,
+                                    ctypes.POINTER(ctypes.c_longlong),
+                                    ctypes.c_size_t ]
+        _libc_sendfile.restype = ctypes.c_ssize_t
+
+        def _sendfile(out_fd, in_fd, offset, count):
+            off = ctypes.c_longlong(offset)
+            n = _libc_sendfile(out_fd, in_fd, ctypes.byref(off), count)
+            if n < 0:
+                e = ctypes.get_errno()
+                raise OSError(e, os.strerror(e))
+            return n
+    except:
+        if DEBUG:
+            print_exc()
+        _sendfile = None
+
+
+def sendfile_supported():
+    return _sendfile is not None
+
+
+class FileRegion:
+    """ Bytes [begin,end) of a file managed by a Storage object. The file
+    handle is looked up when the data is actually sent, so the region stays
+    valid when Storage closes handles to respect max_files_open. """
+
+    def __init__(self, storage, file, begin, end):
+        self.storage = storage
+        self.file = file
+        self.begin = begin
+        self.end = end
+
+    def __len__(self):
+        return int(self.end - self.begin)
+
+    def split(self, n):
+        """ Returns two regions, for the first n bytes and the rest """
+        mid = self.begin + n
+        return (FileRegion(self.storage, self.file, self.begin, mid),
+                FileRegion(self.storage, self.file, mid, self.end))
+
+    def send(self, sock, offset = 0):
+        """ Send as much of the region from offset onwards as the socket
+        accepts. Returns the number of bytes sent, raises socket.error like
+        socket.send() does. """
+        pos = self.begin + offset
+        count = self.end - pos
+        try:
+            if _sendfile is not None:
+                try:
+                    fd = self.storage.get_file_fileno(self.file)
+                    return _sendfile(sock.fileno(), fd, pos, count)
+                except OSError, e:
+                    if e.errno not in (errno.EINVAL, errno.ENOSYS):
+                        raise socket.error(e.errno, e.strerror)
+                    # File system does not support sendfile, read it ourselves
+                    if DEBUG:
+                        print >>sys.stderr,"filesender: sendfile failed, falling back",e
+            data = self.storage.read_region(self.file, pos, self.end)
+        except socket.error:
+            raise
+        except IOError, e:
+            # Storage errors end the connection, like any other write error
+            raise socket.error(errno.EIO, str(e))
+        return sock.send(data)
+
+
+class FilePiece:
+    """ A block of piece data described by FileRegions instead of a
+    string, as returned by StorageWrapper.get_piece_regions() """
+
+    def __init__(self, regions):
+        self.regions = regions
+        self.length = 0
+        for r in regions:
+            self.length += len(r)
+
+    def __len__(self):
+        return self.length
+
+    def tostring(self):
+        return ''.join([r.storage.read_region(r.file, r.begin, r.end) for r in self.regions])
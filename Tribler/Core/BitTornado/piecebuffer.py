@@ -58,6 +58,44 @@ class SingleBuffer:
         self.pool.release(self)
 
 
+class MappedBuffer:
+    """ Read-only piece data in a memory mapped file, see Storage.read_view().
+    Offers the same interface as SingleBuffer, but slicing returns another
+    MappedBuffer that refers to the same memory instead of a copy. """
+    def __init__(self, mapping, offset, length):
+        self.mapping = mapping
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getslice__(self, a, b):
+        if b > self.length:
+            b = self.length
+        if b < 0:
+            b += self.length
+        if a == 0 and b == self.length:
+            return self
+        return MappedBuffer(self.mapping, self.offset+a, max(b-a, 0))
+
+    def getbuffer(self):
+        """ Returns a buffer() on the data, for sending or hashing it
+        without copying """
+        return buffer(self.mapping, self.offset, self.length)
+
+    def tostring(self):
+        return self.mapping[self.offset:self.offset+self.length]
+
+    def getarray(self):
+        a = array('c')
+        a.fromstring(self.getbuffer())
+        return a
+
+    def release(self):
+        pass
+
+
 class BufferPool:
     def __init__(self):
         self.pool = []
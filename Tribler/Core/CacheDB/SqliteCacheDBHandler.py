@@ -1027,6 +1027,25 @@ class TorrentDBHandler(BasicDBHandler):
     
     __single = None    # used for multithreaded singletons pattern
     lock = threading.Lock()
+
+    # number of hits that searchNames() returns for remote queries, and the
+    # number of best seeded hits it ranks to select them
+    REMOTE_SEARCH_HITS = 20
+    REMOTE_SEARCH_CANDIDATES = 100
+
+    # max number of best seeded hits on keyword prefixes that searchNames()
+    # adds to the hits on whole keywords for local queries, and the number
+    # of hits on prefixes it selects them from
+    PREFIX_SEARCH_HITS = 200
+    PREFIX_SEARCH_CANDIDATES = 1000
+
+    # seconds after startup to start filling a new full-text index, the
+    # number of torrents added to it per transaction, and the seconds
+    # between transactions. SQLite's busy handler retries every 100 ms at
+    # most, so a shorter pause can keep other writers waiting.
+    NAME_INDEX_DELAY = 10
+    NAME_INDEX_BATCH = 1000
+    NAME_INDEX_PAUSE = 0.1
     
     def getInstance(*args, **kw):
         # Singleton pattern with double-checking
@@ -1098,6 +1117,111 @@ class TorrentDBHandler(BasicDBHandler):
 
         self.value_name_for_channel = ['C.torrent_id', 'infohash', 'name', 'torrent_file_name', 'length', 'creation_date', 'num_files', 'thumbnail', 'insert_time', 'secret', 'relevance', 'source_id', 'category_id', 'status_id', 'num_seeders', 'num_leechers', 'comment'] 
         
+        # name_index_created: the TorrentFTS full-text index exists and is
+        # kept up to date. name_index: it is complete and searchNames() uses it.
+        self.name_index_created = False
+        self.name_index = False
+        self._initNameIndex()
+
+    def _initNameIndex(self):
+        """ Creates the TorrentFTS full-text index on the keywords of torrent
+        names and file names if it does not exist yet. The docid of a row is
+        the torrent_id. New torrents are indexed when they are added, the
+        existing ones by _fillNameIndex() in the background. Until that is
+        done searchNames() searches the InvertedIndex, as it does when
+        SQLite has no full-text search support. """
+        if not self._db.fetchone(u"SELECT count(*) FROM sqlite_master WHERE name='TorrentFTS'"):
+            # Not through the transaction cache of execute_write(), which
+            # reports errors loudly. The FTS modules may not have been
+            # compiled into SQLite. The MyInfo entry holds the torrent_id up
+            # to which the index has been filled.
+            cur = self._db.getCursor()
+            cur.execute(u"BEGIN TRANSACTION")
+            try:
+                try:
+                    cur.execute(u'CREATE VIRTUAL TABLE TorrentFTS USING fts4(name, files, prefix="3")')
+                except:
+                    cur.execute(u'CREATE VIRTUAL TABLE TorrentFTS USING fts3(name, files)')
+            except:
+                cur.execute(u"ROLLBACK TRANSACTION")
+                print >> sys.stderr, "torrentdb: SQLite has no full-text search, searching the InvertedIndex"
+                return
+            try:
+                cur.execute(u"INSERT OR REPLACE INTO MyInfo (entry, value) VALUES ('TorrentFTS', '0')")
+            except:
+                print_exc()
+                cur.execute(u"ROLLBACK TRANSACTION")
+                return
+            cur.execute(u"COMMIT TRANSACTION")
+        self.name_index_created = True
+
+        position = self._db.fetchone(u"SELECT value FROM MyInfo WHERE entry='TorrentFTS'")
+        if position is None:
+            self.name_index = True
+            return
+
+        # Like the InvertedIndex upgrade in sqlitecachedb.py
+        from Tribler.Utilities.TimedTaskQueue import TimedTaskQueue
+        self.name_index_queue = TimedTaskQueue("IndexTorrentNames")
+        fill_lambda = lambda:self._readFileKeywords(int(position), {}, 0)
+        self.name_index_queue.add_task(fill_lambda, self.NAME_INDEX_DELAY)
+
+    def _readFileKeywords(self, position, filewords, rowid):
+        """ Collects the keywords of all torrents in filewords, reading the
+        InvertedIndex in short queries so writers are not kept waiting. It
+        has no index on torrent_id, so it cannot be read per torrent. """
+        records = self._db.fetchall(u"SELECT rowid, torrent_id, word FROM InvertedIndex WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                                    (rowid, 20*self.NAME_INDEX_BATCH))
+        for rowid, torrent_id, word in records:
+            filewords.setdefault(torrent_id, []).append(word)
+        if records:
+            read_lambda = lambda:self._readFileKeywords(position, filewords, rowid)
+            self.name_index_queue.add_task(read_lambda, self.NAME_INDEX_PAUSE)
+        else:
+            fill_lambda = lambda:self._fillNameIndex(position, filewords, time())
+            self.name_index_queue.add_task(fill_lambda)
+
+    def _fillNameIndex(self, position, filewords, t1):
+        """ Adds the torrents after torrent_id position to the full-text
+        index, NAME_INDEX_BATCH per transaction. Torrents that were indexed
+        when they were added are skipped. """
+        cur = self._db.getCursor()
+        # Take the write lock up front, a deferred transaction that reads
+        # first may fail to get it
+        cur.execute(u"BEGIN IMMEDIATE TRANSACTION")
+        try:
+            torrents = self._db.fetchall(u"SELECT torrent_id, name FROM Torrent WHERE torrent_id > ? AND name IS NOT NULL ORDER BY torrent_id LIMIT ?",
+                                         (position, self.NAME_INDEX_BATCH))
+            if torrents:
+                last = torrents[-1][0]
+                indexed = Set([docid for (docid,) in self._db.fetchall(u"SELECT docid FROM TorrentFTS WHERE docid > ? AND docid <= ?", (position, last))])
+                values = []
+                for torrent_id, name in torrents:
+                    if torrent_id not in indexed:
+                        values.append(self._nameIndexValues(torrent_id, split_into_keywords(name), filewords.get(torrent_id, [])))
+                if values:
+                    cur.executemany(u"INSERT INTO TorrentFTS(docid, name, files) VALUES(?, ?, ?)", values)
+                cur.execute(u"UPDATE MyInfo SET value=? WHERE entry='TorrentFTS'", (str(last),))
+            else:
+                cur.execute(u"DELETE FROM MyInfo WHERE entry='TorrentFTS'")
+        except:
+            # Continued at the next start
+            print_exc()
+            cur.execute(u"ROLLBACK TRANSACTION")
+            return
+        cur.execute(u"COMMIT TRANSACTION")
+
+        if torrents:
+            fill_lambda = lambda:self._fillNameIndex(last, filewords, t1)
+            self.name_index_queue.add_task(fill_lambda, self.NAME_INDEX_PAUSE)
+        else:
+            self.name_index = True
+            print >> sys.stderr, "torrentdb: Filled the full-text index in %.1fs" % (time()-t1)
+
+    def _nameIndexValues(self, torrent_id, name_keywords, file_keywords):
+        name_keywords = Set(name_keywords)
+        file_keywords = [keyword for keyword in file_keywords if keyword not in name_keywords]
+        return (torrent_id, u" ".join(name_keywords), u" ".join(file_keywords))
 
     def register(self, category, torrent_dir):
         self.category = category
@@ -1218,7 +1342,8 @@ class TorrentDBHandler(BasicDBHandler):
         # boudewijn: we are using a Set to ensure that all keywords
         # are unique.  no use having the database layer figuring this
         # out when we can do it now, in memory
-        keywords = Set(split_into_keywords(torrent_name))
+        name_keywords = split_into_keywords(torrent_name)
+        keywords = Set(name_keywords)
 
         # search through the .torrent file for potential keywords in
         # the filenames, but only add the 50 most used
@@ -1244,6 +1369,10 @@ class TorrentDBHandler(BasicDBHandler):
             self._db.executemany(u"INSERT OR IGNORE INTO InvertedIndex VALUES(?, ?)", values, commit=False)
             if DEBUG:
                 print >> sys.stderr, "torrentdb: Extending the InvertedIndex table with", len(values), "new keywords for", torrent_name
+
+        if self.name_index_created:
+            values = self._nameIndexValues(torrent_id, name_keywords, file_keywords)
+            self._db.execute_write(u"INSERT OR REPLACE INTO TorrentFTS(docid, name, files) VALUES(?, ?, ?)", values, commit=False)
         
         # vliegendhart: extract terms and bi-term phrase from Torrent and store it
         nb = NetworkBuzzDBHandler.getInstance()
@@ -1402,6 +1531,8 @@ class TorrentDBHandler(BasicDBHandler):
                 self._db.update(self.table_name, where="torrent_id=%d"%torrent_id, commit=commit, torrent_file_name=None)
             else:
                 self._db.delete(self.table_name, commit=commit, torrent_id=torrent_id)
+                if self.name_index_created:
+                    self._db.execute_write(u"DELETE FROM TorrentFTS WHERE docid = ?", (torrent_id,), commit=commit)
                 try:
                     # vliegendhart: synch bi-term phrase table
                     nb = NetworkBuzzDBHandler.getInstance()
@@ -1795,31 +1926,57 @@ class TorrentDBHandler(BasicDBHandler):
                       'channel_permid',
                       'channel_name']        
         
-        sql = ""
-        count = 0
-        for word in kws:
-            word = word.lower()
-            count += 1
-            sql += " select torrent_id from InvertedIndex where word='" + word + "' "
-            if count < len(kws):
-                sql += " intersect "
-        
-        mainsql = """select T.*, C.publisher_id as channel_permid, C.publisher_name as channel_name 
-                     from Torrent T LEFT OUTER JOIN ChannelCast C on T.infohash = C.infohash 
-                     where T.torrent_id in (%s) order by T.num_seeders desc """ % (sql)
-        if not local:
-            mainsql += " limit 20"
-            
-        results = self._db.fetchall(mainsql)
+        # Keywords from remote peers may contain anything, only use the
+        # alphanumeric parts. This also keeps out FTS query syntax.
+        words = []
+        for kw in kws:
+            words.extend(split_into_keywords(kw))
+        if not words:
+            return []
+
+        if self.name_index:
+            mainsql = """select T.*, C.publisher_id as channel_permid, C.publisher_name as channel_name 
+                         from TorrentFTS JOIN Torrent T on T.torrent_id = TorrentFTS.docid
+                         LEFT OUTER JOIN ChannelCast C on T.infohash = C.infohash 
+                         where TorrentFTS MATCH ? order by T.num_seeders desc """
+            # The best seeded hits on keyword prefixes are picked from a
+            # limited number of them, as a prefix can match a large part of
+            # the index.
+            prefixsql = """select T.*, C.publisher_id as channel_permid, C.publisher_name as channel_name 
+                           from Torrent T LEFT OUTER JOIN ChannelCast C on T.infohash = C.infohash 
+                           where T.torrent_id in (select docid from TorrentFTS where TorrentFTS MATCH ? limit %d)
+                           order by T.num_seeders desc limit %d """
+            # The hits on the whole keywords, plus hits on the prefix of the
+            # last keyword, which the user may still be typing, if there are
+            # few.
+            wordmatch = u" ".join(words)
+            if len(words[-1]) >= 3:
+                prefixmatch = u" ".join(words[:-1] + [words[-1]+u"*"])
+            else:
+                prefixmatch = None
+            if local:
+                results = self._db.fetchall(mainsql, [wordmatch])
+                if prefixmatch and len(results) < self.PREFIX_SEARCH_HITS:
+                    results += self._db.fetchall(prefixsql % (self.PREFIX_SEARCH_CANDIDATES, self.PREFIX_SEARCH_HITS), [prefixmatch])
+            else:
+                mainsql += " limit %d" % self.REMOTE_SEARCH_CANDIDATES
+                results = self._db.fetchall(mainsql, [wordmatch])
+                if prefixmatch and len(results) < self.REMOTE_SEARCH_HITS:
+                    results += self._db.fetchall(prefixsql % (self.PREFIX_SEARCH_CANDIDATES, self.REMOTE_SEARCH_CANDIDATES), [prefixmatch])
+        else:
+            sql = " intersect ".join(["select torrent_id from InvertedIndex where word=?"] * len(words))
+            mainsql = """select T.*, C.publisher_id as channel_permid, C.publisher_name as channel_name 
+                         from Torrent T LEFT OUTER JOIN ChannelCast C on T.infohash = C.infohash 
+                         where T.torrent_id in (%s) order by T.num_seeders desc """ % (sql)
+            if not local:
+                mainsql += " limit %d" % self.REMOTE_SEARCH_CANDIDATES
+            results = self._db.fetchall(mainsql, words)
         t2 = time()
-        sql = "select mod_id, sum(vote), count(*) from VoteCast group by mod_id order by 2 desc"
-        votecast_records = self._db.fetchall(sql)         
-        
-        votes = {}
-        for vote in votecast_records:
-            votes[vote[0]] = (vote[1], vote[2])
+        votes = VoteCastDBHandler.getInstance().getVoteSummary()
         t3 = time()
         
+        ranks = {}
+        seen = Set()
         torrents_dict = {}
         for result in results:
             a = time()
@@ -1831,6 +1988,11 @@ class TorrentDBHandler(BasicDBHandler):
                 torrent['channel_permid'] = ""
             if torrent['channel_name'] is None:
                 torrent['channel_name'] = ""
+
+            # skip hits on prefixes that were also hits on whole keywords
+            if (torrent['torrent_id'], torrent['channel_permid']) in seen:
+                continue
+            seen.add((torrent['torrent_id'], torrent['channel_permid']))
                             
             # check if this torrent belongs to more than one channel
             if torrent['infohash'] in torrents_dict:
@@ -1855,6 +2017,7 @@ class TorrentDBHandler(BasicDBHandler):
                 continue
             
             torrents_dict[torrent['infohash']] = torrent
+            ranks[torrent['infohash']] = self._rankNameMatch(torrent['name'], words)
             try:
                 torrent['source'] = self.id2src[torrent['source_id']]
             except:
@@ -1865,7 +2028,6 @@ class TorrentDBHandler(BasicDBHandler):
             torrent['category'] = [self.id2category[torrent['category_id']]]
             torrent['status'] = self.id2status[torrent['status_id']]
             torrent['simRank'] = ranksfind(None,torrent['infohash'])
-            torrent['infohash'] = str2bin(torrent['infohash'])
             #torrent['num_swarm'] = torrent['num_seeders'] + torrent['num_leechers']
             torrent['last_check_time'] = 0 #torrent['last_check']
             #del torrent['last_check']
@@ -1885,12 +2047,33 @@ class TorrentDBHandler(BasicDBHandler):
             
             #print >> sys.stderr, "hello.. %.3f,%.3f" %((time()-a), time())
         def compare(a,b):
-            return -1*cmp(a['num_seeders'], b['num_seeders'])
+            return -1*cmp((ranks.get(a['infohash'],0), a['num_seeders']), (ranks.get(b['infohash'],0), b['num_seeders']))
         torrent_list = torrents_dict.values()
         torrent_list.sort(compare)
+        if not local:
+            torrent_list = torrent_list[:self.REMOTE_SEARCH_HITS]
+        for torrent in torrent_list:
+            torrent['infohash'] = str2bin(torrent['infohash'])
         #print >> sys.stderr, "# hits:%d; search time:%.3f,%.3f,%.3f" % (len(torrent_list),t2-t1, t3-t2, time()-t1 )
         return torrent_list
 
+    def _rankNameMatch(self, name, words):
+        """ Scores a hit of searchNames(). A keyword scores 4 when it is a
+        word of the torrent name, 2 when it is the prefix of one, and 1 when
+        it only matched the file names. """
+        if name is None:
+            return len(words)
+        name_keywords = split_into_keywords(name)
+        score = 0
+        for word in words:
+            if word in name_keywords:
+                score += 4
+            elif [keyword for keyword in name_keywords if keyword.startswith(word)]:
+                score += 2
+            else:
+                score += 1
+        return score
+
     def selectTorrentsToCollect(self, permid, candidate_list=None, similarity_list_size=50, list_size=1):
         """ 
         select a torrent to collect from a given candidate list
@@ -2946,6 +3129,9 @@ class VoteCastDBHandler(BasicDBHandler):
 
     def __init__(self):
         VoteCastDBHandler.__single = self
+        # (sum,count) of votes per mod_id, see getVoteSummary()
+        self.vote_summary = None
+        self.vote_summary_gen = 0
         try:
             db = SQLiteCacheDB.getInstance()
             BasicDBHandler.__init__(self,db,'VoteCast')
@@ -2988,6 +3174,7 @@ class VoteCastDBHandler(BasicDBHandler):
             
         strvotedict = {'mod_id':bin2str(mod_id),'voter_id':bin2str(voter_id),'vote':vote,'time_stamp':time_stamp}
         self._db.insert(self.table_name, **strvotedict)        
+        self._votesChanged()
 
     def getVote(self,mod_id,voter_id):
         """ 
@@ -3007,6 +3194,7 @@ class VoteCastDBHandler(BasicDBHandler):
         """
         sql = 'Delete From VoteCast where mod_id==? and voter_id==?'
         self._db.execute_write(sql,(bin2str(mod_id),bin2str(voter_id),))
+        self._votesChanged()
 
     def deleteVotes(self, mod_id):
         """ 
@@ -3016,6 +3204,30 @@ class VoteCastDBHandler(BasicDBHandler):
         """
         sql = 'Delete From VoteCast where mod_id==?'
         self._db.execute_write(sql,(bin2str(mod_id),))
+        self._votesChanged()
+    
+    def _votesChanged(self):
+        # Called after every write to VoteCast
+        self.vote_summary_gen += 1
+        self.vote_summary = None
+
+    def getVoteSummary(self):
+        """
+        Return the sum and number of votes for every moderator. Cached until
+        the votes change.
+        @return dict {mod_id:(sum,count)} with mod_id as stored in the DB
+        """
+        summary = self.vote_summary
+        if summary is None:
+            gen = self.vote_summary_gen
+            sql = "select mod_id, sum(vote), count(*) from VoteCast group by mod_id"
+            summary = {}
+            for mod_id, votesum, count in self._db.fetchall(sql):
+                summary[mod_id] = (votesum, count)
+            # Don't cache if votes were written meanwhile
+            if gen == self.vote_summary_gen:
+                self.vote_summary = summary
+        return summary
     
     def getVotes(self,mod_id):
         """ 
@@ -3081,6 +3293,7 @@ class VoteCastDBHandler(BasicDBHandler):
         elif vote!=2:
             sql = "update VoteCast set vote=2 where mod_id==? and voter_id==?"
             self._db.execute_write(sql,(bin2str(mod_id),bin2str(self.my_permid),))    
+        self._votesChanged()
 
         self.notifier.notify(NTFY_CHANNELCAST, NTFY_UPDATE, mod_id)   
     
@@ -3094,6 +3307,7 @@ class VoteCastDBHandler(BasicDBHandler):
         if vote is not None and vote==2:
             sql = "delete from VoteCast where mod_id==? and voter_id==?"
             self._db.execute_write(sql,(bin2str(mod_id),bin2str(self.my_permid),))
+            self._votesChanged()
 
     def getMySubscriptions(self):
         """
@@ -3122,6 +3336,7 @@ class VoteCastDBHandler(BasicDBHandler):
         elif vote>=0 and vote<=2:
             sql = "update VoteCast set vote=-1 where mod_id==? and voter_id==?"
             self._db.execute_write(sql,(bin2str(mod_id),bin2str(self.my_permid),))    
+        self._votesChanged()
         
         self.notifier.notify(NTFY_CHANNELCAST, NTFY_UPDATE, mod_id)
 
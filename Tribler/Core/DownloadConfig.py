@@ -955,6 +955,80 @@ class DownloadConfigInterface:
         """
         return self.dlconfig['ratelim_min_resched_time']
 
+    def set_upload_sendfile(self,value):
+        """ Enable or disable uploading verified pieces straight from disk
+        with the sendfile() system call. Not used for Merkle torrents and
+        encrypted closed swarms.
+        @param value Boolean
+        """
+        self.dlconfig['upload_sendfile'] = value
+
+    def get_upload_sendfile(self):
+        """ Returns whether pieces are uploaded with sendfile().
+        @return Boolean
+        """
+        return self.dlconfig['upload_sendfile']
+
+    def set_hashcheck_workers(self,value):
+        """ Set the number of threads that read and hash the existing data
+        when a download is started. 0 means hash checking is done piece by
+        piece on the network thread.
+        @param value An integer.
+        """
+        self.dlconfig['hashcheck_workers'] = value
+
+    def get_hashcheck_workers(self):
+        """ Returns the number of hash check threads.
+        @return An integer.
+        """
+        return self.dlconfig['hashcheck_workers']
+
+    def set_resume_index(self,value):
+        """ Enable or disable the fast-resume index, which records the
+        pieces that passed the hash check as they come in. When the download
+        is restarted without a checkpoint, e.g. after a crash, the index is
+        used to avoid hash checking all existing data again.
+        @param value Boolean
+        """
+        self.dlconfig['resume_index'] = value
+
+    def get_resume_index(self):
+        """ Returns whether the fast-resume index is used.
+        @return Boolean
+        """
+        return self.dlconfig['resume_index']
+
+    def set_storage_mmap(self,value):
+        """ Enable or disable reading the content through memory mapped
+        files. Verified pieces are then uploaded and passed to the video
+        player without being copied, and reads need no read() calls. Not 
+        used on Windows when files are locked, see set_lock_files().
+        @param value Boolean
+        """
+        self.dlconfig['storage_mmap'] = value
+
+    def get_storage_mmap(self):
+        """ Returns whether content is read through memory mapped files.
+        @return Boolean
+        """
+        return self.dlconfig['storage_mmap']
+
+    def set_vod_rebuffer_target(self,value):
+        """ Set the probability of rebuffering during video-on-demand playback
+        that is acceptable. Playback starts as soon as the predicted 
+        probability of running out of data drops below this value, based on
+        the rate and variance at which peers deliver pieces. 0 disables this
+        and always prebuffers a fixed number of seconds of video.
+        @param value A float between 0 and 1.
+        """
+        self.dlconfig['vod_rebuffer_target'] = value
+
+    def get_vod_rebuffer_target(self):
+        """ Returns the acceptable probability of rebuffering.
+        @return A float.
+        """
+        return self.dlconfig['vod_rebuffer_target']
+
 
     
     
@@ -328,6 +328,14 @@ class DownloadState(Serializable):
                    set when playback starts)
         'firstpiece' = starting absolute piece number of selected file
         'npieces' = number of pieces in selected file
+        'prebufctl' = predictions of the prebuffer controller, a dictionary
+                      with the delivery rate 'mu' and its deviation 'sigma'
+                      (bytes/s), the 'bitrate', the prebuffer it wants in
+                      'pieces', 'bytes' and 'secs', the predicted rebuffer
+                      probability 'prob' with that prebuffer, the 'target'
+                      probability, and the estimated 'startup' time left
+                      (seconds). None when not used, see
+                      DownloadConfig.set_vod_rebuffer_target().
         </pre>, or no keys if no VOD is in progress.
         @return Dict.
         """
@@ -138,6 +138,9 @@ class Session(SessionRuntimeConfig):
         dlpstatedir = os.path.join(self.sessconfig['state_dir'],STATEDIR_DLPSTATE_DIR)
         if not os.path.isdir(dlpstatedir):
             os.mkdir(dlpstatedir)
+        resumeindexdir = os.path.join(self.sessconfig['state_dir'],STATEDIR_RESUMEINDEX_DIR)
+        if not os.path.isdir(resumeindexdir):
+            os.mkdir(resumeindexdir)
         
         # 3. tracker
         trackerdir = self.get_internal_tracker_dir()
@@ -315,6 +318,34 @@ class Session(SessionRuntimeConfig):
         """
         self.lm.set_download_states_callback(usercallback,getpeerlist)
 
+    def set_download_state_changes_callback(self,usercallback):
+        """
+        Like set_download_states_callback() but for monitoring many Downloads
+        cheaply. Calls usercallback with a dictionary that maps each Download 
+        whose state changed since the previous call to a dictionary with 
+        just the changed fields, or to None when the Download was removed. 
+        The first call reports all fields of all Downloads. The fields are:
+        <pre>
+        'status'      : DownloadState.get_status()
+        'error'       : DownloadState.get_error()
+        'progress'    : DownloadState.get_progress()
+        'upspeed'     : DownloadState.get_current_speed(UPLOAD)
+        'downspeed'   : DownloadState.get_current_speed(DOWNLOAD)
+        'numpeers'    : DownloadState.get_num_peers()
+        'numnonseeds' : DownloadState.get_num_nonseeds()
+        </pre>
+        These are read from counters kept by the download engine, no 
+        DownloadState is created. When nothing changed the usercallback is
+        not called. The usercallback must return when to look for changes
+        again, as a number of seconds from now, or < 0.0 to stop.
+
+        The callback will be called by a popup thread which can be used
+        indefinitely (within reason) by the higher level code.
+        
+        @param usercallback A function adhering to the above spec. 
+        """
+        self.lm.set_download_state_changes_callback(usercallback)
+
 
     #
     # Config parameters that only exist at runtime
@@ -356,6 +387,22 @@ class Session(SessionRuntimeConfig):
         return DialbackMsgHandler.getInstance().isConnectable()
 
 
+    def get_hashcheck_stats(self):
+        """ Returns statistics about the integrity checks of on-disk data 
+        done when Downloads are started, see 
+        SessionConfig.set_hashcheck_concurrency(). 
+        <pre>
+        'queued'  : number of Downloads waiting to be checked
+        'active'  : number of Downloads being checked
+        'checked' : number of Downloads checked so far
+        'bytes'   : total content size of those Downloads
+        'speed'   : bytes checked per second while checking
+        </pre>
+        @return A dictionary. """
+        # no locking, lm only reads counters
+        return self.lm.get_hashcheck_stats()
+
+
     def get_current_startup_config_copy(self):
         """ Returns a SessionStartupConfig that is a copy of the current runtime 
         SessionConfig.
@@ -1423,6 +1423,20 @@ class SessionConfigInterface:
         """
         return self.sessconfig['socket_sndbuf_size']
 
+    def set_hashcheck_concurrency(self,value):
+        """ Set the maximum number of Downloads whose on-disk data is checked 
+        at the same time. Downloads stored on the same disk are checked one 
+        at a time, except Downloads in video-on-demand mode.
+        @param value Integer
+        """
+        self.sessconfig['hashcheck_concurrency'] = value
+
+    def get_hashcheck_concurrency(self):
+        """ Returns the maximum number of concurrent hash checks.
+        @return Integer
+        """
+        return self.sessconfig['hashcheck_concurrency']
+
 
 
 
@@ -349,6 +349,17 @@ class SwiftDownloadImpl(SwiftDownloadRuntimeConfig):
             self.dllock.release()
 
 
+    def network_get_state_summary(self):
+        """ See DownloadImpl.network_get_state_summary().
+        Called by network thread """
+        ds = self.network_get_state(None,False,sessioncalling=True)
+        return {'status':ds.get_status(),'error':ds.get_error(),
+                'progress':ds.get_progress(),
+                'upspeed':ds.get_current_speed(UPLOAD),
+                'downspeed':ds.get_current_speed(DOWNLOAD),
+                'numpeers':ds.get_num_peers(),
+                'numnonseeds':ds.get_num_nonseeds()}
+
     def sesscb_get_state_returncallback(self,usercallback,when,newgetpeerlist):
         """ Called by SessionCallbackThread """
         self.dllock.acquire()
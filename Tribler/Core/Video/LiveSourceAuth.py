@@ -35,7 +35,25 @@ class Authenticator:
     def sign(self,content):
         pass
     
-    def verify(self,piece):
+    def verify(self,piece,index):
+        """ A piece is valid if:
+        - the signature is correct,
+        - the seqnum % npieces == piecenr.
+        - the seqnum is no older than self.seqnum - npieces
+        @param piece The piece data as received from peer
+        @param index The piece number as received from peer
+        @return Boolean
+        """
+        return self.verify_signature(piece,index) and self.verify_seqnum(piece,index)
+
+    def verify_signature(self,piece,index):
+        """ Checks the signature only. Does not change the state of the
+        Authenticator, so may be called from another thread. """
+        pass
+
+    def verify_seqnum(self,piece,index):
+        """ Checks the seqnum and timestamp of a piece whose signature
+        is correct, and records them. """
         pass
     
     def get_content(self,piece):
@@ -60,7 +78,13 @@ class NullAuthenticator(Authenticator):
     def sign(self,content):
         return [content]
     
-    def verify(self,piece):
+    def verify(self,piece,index=None):
+        return True
+
+    def verify_signature(self,piece,index):
+        return True
+
+    def verify_seqnum(self,piece,index):
         return True
     
     def get_content(self,piece):
@@ -125,17 +149,8 @@ class ECDSAAuthenticator(Authenticator):
         else:
             return [content,extra,lensig,sig]
         
-    def verify(self,piece,index):
-        """ A piece is valid if:
-        - the signature is correct,
-        - the seqnum % npieces == piecenr.
-        - the seqnum is no older than self.seqnum - npieces
-        @param piece The piece data as received from peer
-        @param index The piece number as received from peer
-        @return Boolean
-        """
+    def verify_signature(self,piece,index):
         try:
-            # Can we do this without memcpy?
             #print >>sys.stderr,"ECDSAAuth: verify",len(piece)
             extra = piece[-self.OUR_SIGSIZE:-self.OUR_SIGSIZE+self.EXTRA_SIZE]
             lensig = ord(piece[-self.OUR_SIGSIZE+self.EXTRA_SIZE])
@@ -148,42 +163,48 @@ class ECDSAAuthenticator(Authenticator):
                 sig = piece[-self.OUR_SIGSIZE+self.EXTRA_SIZE+self.LENGTH_SIZE:]
             else:
                 sig = piece[-self.OUR_SIGSIZE+self.EXTRA_SIZE+self.LENGTH_SIZE:diff]
-            content = piece[:-self.OUR_SIGSIZE]
+            # Hash the content in place rather than slicing off a copy
+            content = buffer(piece,0,len(piece)-self.OUR_SIGSIZE)
             if DEBUG:
                 print >>sys.stderr,"ECDSAAuth: verify piece",index,"sig",`sig`
                 print >>sys.stderr,"ECDSAAuth: verify dig",sha(content).hexdigest()
         
             ret = ecdsa_verify_data_pubkeyobj(content,extra,self.pubkey,sig)
-            if ret:
-                (seqnum, rtstamp) = self._decode_extra(piece)
-                
-                if DEBUG:
-                    print >>sys.stderr,"ECDSAAuth: verify piece",index,"seq",seqnum,"ts %.5f s" % rtstamp,"ls",lensig
-                
-                mod = seqnum % self.get_npieces()
-                thres = self.seqnum - self.get_npieces()/2
-                if seqnum <= thres:
-                    print >>sys.stderr,"ECDSAAuth: @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@ failed piece",index,"old seqnum",seqnum,"<<",self.seqnum
-                    return False
-                elif mod != index:
-                    print >>sys.stderr,"ECDSAAuth: @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@ failed piece",index,"expected",mod
-                    return False 
-                elif self.startts is not None and rtstamp < self.startts:
-                    print >>sys.stderr,"ECDSAAuth: @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@ failed piece",index,"older than oldest known ts",rtstamp,self.startts
-                    return False
-                else:
-                    self.seqnum = max(self.seqnum,seqnum)
-                    if self.startts is None:
-                        self.startts = rtstamp-300.0 # minus 5 min in case we read piece N+1 before piece N
-                        print >>sys.stderr,"ECDSAAuth: @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@: startts",self.startts
-            else:
+            if not ret:
                 print >>sys.stderr,"ECDSAAuth: @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@ piece",index,"failed sig"
-            
             return ret
         except:
             print_exc()
             return False 
 
+    def verify_seqnum(self,piece,index):
+        try:
+            (seqnum, rtstamp) = self._decode_extra(piece)
+            
+            if DEBUG:
+                print >>sys.stderr,"ECDSAAuth: verify piece",index,"seq",seqnum,"ts %.5f s" % rtstamp
+            
+            mod = seqnum % self.get_npieces()
+            thres = self.seqnum - self.get_npieces()/2
+            if seqnum <= thres:
+                print >>sys.stderr,"ECDSAAuth: @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@ failed piece",index,"old seqnum",seqnum,"<<",self.seqnum
+                return False
+            elif mod != index:
+                print >>sys.stderr,"ECDSAAuth: @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@ failed piece",index,"expected",mod
+                return False 
+            elif self.startts is not None and rtstamp < self.startts:
+                print >>sys.stderr,"ECDSAAuth: @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@ failed piece",index,"older than oldest known ts",rtstamp,self.startts
+                return False
+            else:
+                self.seqnum = max(self.seqnum,seqnum)
+                if self.startts is None:
+                    self.startts = rtstamp-300.0 # minus 5 min in case we read piece N+1 before piece N
+                    print >>sys.stderr,"ECDSAAuth: @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@: startts",self.startts
+            return True
+        except:
+            print_exc()
+            return False 
+
     def get_content(self,piece):
         return piece[:-self.OUR_SIGSIZE]
 
@@ -262,87 +283,84 @@ class RSAAuthenticator(Authenticator):
         sig = rsa_sign_data(content,extra,self.keypair)
         return [content,extra,sig]
         
-    def verify(self,piece,index):
-        """ A piece is valid if:
-        - the signature is correct,
-        - the seqnum % npieces == piecenr.
-        - the seqnum is no older than self.seqnum - npieces
-        @param piece The piece data as received from peer
-        @param index The piece number as received from peer
-        @return Boolean
-        """
+    def verify_signature(self,piece,index):
         try:
-            # Can we do this without memcpy?
             #print >>sys.stderr,"ECDSAAuth: verify",len(piece)
             extra = piece[-self.our_sigsize():-self.our_sigsize()+self.EXTRA_SIZE]
             sig = piece[-self.our_sigsize()+self.EXTRA_SIZE:]
-            content = piece[:-self.our_sigsize()]
+            # Hash the content in place rather than slicing off a copy
+            content = buffer(piece,0,len(piece)-self.our_sigsize())
             #if DEBUG:
             #    print >>sys.stderr,"RSAAuth: verify piece",index,"sig",`sig`
             #    print >>sys.stderr,"RSAAuth: verify dig",sha(content).hexdigest()
         
             ret = rsa_verify_data_pubkeyobj(content,extra,self.pubkey,sig)
-            if ret:
-                (seqnum, rtstamp) = self._decode_extra(piece)
-                
-                if DEBUG:
-                    print >>sys.stderr,"RSAAuth: verify piece",index,"seq",seqnum,"ts %.5f s" % rtstamp
-                
-                mod = seqnum % self.get_npieces()
-                thres = self.seqnum - self.get_npieces()/2
-                if seqnum <= thres:
-                    print >>sys.stderr,"RSAAuth: @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@ failed piece",index,"old seqnum",seqnum,"<<",self.seqnum
-                    return False
-                elif mod != index:
-                    print >>sys.stderr,"RSAAuth: @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@ failed piece",index,"expected",mod
-                    return False
-                elif self.startts is not None and rtstamp < self.startts:
-                    print >>sys.stderr,"RSAAuth: @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@ failed piece",index,"older than oldest known ts",rtstamp,self.startts
-                    return False
-                else:
-                    self.seqnum = max(self.seqnum,seqnum)
-                    if self.startts is None:
-                        self.startts = rtstamp-300.0 # minus 5 min in case we read piece N+1 before piece N
-                        
-                        # Arno, 2010-09-02: With createlivestream.py now waiting
-                        # till an input comes back online we can get the following
-                        # situation:
-                        #
-                        # VideoSource created some pieces before stall. These
-                        # have timestamp T1 or smaller. Now the input comes online
-                        # after a long period (think BBC three, just from 8pm-2am)
-                        # and the VideoSource starts creating new pieces. These
-                        # pieces will have timestamp T2 or greater. 
-                        # 
-                        # Now assume a client tunes in and its hookin point
-                        # is chosen to include some of the old pieces. Then
-                        # if the client downloads a new piece before an old piece
-                        # (rarest first over prebuffer during live hookin)
-                        # self.startts gets set to T2 or greater. When the client
-                        # then downloads an old piece with T1 or smaller, it
-                        # will get refused as being too old.
-                        #
-                        # Not sure how often this occurs, soon after input
-                        # is back online the hookin point should be in the
-                        # new pieces.
-                        #
-                        # Problem is if people tune in, waiting for the 
-                        # broadcast to start.
-                        #
-                        # Arno, 2011-02-11: However, this means we won't get
-                        # enough prebuffer in time, and we'll choose a new
-                        # hook-in point. At one point the prebuff will consist
-                        # of only new pieces.
-                        #
-                        print >>sys.stderr,"RSAAuth: @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@: startts",self.startts
-            else:
+            if not ret:
                 print >>sys.stderr,"RSAAuth: @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@ piece",index,"failed sig"
-            
             return ret
         except:
             print_exc()
             return False 
 
+    def verify_seqnum(self,piece,index):
+        try:
+            (seqnum, rtstamp) = self._decode_extra(piece)
+            
+            if DEBUG:
+                print >>sys.stderr,"RSAAuth: verify piece",index,"seq",seqnum,"ts %.5f s" % rtstamp
+            
+            mod = seqnum % self.get_npieces()
+            thres = self.seqnum - self.get_npieces()/2
+            if seqnum <= thres:
+                print >>sys.stderr,"RSAAuth: @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@ failed piece",index,"old seqnum",seqnum,"<<",self.seqnum
+                return False
+            elif mod != index:
+                print >>sys.stderr,"RSAAuth: @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@ failed piece",index,"expected",mod
+                return False
+            elif self.startts is not None and rtstamp < self.startts:
+                print >>sys.stderr,"RSAAuth: @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@ failed piece",index,"older than oldest known ts",rtstamp,self.startts
+                return False
+            else:
+                self.seqnum = max(self.seqnum,seqnum)
+                if self.startts is None:
+                    self.startts = rtstamp-300.0 # minus 5 min in case we read piece N+1 before piece N
+                    
+                    # Arno, 2010-09-02: With createlivestream.py now waiting
+                    # till an input comes back online we can get the following
+                    # situation:
+                    #
+                    # VideoSource created some pieces before stall. These
+                    # have timestamp T1 or smaller. Now the input comes online
+                    # after a long period (think BBC three, just from 8pm-2am)
+                    # and the VideoSource starts creating new pieces. These
+                    # pieces will have timestamp T2 or greater. 
+                    # 
+                    # Now assume a client tunes in and its hookin point
+                    # is chosen to include some of the old pieces. Then
+                    # if the client downloads a new piece before an old piece
+                    # (rarest first over prebuffer during live hookin)
+                    # self.startts gets set to T2 or greater. When the client
+                    # then downloads an old piece with T1 or smaller, it
+                    # will get refused as being too old.
+                    #
+                    # Not sure how often this occurs, soon after input
+                    # is back online the hookin point should be in the
+                    # new pieces.
+                    #
+                    # Problem is if people tune in, waiting for the 
+                    # broadcast to start.
+                    #
+                    # Arno, 2011-02-11: However, this means we won't get
+                    # enough prebuffer in time, and we'll choose a new
+                    # hook-in point. At one point the prebuff will consist
+                    # of only new pieces.
+                    #
+                    print >>sys.stderr,"RSAAuth: @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@: startts",self.startts
+            return True
+        except:
+            print_exc()
+            return False 
+
     def get_content(self,piece):
         return piece[:-self.our_sigsize()]
 
@@ -21,6 +21,15 @@ class MovieTransport:
 
     def read(self):
         pass
+
+    def readinto(self,buf):
+        """ Read at most len(buf) bytes into buf, returns the number of bytes
+        read. Transports that can avoid the intermediate copy override this. """
+        data = self.read(len(buf))
+        if not data:
+            return 0
+        buf[0:len(data)] = data
+        return len(data)
         
     def stop(self):
         pass
@@ -63,6 +72,16 @@ class MovieTransportStreamWrapper:
             data = ''
         return data
 
+    def readinto(self,buf):
+        """ Read at most len(buf) bytes into buf, see 
+        MovieOnDemandTransporter.readinto() """
+        if not self.started:
+            self.mt.start(self.useroffset)
+            self.started = True
+        if self.mt.done():
+            return 0
+        return self.mt.readinto(buf)
+
     def seek(self,pos,whence=os.SEEK_SET):
         # TODO: shift play_pos in PiecePicking + interpret whence
         if DEBUG:
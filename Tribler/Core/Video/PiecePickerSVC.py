@@ -174,6 +174,17 @@ class PiecePickerSVC(PiecePicker):
         if self.is_interesting(piece):
             self.peer_connections[connection]["interesting"][piece] = 1
 
+    def got_haves(self, pieces, connection=None):
+        if pieces:
+            self.maxhave = max(self.maxhave,max(pieces))
+        PiecePicker.got_haves( self, pieces, connection )
+
+        for piece in pieces:
+            if self.transporter:
+                self.transporter.got_have( piece )
+            if self.is_interesting(piece):
+                self.peer_connections[connection]["interesting"][piece] = 1
+
     def got_seed(self):
         self.maxhave = self.numpieces
         PiecePicker.got_seed( self )
@@ -344,6 +355,9 @@ class PiecePickerSVC(PiecePicker):
             # buffering mode
             min_delay, max_delay, offset_delay = self.buffering_delay
 
+        # Time left until each piece is due, computed once per piece
+        dues = {}
+
         for download in downloads:
             total_length = 0
             download_rate = download.get_short_term_rate()
@@ -376,7 +390,11 @@ class PiecePickerSVC(PiecePicker):
 
                     else:
                         if playing_mode:
-                            time_until_deadline = min(piece_due(piece_id), time_request + max_delay - now)
+                            # piece_due() returns an absolute time
+                            due = dues.get(piece_id)
+                            if due is None:
+                                due = dues[piece_id] = piece_due(piece_id) - now
+                            time_until_deadline = min(due, time_request + max_delay - now)
                         else:
                             time_until_deadline = time_request + max_delay - now
                         time_until_download = total_length / download_rate
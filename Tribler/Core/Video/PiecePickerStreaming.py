@@ -216,6 +216,15 @@ class PiecePickerStreaming(PiecePicker):
             self.peer_connections[connection]["interesting"][piece] = 1
 
 
+    def got_haves(self, pieces, connection=None):
+        if pieces:
+            self.maxhave = max(self.maxhave,max(pieces))
+        PiecePicker.got_haves(self,pieces,connection)
+
+        for piece in pieces:
+            if self.is_interesting(piece):
+                self.peer_connections[connection]["interesting"][piece] = 1
+
     def got_seed(self):
         self.maxhave = self.numpieces
         PiecePicker.got_seed( self )
@@ -389,6 +398,9 @@ class PiecePickerStreaming(PiecePicker):
             # buffering mode
             min_delay, max_delay, offset_delay = self.buffering_delay
 
+        # Time left until each piece is due, computed once per piece
+        dues = {}
+
         for download in downloads:
 
             total_length = 0
@@ -421,7 +433,11 @@ class PiecePickerStreaming(PiecePicker):
 
                     else:
                         if playing_mode:
-                            time_until_deadline = min(piece_due(piece_id), time_request + max_delay - now)
+                            # piece_due() returns an absolute time
+                            due = dues.get(piece_id)
+                            if due is None:
+                                due = dues[piece_id] = piece_due(piece_id) - now
+                            time_until_deadline = min(due, time_request + max_delay - now)
                         else:
                             time_until_deadline = time_request + max_delay - now
                         time_until_download = total_length / download_rate
@@ -442,6 +458,42 @@ class PiecePickerStreaming(PiecePicker):
             if DEBUG_CHUNKS:
                 print_chunks(self.downloader, list(self.videostatus.generate_high_range()), compact=False)
 
+    def time_to_deliver(self, download):
+        """ Returns the expected number of seconds until download will have
+        delivered a piece requested now, after the requests already queued
+        on it, or None when it has no recent download rate. """
+        rate = download.get_short_term_rate()
+        if not rate:
+            return None
+        queued = self.videostatus.piecelen
+        for request in download.active_requests:
+            queued += request[2]
+        return queued / rate
+
+    def meets_deadline(self, connection, piece):
+        """ Returns whether piece should be requested from connection,
+        given when the piece is due for playback. False when the peer
+        is not expected to deliver it in time and another peer that 
+        has the piece is. """
+        if not self.transporter or connection is None:
+            # HTTP seeds pick pieces without a connection
+            return True
+        vs = self.videostatus
+        if not vs.playing or vs.paused:
+            return True
+        offset_delay = self.playing_delay[2]
+        due = self.transporter.piece_due(piece) - time.time()
+        t = self.time_to_deliver(connection.download)
+        if t is None or due >= t - offset_delay:
+            return True
+        for download in self.downloader.downloads:
+            if download is connection.download or not download.have[piece] or download.bad_performance_counter:
+                continue
+            t = self.time_to_deliver(download)
+            if t is not None and due >= t - offset_delay:
+                return False
+        return True
+
     def requested(self, *request):
         self.outstanding_requests[request] = time.time()
         return PiecePicker.requested(self, *request)
@@ -744,6 +796,11 @@ class PiecePickerStreaming(PiecePicker):
                 choice = pick_first( first, highprob_cutoff )
             type = "high"
 
+        # Earliest deadline first: leave a high-priority piece to a 
+        # faster peer if this one is not expected to deliver it in time
+        if choice is not None and allow_based_on_performance and not vs.prebuffering:
+            allow_based_on_performance = self.meets_deadline(connection, choice)
+
         # it is possible that the performance of this peer prohibits
         # us from selecting this piece...
         if not allow_based_on_performance:
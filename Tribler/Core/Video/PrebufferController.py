@@ -0,0 +1,176 @@
+# see LICENSE.txt for license information
+#
+# Startup-latency controller for video-on-demand
+#
+import sys
+import time
+from math import sqrt,exp,log,erfc,pi
+from collections import deque
+
+DEBUG = False
+
+def normal_cdf(x):
+    return 0.5 * erfc(-x / sqrt(2.0))
+
+def log_normal_cdf(x):
+    """ log(normal_cdf(x)), also where normal_cdf(x) underflows """
+    if x > -20.0:
+        return log(normal_cdf(x))
+    # Asymptotic expansion of the Mills ratio
+    x2 = x*x
+    return -x2/2.0 - log(-x) - 0.5*log(2.0*pi) + log(1.0 - 1.0/x2 + 3.0/(x2*x2) - 15.0/(x2*x2*x2))
+
+
+class PrebufferController:
+    """ Chooses the smallest prebuffer with which playback can start such
+    that the probability of running out of data (rebuffering) stays below a
+    target.
+
+    The amount of buffered video is modelled as a Brownian motion with
+    drift d = mu - bitrate and variance sigma^2 per second, where mu is the
+    rate at which our peers deliver and sigma^2 follows from the variance
+    of the time between completed pieces. Starting with x0 bytes buffered,
+    the probability of the buffer hitting zero before the remaining H
+    seconds of video have been played is
+
+        P = Phi((-x0-dH)/(sigma sqrt(H)))
+            + exp(-2 d x0/sigma^2) Phi((-x0+dH)/(sigma sqrt(H)))
+
+    As P decreases in x0, the smallest prebuffer is found by bisection.
+    Just after the download started mu is measured over a short time, so
+    the drift is lowered by the standard error sigma/sqrt(T) of mu measured
+    over T seconds, to avoid starting too early on a lucky burst.
+    """
+
+    # number of piece completions to estimate the arrival variance from
+    WINDOW = 64
+
+    # below this number of samples, assume Poisson arrivals of pieces
+    MIN_SAMPLES = 8
+
+    # never start playback with less than this number of pieces
+    MIN_PREBUF_PIECES = 2
+
+    def __init__(self,piecelen,target):
+        self.piecelen = piecelen
+        self.target = target
+        self.arrivals = deque(maxlen=self.WINDOW+1)
+
+        # last prediction, for get_stats()
+        self.mu = 0.0
+        self.sigma = 0.0
+        self.bitrate = 0.0
+        self.pieces = None
+        self.prob = None
+        self.startup = None
+
+    def piece_completed(self,t=None):
+        if t is None:
+            t = time.time()
+        self.arrivals.append(t)
+
+    def arrival_variance(self,mu):
+        """ Returns the variance of the number of bytes delivered per second.
+        For a renewal process with inter-arrival times of mean m and variance
+        v, the number of pieces per second has variance v/m^3. """
+        L = self.piecelen
+        n = len(self.arrivals)-1
+        if n >= self.MIN_SAMPLES:
+            gaps = [self.arrivals[i+1]-self.arrivals[i] for i in xrange(n)]
+            m = sum(gaps)/n
+            if m > 0.0:
+                v = sum([(g-m)*(g-m) for g in gaps])/(n-1)
+                return L * L * v / (m*m*m)
+        # Poisson arrivals of pieces at rate mu/L
+        return mu * L
+
+    def rebuffer_probability(self,x0,d,var,horizon):
+        """ Probability that the buffer of x0 bytes runs dry within horizon
+        seconds, or ever if horizon is None. """
+        if horizon is not None and horizon <= 0.0:
+            if x0 > 0.0:
+                return 0.0
+            return 1.0
+        if var <= 0.0:
+            if d >= 0.0 or (horizon is not None and x0 + d*horizon > 0.0):
+                return 0.0
+            return 1.0
+        e = -2.0*d*x0/var
+        if horizon is None:
+            if d <= 0.0:
+                return 1.0
+            return exp(e)
+        s = sqrt(var*horizon)
+        # exp(e) overflows for a large buffer and negative drift while the
+        # normal_cdf() it multiplies underflows, so add their logarithms.
+        # The product is at most 1.
+        p = normal_cdf((-x0-d*horizon)/s) + exp(min(0.0,e + log_normal_cdf((-x0+d*horizon)/s)))
+        return min(1.0,max(0.0,p))
+
+    def update(self,mu,bitrate,horizon,maxpieces,nhave):
+        """ Returns the number of pieces to prebuffer, at most maxpieces, or
+        None if no such prebuffer keeps the rebuffer probability below the
+        target.
+
+        mu = current delivery rate in bytes/s
+        bitrate = playback rate in bytes/s
+        horizon = seconds of video left to play, None if unbounded
+        nhave = number of the pieces to prebuffer we already have
+        """
+        self.mu = mu
+        self.bitrate = bitrate
+        self.pieces = None
+        self.prob = None
+        self.startup = None
+        if mu <= 0.0 or bitrate <= 0.0 or self.target <= 0.0:
+            self.sigma = 0.0
+            return None
+
+        L = self.piecelen
+        var = self.arrival_variance(mu)
+        self.sigma = sqrt(var)
+        d = mu - bitrate
+        if len(self.arrivals) > 1:
+            T = self.arrivals[-1]-self.arrivals[0]
+        else:
+            T = 0.0
+        if T > 0.0:
+            d -= self.sigma/sqrt(T)
+        else:
+            d = min(d,0.0)
+
+        lo = min(self.MIN_PREBUF_PIECES,maxpieces)
+        hi = maxpieces
+        p = self.rebuffer_probability(hi*L,d,var,horizon)
+        if p > self.target:
+            self.prob = p
+            return None
+        while lo < hi:
+            mid = (lo+hi)/2
+            if self.rebuffer_probability(mid*L,d,var,horizon) <= self.target:
+                hi = mid
+            else:
+                lo = mid+1
+
+        self.pieces = lo
+        self.prob = self.rebuffer_probability(lo*L,d,var,horizon)
+        self.startup = float(max(0,lo-nhave) * L) / mu
+        if DEBUG:
+            print >>sys.stderr,"prebufctl: mu",int(mu),"sigma",int(self.sigma),"bitrate",int(bitrate),"prebuf",lo,"pieces, P",self.prob,"startup",self.startup
+        return lo
+
+    def get_stats(self):
+        s = { "mu": self.mu,
+              "sigma": self.sigma,
+              "bitrate": self.bitrate,
+              "target": self.target,
+              "pieces": self.pieces,
+              "prob": self.prob,
+              "startup": self.startup }
+        if self.pieces is None:
+            s["bytes"] = None
+            s["secs"] = None
+        else:
+            s["bytes"] = self.pieces * self.piecelen
+            s["secs"] = float(self.pieces * self.piecelen) / self.bitrate
+        return s
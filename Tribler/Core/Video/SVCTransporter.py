@@ -592,6 +592,10 @@ class SVCTransporter(MovieOnDemandTransporter):
         # Ric: returning the size of the base layer
         return self.videostatus.selected_movie[0]["size"]
 
+    def readinto(self,buf):
+        # Pieces are popped differently, see read()
+        return MovieTransport.readinto(self,buf)
+
     def read(self,numbytes=None):
         """ Read a set of pieces. The return data will be 
             a byte for the pieces presence and a set of pieces
@@ -15,6 +15,7 @@ from base64 import b64encode
 
 from Tribler.Core.BitTornado.CurrentRateMeasure import Measure
 from Tribler.Core.Video.MovieTransport import MovieTransport,MovieTransportStreamWrapper
+from Tribler.Core.Video.PrebufferController import PrebufferController
 from Tribler.Core.simpledefs import *
 from Tribler.Core.osutils import *
 from Tribler.Core.Statistics.Status.Status import get_status_holder, TRIALLOG
@@ -257,6 +258,15 @@ class MovieOnDemandTransporter(MovieTransport):
             else:
                 print >>sys.stderr,"vod: trans: Want",self.max_prebuf_packets,"pieces for prebuffering"
 
+        # For VOD, start playback before max_prebuf_packets are in when the
+        # download is fast and steady enough, see controlled_prebuffer().
+        # Live keeps prebuffering a fixed amount, as pieces are generated
+        # at the bitrate and a hookin point has to be chosen first.
+        if not vs.live_streaming and bt1download.config.get('vod_rebuffer_target', 0.05) > 0.0:
+            self.prebufctl = PrebufferController(vs.piecelen,bt1download.config.get('vod_rebuffer_target', 0.05))
+        else:
+            self.prebufctl = None
+
         self.nreceived = 0
         
         if DEBUG:
@@ -276,7 +286,7 @@ class MovieOnDemandTransporter(MovieTransport):
         self.curpiece = ""
         self.curpiece_pos = 0
         self.outbuf = []
-        self.outbuflen = None
+        self.outbuflen = 0 # bytes in outbuf, maintained by push and pop
         self.last_pop = None # time of last pop
         self.rehookin = False
         self.reset_bitrate_prediction()
@@ -706,11 +716,19 @@ class MovieOnDemandTransporter(MovieTransport):
         # time to be varied independently of highrange width. 
         #
         f,t = vs.playback_pos, vs.normalize( vs.playback_pos + self.max_prebuf_packets )
-        prebufrange = vs.generate_range( (f, t) )
+        prebufrange = list(vs.generate_range( (f, t) ))
+
+        # The prebuffer controller may decide that fewer pieces suffice
+        needed = self.controlled_prebuffer( prebufrange )
+        if needed is not None:
+            prebufrange = prebufrange[:needed]
+            npieces = needed
+        else:
+            npieces = self.max_prebuf_packets
         missing_pieces = filter( lambda i: not self.have_piece( i ), prebufrange)
 
         gotall = not missing_pieces
-        self.prebufprogress = float(self.max_prebuf_packets-len(missing_pieces))/float(self.max_prebuf_packets)
+        self.prebufprogress = float(npieces-len(missing_pieces))/float(npieces)
         
         if DEBUG:
             print >>sys.stderr,"vod: trans: Already got",(self.prebufprogress*100.0),"% of prebuffer"
@@ -774,7 +792,7 @@ class MovieOnDemandTransporter(MovieTransport):
         # # this is unlikely to happen and we will therefore only wait
         # # until we estimate that we have enough_buffer.
         # if (gotall or vs.live_streaming) and self.enough_buffer():
-        if gotall and self.enough_buffer():
+        if gotall and (needed is not None or self.enough_buffer()):
             # enough buffer and could estimated bitrate - start streaming
             if DEBUG:
                 print >>sys.stderr,"vod: trans: Prebuffering done",currentThread().getName()
@@ -866,6 +884,8 @@ class MovieOnDemandTransporter(MovieTransport):
 
         if downloaded:
             self.overall_rate.update_rate( vs.real_piecelen( piece ) )
+            if self.prebufctl is not None:
+                self.prebufctl.piece_completed()
 
         # Arno, 2010-04-20: STBSPEED: vs.in_download_range( piece ) is equiv to downloaded=False
         if vs.in_download_range( piece ):
@@ -971,6 +991,30 @@ class MovieOnDemandTransporter(MovieTransport):
 
         return pieces_left * vs.piecelen / expected_download_speed
 
+    def controlled_prebuffer(self,prebufrange):
+        """ Returns the number of pieces from prebufrange that the prebuffer
+        controller wants before playback can start, or None if it cannot tell
+        and all max_prebuf_packets are to be prebuffered. """
+        vs = self.videostatus
+        if self.prebufctl is None or self.doing_ffmpeg_analysis or not vs.bitrate_set or not prebufrange:
+            return None
+
+        # Delivery rate: what our peers sent us in the last seconds, or
+        # the overall rate which includes HTTP seeds
+        mu = 0.0
+        for d in self.bt1download.downloader.downloads:
+            mu += d.get_short_term_rate()
+        mu = max(mu,self.overall_rate.get_rate())
+
+        nhave = 0
+        for i in prebufrange:
+            if not self.have_piece(i):
+                break
+            nhave += 1
+
+        horizon = self.expected_playback_time()
+        return self.prebufctl.update(mu,vs.bitrate,horizon,len(prebufrange),nhave)
+
     def expected_playback_time(self):
         """ Expected playback time left. """
 
@@ -1048,18 +1092,8 @@ class MovieOnDemandTransporter(MovieTransport):
             pieces are returned. The bytes read will be returned, or None in
             case of an error or end-of-stream. """
             
-        if not self.curpiece:
-            # curpiece_pos could be set to something other than 0! 
-            # for instance, a seek request sets curpiece_pos but does not
-            # set curpiece.
-
-            piecetup = self.pop()
-            if piecetup is None:
-                return None
-            
-            piecenr,self.curpiece = piecetup
-            if DEBUG:
-                print >>sys.stderr,"vod: trans: %d: popped piece to transport to player" % piecenr
+        if not self.pop_curpiece():
+            return None
 
         curpos = self.curpiece_pos
         left = len(self.curpiece) - curpos
@@ -1083,6 +1117,45 @@ class MovieOnDemandTransporter(MovieTransport):
 
         return data
 
+    def readinto(self,buf):
+        """ Read at most len(buf) bytes from the stream into buf, which must
+            support slice assignment, e.g. a bytearray. Unlike read(), which
+            returns a copy of part of a piece, the data is copied once, from
+            the piece straight into buf. Returns the number of bytes read, 0 
+            in case of an error or end-of-stream. """
+
+        if not self.pop_curpiece():
+            return 0
+
+        curpos = self.curpiece_pos
+        n = min(len(buf),len(self.curpiece) - curpos)
+        buf[0:n] = buffer(self.curpiece,curpos,n)
+
+        if curpos+n < len(self.curpiece):
+            self.curpiece_pos += n
+        else:
+            self.curpiece = ""
+            self.curpiece_pos = 0
+
+        return n
+
+    def pop_curpiece(self):
+        """ Makes sure self.curpiece holds the piece to read from, returns
+            False in case of an error or end-of-stream. """
+        if not self.curpiece:
+            # curpiece_pos could be set to something other than 0! 
+            # for instance, a seek request sets curpiece_pos but does not
+            # set curpiece.
+
+            piecetup = self.pop()
+            if piecetup is None:
+                return False
+            
+            piecenr,self.curpiece = piecetup
+            if DEBUG:
+                print >>sys.stderr,"vod: trans: %d: popped piece to transport to player" % piecenr
+        return True
+
     def start( self, bytepos = 0, force = False ):
         """ Initialise to start playing at position `bytepos'. """
         
@@ -1143,6 +1216,7 @@ class MovieOnDemandTransporter(MovieTransport):
             self.curpiece_pos = offset
             self.set_pos( piece )
             self.outbuf = []
+            self.outbuflen = 0
             self.last_pop = time.time()
             self.reset_bitrate_prediction()
             vs.playing = True
@@ -1182,6 +1256,7 @@ class MovieOnDemandTransporter(MovieTransport):
         # clear buffer and notify possible readers
         self.data_ready.acquire()
         self.outbuf = []
+        self.outbuflen = 0
         self.last_pop = None
         vs.prebuffering = False
         self.data_ready.notify()
@@ -1514,7 +1589,6 @@ class MovieOnDemandTransporter(MovieTransport):
             return
 
         mx = self.max_buffer_size()
-        self.outbuflen = sum( [len(d) for (p,d) in self.outbuf] )
         now = time.time()
 
         if self.http_support is not None:
@@ -1839,6 +1913,10 @@ class MovieOnDemandTransporter(MovieTransport):
               "pieces": self.stat_pieces.pop_completed(),
               "firstpiece":self.videostatus.first_piece,
               "npieces":self.videostatus.movie_numpieces}
+        if self.prebufctl is not None:
+            s["prebufctl"] = self.prebufctl.get_stats()
+        else:
+            s["prebufctl"] = None
         return s
 
     def get_prebuffering_progress(self):
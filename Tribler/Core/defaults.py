@@ -116,6 +116,7 @@ sessdefaults['swiftdlsperproc'] = 1000
 sessdefaults['socket_write_always'] = False  # See SocketHandler
 sessdefaults['socket_rcvbuf_size'] = None
 sessdefaults['socket_sndbuf_size'] = None
+sessdefaults['hashcheck_concurrency'] = 2  # See LaunchManyCore
 
 
 trackerdefaults = {}
@@ -249,6 +250,12 @@ dldefaults['live_drop_pieces'] = True
 dldefaults['upload_while_prebuf'] = True
 dldefaults['ratelim_min_resched_time'] = 0.0
 dldefaults['socket_write_always'] = False
+# Version 6:
+dldefaults['upload_sendfile'] = False
+dldefaults['hashcheck_workers'] = 2
+dldefaults['resume_index'] = True
+dldefaults['storage_mmap'] = False
+dldefaults['vod_rebuffer_target'] = 0.05
 
 tdefdictdefaults = {}
 tdefdictdefaults['comment'] = None
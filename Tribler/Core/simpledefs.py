@@ -40,6 +40,7 @@ For details see API.py
 
 STATEDIR_ITRACKER_DIR = 'itracker'
 STATEDIR_DLPSTATE_DIR = 'dlcheckpoints'
+STATEDIR_RESUMEINDEX_DIR = 'dlresume'
 STATEDIR_PEERICON_DIR = 'icons'
 STATEDIR_TORRENTCOLL_DIR = 'collected_torrent_files'
 
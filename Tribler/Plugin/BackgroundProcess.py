@@ -679,17 +679,21 @@ class BackgroundApp(BaseApp):
             # Arno, 2011-01-24: Only rate limit when HTTP seeds avail.
             urllist = d.get_def().get_urllist()
             httpseeds = d.get_def().get_httpseeds()     
+            atbitrate = False
             if not d.get_def().get_live() and not params['filename'] and (urllist is not None or httpseeds is not None):
                 # Arno, < 2010-08-10: Firefox reads aggressively, we just
                 # give it data at bitrate pace such that we know when we
                 # have to fallback to HTTP servers.
                 #
                 # 2010-08-10: not when file complete on disk ;-)
-                stream = AtBitrateStream( stream, params['bitrate'] )
+                #
+                # Done per HTTP request with an AtBitrateStream, see 
+                # BGInstanceConnection.get_reader_stream()
+                atbitrate = True
             
             blocksize = d.get_def().get_piece_length()
             #Ric: add svc on streaminfo, added bitrate
-            streaminfo = { 'mimetype': params['mimetype'], 'stream': stream, 'length': params['length'], 'blocksize':blocksize, 'svc': d.get_mode() == DLMODE_SVC, 'bitrate': params['bitrate'] }
+            streaminfo = { 'mimetype': params['mimetype'], 'stream': stream, 'length': params['length'], 'blocksize':blocksize, 'svc': d.get_mode() == DLMODE_SVC, 'bitrate': params['bitrate'], 'atbitrate': atbitrate }
 
             duser = self.dusers[d]
             duser['streaminfo'] = streaminfo
@@ -981,11 +985,24 @@ class BGInstanceConnection(InstanceConnection):
         then either rewind the Tribler Core stream (VOD) or leave it (live)
         and tell the new IC to PLAY. The new ControlledStream will then
         be read by the HTTP server again.
+        
+        The HTTP server reads the ControlledStream through a FanOutStream,
+        so the player can have several requests for the stream open, each
+        reading from its own offset. See get_reader_stream().
         """
         self.cstreaminfo.update(streaminfo)
         stream = streaminfo['stream']
         cstream = ControlledStream( stream )
         self.cstreaminfo['stream'] = cstream
+        self.cstreaminfo['readerfunc'] = self.get_reader_stream
+
+    def get_reader_stream(self,reader):
+        """ Called by the HTTP server for each request, with the request's
+        reader of the FanOutStream. Paces the request if needed and gives it
+        EOF when our ControlledStream is closed. """
+        if self.cstreaminfo.get('atbitrate',False):
+            reader = AtBitrateStream( reader, self.cstreaminfo['bitrate'] )
+        return ControlledStream( reader, self.cstreaminfo['stream'] )
 
     # TODO nicer :-)
     # for the moment we just add a parameter for metadata requests
@@ -998,7 +1015,7 @@ class BGInstanceConnection(InstanceConnection):
         if metadata is not None:
             self.urlpath += metadata
         else:
-            self.videoHTTPServer.set_inputstream(self.cstreaminfo,self.urlpath)
+            self.videoHTTPServer.set_inputstream(self.cstreaminfo,self.urlpath,fanout=True)
         
         if DEBUG:
             print >> sys.stderr, "bg: Telling plugin to start playback of",self.urlpath
@@ -1107,13 +1124,21 @@ class ControlledStream:
     """ A file-like object that throws EOF when closed, without actually closing
     the underlying inputstream. See BGInstanceConnection.set_streaminfo() for
     an explanation on how this is used. 
+    
+    Each request of a fan-out stream reads through a ControlledStream of
+    its own, which has the IC's ControlledStream as parent. It throws EOF
+    when either is closed.
     """
-    def __init__(self,stream):
+    def __init__(self,stream,parent=None):
         self.stream = stream
+        self.parent = parent
         self.done = False # Event()
         
+    def is_done(self):
+        return self.done or (self.parent is not None and self.parent.done)
+
     def read(self,nbytes=None):
-        if not self.done:
+        if not self.is_done():
             return self.stream.read(nbytes)
         else:
             return '' # EOF
@@ -1184,7 +1209,9 @@ class AtBitrateStream:
     def read(self,nbytes=None):
         if not self.done:
             to_give = self.stream.read( nbytes )
-            sleep_time = self.has_to_sleep( nbytes )
+            # A FanOutReader may return less than asked for, so account
+            # for what the reader got, to follow its offset.
+            sleep_time = self.has_to_sleep( len(to_give) )
             #print >>sys.stderr,"DIEGO DEBUG : SLEEP_time", sleep_time
             if sleep_time > 0.0:
                 time.sleep( sleep_time )
@@ -189,6 +189,10 @@ def main(argv):
     # STBSPEED 300B: Previously got 200 mbps out of a single process. This
     # means ~100 slots at 2 mbps. 
     dscfg.set_max_uploads(100)
+
+    # Serve the static content with sendfile() instead of copying every 
+    # block through Python.
+    dscfg.set_upload_sendfile(True)
     
     #
     # Scan dir, until exit by CTRL-C (or any other signal/interrupt)
@@ -11,17 +11,30 @@ import sys
 from threading import Thread,Condition
 from traceback import print_exc,print_stack,format_stack
 from time import time
+from heapq import heappush,heappop,heapify
 
 DEBUG = False
 
+# Rebuild the heap when more than half of it are cancelled tasks
+COMPACT_MIN_CANCELLED = 1024
+
 class TimedTaskQueue:
     
     __single = None
     
     def __init__(self,nameprefix="TimedTaskQueue",isDaemon=True):
         self.cond = Condition()
-        self.queue = []
+        self.queue = [] # heap of [when,count,task,id], task is None when cancelled
+        self.ids = {}   # id -> queued task with that id
+        self.ncancelled = 0
         self.count = 0.0 # serves to keep task that were scheduled at the same time in FIFO order
+        
+        # Statistics, see get_stats()
+        self.nexecuted = 0
+        self.totallatency = 0.0
+        self.maxlatency = 0.0
+        self.maxqueued = 0
+        
         self.thread = Thread(target = self.run)
         self.thread.setDaemon(isDaemon)
         self.thread.setName( nameprefix+self.thread.getName() )
@@ -47,32 +60,67 @@ class TimedTaskQueue:
         if __debug__:
             self.callstack[self.count] = format_stack()
             
-        if id != None:  # remove all redundant tasks
-            self.queue = filter(lambda item:item[3]!=id, self.queue)
-        self.queue.append((when,self.count,task,id))
+        item = [when,self.count,task,id]
+        if id != None:  # remove redundant task
+            old = self.ids.get(id)
+            if old is not None:
+                self.cancel_item(old)
+            self.ids[id] = item
+        heappush(self.queue,item)
+        if len(self.queue)-self.ncancelled > self.maxqueued:
+            self.maxqueued = len(self.queue)-self.ncancelled
         self.count += 1.0
         self.cond.notify()
         self.cond.release()
         
+    def cancel_item(self,item):
+        """ Cancel queued task, it is removed from the heap when due or at the
+        next compaction. Called with lock held """
+        item[2] = None
+        self.ncancelled += 1
+        if __debug__:
+            self.callstack.pop(item[1],None)
+        if self.ncancelled > COMPACT_MIN_CANCELLED and self.ncancelled*2 > len(self.queue):
+            self.queue = [x for x in self.queue if x[2] is not None]
+            heapify(self.queue)
+            self.ncancelled = 0
+
+    def get_stats(self):
+        """ Returns a dictionary with the number of queued and executed tasks,
+        the maximum number of queued tasks, and the average and maximum time in 
+        seconds between when a task was due and when it was started.
+        
+        Called by any thread """
+        self.cond.acquire()
+        try:
+            if self.nexecuted:
+                avglatency = self.totallatency/self.nexecuted
+            else:
+                avglatency = 0.0
+            return {'queued':len(self.queue)-self.ncancelled,
+                    'maxqueued':self.maxqueued,
+                    'executed':self.nexecuted,
+                    'avglatency':avglatency,
+                    'maxlatency':self.maxlatency}
+        finally:
+            self.cond.release()
+        
     def run(self):
         """ Run by server thread """
         while True:
             task = None
-            timeout = None
-            flag = False
             self.cond.acquire()
             while True:
-                while len(self.queue) == 0 or flag:
-                    flag = False
-                    if timeout is None:
-                        # Wait until something is queued
-                        self.cond.wait()
-                    else:
-                        # Wait till first event is due
-                        self.cond.wait(timeout)
-                # A new event was added or an event is due
-                self.queue.sort()
+                # Drop cancelled tasks at head of queue
+                while len(self.queue) > 0 and self.queue[0][2] is None:
+                    heappop(self.queue)
+                    self.ncancelled -= 1
+                if len(self.queue) == 0:
+                    # Wait until something is queued
+                    self.cond.wait()
+                    continue
                 
+                # A new event was added or an event is due
                 (when,count,task,id) = self.queue[0]
                 if DEBUG:
                     print >>sys.stderr,"ttqueue: EVENT IN QUEUE",when,task
@@ -81,13 +129,19 @@ class TimedTaskQueue:
                     # Event not due, wait some more
                     if DEBUG:
                         print >>sys.stderr,"ttqueue: EVENT NOT TILL",when-now
-                    timeout = when-now
-                    flag = True
+                    self.cond.wait(when-now)
                 else:
                     # Event due, execute
                     if DEBUG:
                         print >>sys.stderr,"ttqueue: EVENT DUE"
-                    self.queue.pop(0)
+                    heappop(self.queue)
+                    if id is not None:
+                        del self.ids[id]
+                    latency = now-when
+                    self.nexecuted += 1
+                    self.totallatency += latency
+                    if latency > self.maxlatency:
+                        self.maxlatency = latency
                     if __debug__:
                         assert count in self.callstack
                         stack = self.callstack.pop(count)
@@ -100,10 +154,10 @@ class TimedTaskQueue:
                 if task == 'stop':  
                     break
                 elif task == 'quit':
-                    if len(self.queue) == 0:
+                    if len(self.queue) == self.ncancelled:
                         break
                     else:
-                        (when,count,task,id) = self.queue[-1]
+                        (when,count,task,id) = max(self.queue)
                         t = when-time()+0.001
                         self.add_task('quit',t)
                 else:
@@ -0,0 +1,158 @@
+# see LICENSE.txt for license information
+#
+
+import sys
+import os
+from bisect import bisect_right
+from threading import Condition
+
+DEBUG = False
+
+class FanOutStream:
+    """ Class that lets any number of readers read a single input stream,
+    each from its own offset. The blocks read from the input stream are
+    kept in a ring of at most ringsize bytes, and handed to the readers
+    as buffer objects, such that a block is read once and never copied,
+    no matter how many readers there are.
+
+    A reader that falls behind the ring of a live stream is moved forward
+    to the oldest data in the ring. For a seekable stream, a reader that
+    reads outside the ring makes the input stream seek, which restarts the
+    ring at that offset. So the ring serves readers that stay close
+    together, e.g. several players watching the same channel.
+
+    Use get_reader() to get a file-like object for each reader.
+    """
+    def __init__(self,inputstream,seekable,readsize=65536,ringsize=8*1024*1024):
+        self.instream = inputstream
+        self.seekable = seekable
+        self.readsize = readsize
+        self.ringsize = ringsize
+
+        self.cond = Condition()
+        self.blocks = []        # data of blocks in ring
+        self.offsets = []       # offset of each block in ring
+        self.tail = 0           # offset of first byte in ring
+        self.head = 0           # offset just past last byte in ring
+        self.eof = False
+        self.pulling = False    # a reader is reading from instream
+
+    def get_reader(self):
+        return FanOutReader(self)
+
+    def close(self):
+        self.cond.acquire()
+        try:
+            self.blocks = []
+            self.offsets = []
+            self.tail = self.head
+        finally:
+            self.cond.release()
+        self.instream.close()
+
+    def read_at(self,pos,nwant):
+        """ Returns (pos,data) with at most nwant bytes of data starting at
+        pos, or at the oldest data when pos is no longer in the ring of a
+        live stream. Data is '' at EOF. """
+        self.cond.acquire()
+        try:
+            while True:
+                # A reader just ahead of the ring, e.g. a range request
+                # that starts in the next block, waits for the block
+                # rather than restarting the ring
+                if pos < self.tail or (pos >= self.head+self.readsize and self.seekable):
+                    if self.pulling:
+                        self.cond.wait()
+                        continue
+                    if self.seekable:
+                        self.reposition(pos)
+                    else:
+                        if DEBUG:
+                            print >>sys.stderr,"FanOutStream: reader fell behind, skipping",self.tail-pos
+                        pos = self.tail
+
+                if pos < self.head:
+                    # In ring
+                    i = bisect_right(self.offsets,pos)-1
+                    block = self.blocks[i]
+                    off = pos-self.offsets[i]
+                    if nwant is None:
+                        n = len(block)-off
+                    else:
+                        n = min(nwant,len(block)-off)
+                    if off == 0 and n == len(block):
+                        return pos,block
+                    return pos,buffer(block,off,n)
+
+                if self.eof:
+                    return pos,''
+
+                if self.pulling:
+                    # Another reader is getting the next block
+                    self.cond.wait()
+                    continue
+                self.pull()
+        finally:
+            self.cond.release()
+
+    def pull(self):
+        """ Appends the next block of instream to the ring. Reads without
+        holding the lock, as it may block until P2P data arrives. """
+        self.pulling = True
+        self.cond.release()
+        try:
+            data = self.instream.read(self.readsize)
+        finally:
+            self.cond.acquire()
+            self.pulling = False
+            self.cond.notifyAll()
+
+        if not data:
+            self.eof = True
+            return
+        self.blocks.append(data)
+        self.offsets.append(self.head)
+        self.head += len(data)
+
+        # Drop oldest blocks, always keeping the newest
+        while self.head-self.tail > self.ringsize and len(self.blocks) > 1:
+            self.tail += len(self.blocks[0])
+            del self.blocks[0]
+            del self.offsets[0]
+
+    def reposition(self,pos):
+        if DEBUG:
+            print >>sys.stderr,"FanOutStream: seeking input to",pos,"ring was",self.tail,self.head
+        self.instream.seek(pos,os.SEEK_SET)
+        self.blocks = []
+        self.offsets = []
+        self.tail = pos
+        self.head = pos
+        self.eof = False
+
+
+class FanOutReader:
+    """ File-like object reading a FanOutStream from its own offset. read()
+    returns buffer objects that refer to the blocks in the ring. """
+
+    def __init__(self,fanout):
+        self.fanout = fanout
+        self.pos = 0
+
+    def read(self,nwant=None):
+        pos,data = self.fanout.read_at(self.pos,nwant)
+        self.pos = pos+len(data)
+        return data
+
+    def seek(self,offset,whence=os.SEEK_SET):
+        if whence != os.SEEK_SET:
+            raise ValueError("FanOutReader only supports SEEK_SET")
+        # Seeking the input is done on read
+        self.pos = offset
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        # DO NOT close the input stream, other readers use it
+        pass
@@ -5,15 +5,19 @@
 import sys
 import time
 import socket
+import select
+import errno
+import random
 import BaseHTTPServer
-from SocketServer import ThreadingMixIn
-from threading import RLock,Thread,currentThread
+from Queue import Queue,Empty
+from threading import Lock,RLock,Thread,currentThread
 from traceback import print_exc,print_stack
 import string
 from cStringIO import StringIO
 
 import os
 import Tribler.Core.osutils
+from Tribler.Video.FanOutStream import FanOutStream
 
 # NOTE: DEBUG is set dynamically depending from DEBUGWEBUI and DEBUGCONTENT
 DEBUG = False
@@ -21,7 +25,24 @@ DEBUGCONTENT = False
 DEBUGWEBUI = False
 DEBUGLOCK = False
 DEBUGBASESERV = False
-        
+
+# Number of threads that read from the streams, see VideoHTTPServer
+DEFAULT_NWORKERS = 8
+# A worker busy with one step for longer than this many seconds is assumed
+# to be blocked waiting for data, and another worker is started
+STALL_TIME = 0.5
+# Seconds after which an idle extra worker exits
+EXTRA_WORKER_IDLE = 15.0
+# Read more from a stream when less than this is waiting to be sent to a client
+OUTBUF_LOWWATER = 128*1024
+# A worker reads until this much is waiting to be sent to the client
+OUTBUF_HIGHWATER = 512*1024
+# Max size of the request headers
+MAX_REQUEST_SIZE = 64*1024
+# As advertised in the Keep-Alive header
+KEEPALIVE_TIMEOUT = 15
+KEEPALIVE_MAX = 100
+
 def bytestr2int(b):
     if b == "":
         return None
@@ -29,11 +50,74 @@ def bytestr2int(b):
         return int(b)
 
 
+def parse_byte_ranges(range,length):
+    """ Parses the value of an HTTP Range header for an entity of the given
+    length, see http://tools.ietf.org/html/rfc2616#section-14.35
+
+    Returns the list of satisfiable (firstbyte,lastbyte) ranges, or None if
+    the header is invalid or none of the ranges is satisfiable.
+    """
+    try:
+        type, seek = string.split(range,'=',1)
+        if type.strip().lower() != 'bytes':
+            return None
+        ranges = []
+        for spec in string.split(seek,','):
+            spec = spec.strip()
+            if spec == "":
+                continue
+            firstbytestr, lastbytestr = string.split(spec,'-',1)
+            firstbyte = bytestr2int(firstbytestr.strip())
+            lastbyte = bytestr2int(lastbytestr.strip())
+
+            if firstbyte is None:
+                if lastbyte is None or lastbyte < 0:
+                    # - Invalid input
+                    return None
+                if lastbyte == 0:
+                    continue
+                # "-100" = last 100 bytes. If the entity is shorter than the
+                # specified suffix-length, the entire entity-body is used.
+                firstbyte = max(0,length-lastbyte)
+                lastbyte = length-1
+            elif firstbyte < 0 or (lastbyte is not None and lastbyte < firstbyte):
+                # - Invalid input
+                return None
+            elif lastbyte is None or lastbyte >= length:
+                # "100-" : byte 100 and further
+                lastbyte = length-1
+
+            if firstbyte >= length:
+                continue
+            ranges.append((firstbyte,lastbyte))
+    except ValueError:
+        return None
+
+    if len(ranges) == 0:
+        return None
+    return ranges
+
+
+def socketpair():
+    """ Returns a pair of connected sockets. socket.socketpair() is not
+    available on Windows, so connect over the loopback interface. """
+    lsock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+    try:
+        lsock.bind(("127.0.0.1",0))
+        lsock.listen(1)
+        csock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        csock.connect(lsock.getsockname())
+        ssock,addr = lsock.accept()
+    finally:
+        lsock.close()
+    return ssock,csock
+
+
 class AbstractPathMapper:
-    
+
     def __init__(self):
         pass
-    
+
     def get(self,path):
         msg = 'AbstractPathMapper: Unknown path '+path
         stream = StringIO(msg)
@@ -41,81 +125,137 @@ class AbstractPathMapper:
         return streaminfo
 
 
-class VideoHTTPServer(ThreadingMixIn,BaseHTTPServer.HTTPServer):
-#class VideoHTTPServer(BaseHTTPServer.HTTPServer):
+class VideoHTTPServer:
     """
     Arno: not using ThreadingMixIn makes it a single-threaded server.
-    
+
     2009-09-08: Previously single or multi didn't matter because there would
     always just be one request for one HTTP path. Now we started supporting HTTP
     range queries and that results in parallel requests on the same path
     (and thus our stream object). The reason there are parallel requests
-    is due to the funky way VLC uses HTTP range queries: It does not request 
+    is due to the funky way VLC uses HTTP range queries: It does not request
     begin1-end1, begin2-end2, begin2-end2, but begin1- & begin2- &
     begin3-. That is, it requests almost the whole file everytime, and in
-    parallel too, aborting the earlier connections as it proceeds. 
-    
+    parallel too, aborting the earlier connections as it proceeds.
+
     2009-12-05: I now made it Multi-threaded to also handle the NSSA search
     API requests. The concurrency issue on the p2p streams is handled by
     adding a lock per stream.
+
+    The server no longer uses a thread per connection, as a head-end serving
+    many set-top boxes would run out of threads. One thread does all socket
+    I/O using select(), and a pool of worker threads prepare the responses
+    and read the streams. A connection gets more data when most of what it
+    got before has been sent. A request for a stream that is in use by
+    another request does not occupy a worker but is parked until that
+    request releases the stream.
+
+    A read that waits for P2P data blocks its worker. So that stalled
+    streams cannot starve the other clients, a worker that is busy for more
+    than STALL_TIME seconds no longer counts towards the nworkers workers
+    and an extra worker is started in its place. Extra workers exit when
+    idle. Hence there are nworkers threads plus one per stalled read.
     """
     __single = None
-    
-    def __init__(self,port):
+
+    def __init__(self,port,nworkers=DEFAULT_NWORKERS):
         if VideoHTTPServer.__single:
             raise RuntimeError, "HTTPServer is Singleton"
-        VideoHTTPServer.__single = self 
+        VideoHTTPServer.__single = self
+
+        self.init_server(port,nworkers)
 
+    def init_server(self,port,nworkers):
         self.port = port
-        BaseHTTPServer.HTTPServer.__init__( self, ("127.0.0.1",self.port), SimpleServer )
-        self.daemon_threads = True
-        self.allow_reuse_address = True
-        #self.request_queue_size = 10
+        self.socket = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+        self.socket.bind(("127.0.0.1",self.port))
+        self.socket.listen(5)
+        self.socket.setblocking(0)
+
+        self.lock = RLock()
 
-        self.lock = RLock()        
-        
         self.urlpath2streaminfo = {} # Maps URL to streaminfo
         self.mappers = [] # List of PathMappers
-        
+        self.urlpath2waiters = {} # Maps URL to connections waiting for its stream
+
         self.errorcallback = None
         self.statuscallback = None
-        
+
+        # Event handling. evlock protects the connections' buffers and state
+        # shared with the workers.
+        self.nworkers = nworkers
+        self.nthreads = 0   # running worker threads, including extra ones
+        self.evlock = Lock()
+        self.conns = {} # Maps fileno to VideoHTTPConnection
+        self.running = {} # Maps connection being processed to start time
+        self.jobs = Queue()
+        self.wakeup_recv,self.wakeup_send = socketpair()
+        self.wakeup_recv.setblocking(0)
+        self.wakeup_send.setblocking(0)
+        self.done = False
+
     def getInstance(*args, **kw):
         if VideoHTTPServer.__single is None:
             VideoHTTPServer(*args, **kw)
         return VideoHTTPServer.__single
     getInstance = staticmethod(getInstance)
-    
+
     def background_serve( self ):
-        name = "VideoHTTPServerThread-1"
-        self.thread2 = Thread(target=self.serve_forever,name=name)
+        self.start_threads("VideoHTTPServer")
+
+    def start_threads(self,name):
+        self.threadname = name
+        for i in range(self.nworkers):
+            self.start_worker(False)
+        self.thread2 = Thread(target=self.serve_forever,name=name+"Thread-1")
         self.thread2.setDaemon(True)
         self.thread2.start()
-        #thread.start_new_thread( self.serve_forever, () )
 
     def register(self,errorcallback,statuscallback):
         self.errorcallback = errorcallback
         self.statuscallback = statuscallback
 
-    def set_inputstream(self,streaminfo,urlpath):
+    def set_inputstream(self,streaminfo,urlpath,fanout=False):
+        """ Serve the stream in streaminfo at urlpath. Normally requests
+        for urlpath are served one at a time from the stream. With fanout,
+        any number of requests are served at the same time, each reading
+        from its own offset, see FanOutStream. If streaminfo has a 
+        'readerfunc', each request reads from readerfunc(reader) rather
+        than from its reader, e.g. to pace or stop each request on its own.
+        """
         if DEBUGLOCK:
             print >>sys.stderr,"vs: set_input: lock",urlpath,currentThread().getName()
         self.lock.acquire()
-        streaminfo['lock'] = RLock()
+        if fanout:
+            if 'blocksize' in streaminfo:
+                readsize = streaminfo['blocksize']
+            else:
+                readsize = 65536
+            streaminfo['fanout'] = FanOutStream(streaminfo['stream'],streaminfo['length'] is not None,readsize)
+        else:
+            # Not an RLock: a request may acquire the stream in one worker
+            # thread and release it in another.
+            streaminfo['lock'] = Lock()
         self.urlpath2streaminfo[urlpath] = streaminfo
         if DEBUGLOCK:
             print >>sys.stderr,"vs: set_input: unlock",urlpath,currentThread().getName()
         self.lock.release()
-        
-    def acquire_inputstream(self,urlpath):
 
-        streaminfo = None
-        # First check mappers, without locking, assuming video stream URL paths won't match mappers
+    def get_mapped_inputstream(self,urlpath):
+        # Check mappers, without locking, assuming video stream URL paths won't match mappers
         for mapper in self.mappers:
             streaminfo = mapper.get(urlpath)
             #print >>sys.stderr,"videoserv: get_inputstream: Got streaminfo",`streaminfo`,"from",`mapper`
             if streaminfo is not None and (streaminfo['statuscode'] == 200 or streaminfo['statuscode'] == 301 or streaminfo['statuscode'] == 501):
                 return streaminfo
+        return None
+
+    def acquire_inputstream(self,urlpath):
+
+        streaminfo = self.get_mapped_inputstream(urlpath)
+        if streaminfo is not None:
+            return streaminfo
 
         if DEBUGLOCK:
             print >>sys.stderr,"vs: acq_input: lock",urlpath,currentThread().getName()
@@ -132,8 +272,41 @@ class VideoHTTPServer(ThreadingMixIn,BaseHTTPServer.HTTPServer):
             if DEBUGLOCK:
                 print >>sys.stderr,"vs: acq_input: stream: lock",urlpath,currentThread().getName()
             streaminfo['lock'].acquire()
-        return streaminfo
+        return self.get_reader_streaminfo(streaminfo)
+
+    def try_acquire_inputstream(self,urlpath,conn):
+        """ Non-blocking version of acquire_inputstream() used by the
+        request handlers. Returns (True,streaminfo), or (False,None) when the
+        stream is in use by another request, in which case conn is rescheduled
+        when that request releases it. """
+        streaminfo = self.get_mapped_inputstream(urlpath)
+        if streaminfo is not None:
+            return True,streaminfo
 
+        self.lock.acquire()
+        try:
+            streaminfo = self.urlpath2streaminfo.get(urlpath,None)
+            if streaminfo is not None and 'lock' in streaminfo:
+                if DEBUGLOCK:
+                    print >>sys.stderr,"vs: try_acq_input: stream: lock",urlpath,currentThread().getName()
+                if not streaminfo['lock'].acquire(False):
+                    conn.waiting = True
+                    self.urlpath2waiters.setdefault(urlpath,[]).append(conn)
+                    return False,None
+        finally:
+            self.lock.release()
+        return True,self.get_reader_streaminfo(streaminfo)
+
+    def get_reader_streaminfo(self,streaminfo):
+        """ For a fan-out stream, returns a copy of streaminfo with its own
+        reader as stream, otherwise streaminfo """
+        if streaminfo is not None and 'fanout' in streaminfo:
+            reader = streaminfo['fanout'].get_reader()
+            if 'readerfunc' in streaminfo:
+                reader = streaminfo['readerfunc'](reader)
+            streaminfo = streaminfo.copy()
+            streaminfo['stream'] = reader
+        return streaminfo
 
     def release_inputstream(self,urlpath):
         if DEBUGLOCK:
@@ -150,13 +323,14 @@ class VideoHTTPServer(ThreadingMixIn,BaseHTTPServer.HTTPServer):
             if DEBUGLOCK:
                 print >>sys.stderr,"vs: rel_input: stream: unlock",urlpath,currentThread().getName()
             streaminfo['lock'].release()
+        self.wakeup_waiters(urlpath)
 
 
     def del_inputstream(self,urlpath):
         if DEBUGLOCK:
             print >>sys.stderr,"vs: del_input: enter",urlpath
         streaminfo = self.acquire_inputstream(urlpath)
-        
+
         if DEBUGLOCK:
             print >>sys.stderr,"vs: del_input: lock",urlpath,currentThread().getName()
         self.lock.acquire()
@@ -171,6 +345,18 @@ class VideoHTTPServer(ThreadingMixIn,BaseHTTPServer.HTTPServer):
             if DEBUGLOCK:
                 print >>sys.stderr,"vs: del_input: stream: unlock",urlpath,currentThread().getName()
             streaminfo['lock'].release()
+        self.wakeup_waiters(urlpath)
+
+    def wakeup_waiters(self,urlpath):
+        self.lock.acquire()
+        try:
+            waiters = self.urlpath2waiters.pop(urlpath,[])
+        finally:
+            self.lock.release()
+        if len(waiters) > 0:
+            for conn in waiters:
+                conn.waiting = False
+            self.wakeup()
 
 
     def get_port(self):
@@ -184,301 +370,614 @@ class VideoHTTPServer(ThreadingMixIn,BaseHTTPServer.HTTPServer):
     def shutdown(self):
         if DEBUG:
             print >>sys.stderr,"videoserv: Shutting down HTTP"
-        # Stop by closing listening socket of HTTP server
+        # Stop by closing listening socket of HTTP server, done by serve_forever
+        self.done = True
+        self.wakeup()
+
+    #
+    # Event handling, in the server thread
+    #
+    def serve_forever(self):
+        while not self.done:
+            try:
+                self.handle_events()
+            except:
+                print_exc()
+                time.sleep(0.1)
+
         self.socket.close()
+        for conn in self.conns.values():
+            self.close_connection(conn)
+        self.evlock.acquire()
+        nthreads = self.nthreads
+        self.evlock.release()
+        for i in range(nthreads):
+            self.jobs.put(None)
 
-    
-    def handle_error(self, request, client_address):
-        """ Error inside the BaseHTTPServer that reports errors like:
-          File "c:\Python265\lib\socket.py", line 406, in readline
-            data = self._sock.recv(self._rbufsize)
-          error: [Errno 10053] An established connection was aborted by the software in your host machine
-          
-          As this fill the log when VLC uses HTTP range requests in its brutal
-          way (send offset, close conn, send offset+10K-, close conn), 
-          only print when really wanted.
-        """
-        if DEBUGBASESERV:
-            print >>sys.stderr,"VideoHTTPServer: handle_error",request,client_address
-            print_exc()
-            
+    def handle_events(self):
+        rlist = [self.socket,self.wakeup_recv]
+        wlist = []
+        self.evlock.acquire()
+        try:
+            for conn in self.conns.itervalues():
+                if len(conn.inbuf) < MAX_REQUEST_SIZE:
+                    rlist.append(conn)
+                if conn.outbuflen > 0:
+                    wlist.append(conn)
+        finally:
+            self.evlock.release()
+
+        if len(self.running) > 0:
+            # Check for stalled workers regularly
+            timeout = STALL_TIME/2
+        else:
+            timeout = 1.0
+        try:
+            r,w,e = select.select(rlist,wlist,[],timeout)
+        except select.error,e:
+            if e[0] == errno.EINTR:
+                return
+            raise
+
+        for s in r:
+            if s is self.socket:
+                self.handle_accept()
+            elif s is self.wakeup_recv:
+                try:
+                    self.wakeup_recv.recv(4096)
+                except socket.error:
+                    pass
+            else:
+                self.handle_read(s)
+        for conn in w:
+            if not conn.closed:
+                self.handle_write(conn)
+        self.schedule()
+
+    def handle_accept(self):
+        try:
+            sock,addr = self.socket.accept()
+        except socket.error:
+            return
+        sock.setblocking(0)
+        conn = VideoHTTPConnection(sock,addr)
+        self.evlock.acquire()
+        self.conns[conn.fileno()] = conn
+        self.evlock.release()
+
+    def handle_read(self,conn):
+        try:
+            data = conn.sock.recv(65536)
+        except socket.error,e:
+            if e[0] in (errno.EAGAIN,errno.EWOULDBLOCK,errno.EINTR):
+                return
+            if DEBUGBASESERV:
+                print >>sys.stderr,"VideoHTTPServer: handle_read: error",conn.addr,e
+            data = ''
+        if len(data) == 0:
+            # Client closed the connection, e.g. VLC aborting a range request
+            self.close_connection(conn)
+            return
+        conn.inbuf += data
+        conn.lastactive = time.time()
+
+    def handle_write(self,conn):
+        """ Send what is buffered, without copying the data """
+        self.evlock.acquire()
+        try:
+            try:
+                while conn.outbuflen > 0:
+                    data = conn.outbuf[0]
+                    n = conn.sock.send(buffer(data,conn.outpos))
+                    conn.outbuflen -= n
+                    conn.outpos += n
+                    if conn.outpos < len(data):
+                        break
+                    del conn.outbuf[0]
+                    conn.outpos = 0
+            except socket.error,e:
+                if e[0] not in (errno.EAGAIN,errno.EWOULDBLOCK,errno.EINTR):
+                    if DEBUGBASESERV:
+                        print >>sys.stderr,"VideoHTTPServer: handle_write: error",conn.addr,e
+                    conn.broken = True
+            conn.lastactive = time.time()
+        finally:
+            self.evlock.release()
+        if conn.broken:
+            self.close_connection(conn)
+
+    def schedule(self):
+        """ Gives the workers the connections that have a request to handle
+        or need more data for their response, and closes the ones that are
+        done. """
+        now = time.time()
+        toclose = []
+        self.evlock.acquire()
+        try:
+            for conn in self.conns.itervalues():
+                if conn.busy or conn.waiting:
+                    continue
+                if conn.handler is None:
+                    if conn.outbuflen > 0:
+                        continue
+                    if conn.close_when_done or now-conn.lastactive > KEEPALIVE_TIMEOUT:
+                        toclose.append(conn)
+                        continue
+                    # Next request, ignoring empty lines preceding it
+                    conn.inbuf = conn.inbuf.lstrip('\r\n')
+                    end = conn.find_request_end()
+                    if end == -1:
+                        continue
+                    requestdata = conn.inbuf[:end]
+                    conn.inbuf = conn.inbuf[end:]
+                    conn.handler = SimpleServer(requestdata,conn,self)
+                    conn.nrequests += 1
+                    if conn.nrequests >= KEEPALIVE_MAX:
+                        conn.close_when_done = True
+                elif conn.outbuflen >= OUTBUF_LOWWATER:
+                    continue
+                conn.busy = True
+                self.jobs.put(conn)
+        finally:
+            self.evlock.release()
+        for conn in toclose:
+            self.close_connection(conn)
+        self.check_stalled(now)
+
+    def check_stalled(self,now):
+        """ Starts extra workers so there are nworkers that are not stalled
+        waiting for data """
+        self.evlock.acquire()
+        try:
+            nstalled = 0
+            for started in self.running.itervalues():
+                if now-started > STALL_TIME:
+                    nstalled += 1
+            nstart = self.nworkers+nstalled-self.nthreads
+        finally:
+            self.evlock.release()
+        for i in range(nstart):
+            if DEBUGBASESERV:
+                print >>sys.stderr,"VideoHTTPServer: starting extra worker,",nstalled,"stalled"
+            self.start_worker(True)
+
+    def close_connection(self,conn):
+        self.evlock.acquire()
+        try:
+            if conn.closed:
+                return
+            conn.closed = True
+            del self.conns[conn.fileno()]
+            handler = None
+            if not conn.busy:
+                # Otherwise the worker finishes it
+                handler = conn.handler
+                conn.handler = None
+        finally:
+            self.evlock.release()
+        try:
+            conn.sock.close()
+        except:
+            pass
+        if handler is not None:
+            handler.finish()
+
+    def wakeup(self):
+        try:
+            self.wakeup_send.send('x')
+        except socket.error:
+            # Full, so a wakeup is pending anyway
+            pass
+
+    #
+    # Request handling, in the worker threads
+    #
+    def start_worker(self,extra):
+        self.evlock.acquire()
+        self.nthreads += 1
+        n = self.nthreads
+        self.evlock.release()
+        worker = Thread(target=self.worker,args=(extra,),name=self.threadname+"Worker-"+str(n))
+        worker.setDaemon(True)
+        worker.start()
+
+    def worker(self,extra):
+        while True:
+            if extra:
+                try:
+                    conn = self.jobs.get(True,EXTRA_WORKER_IDLE)
+                except Empty:
+                    self.evlock.acquire()
+                    try:
+                        if self.nthreads > self.nworkers:
+                            self.nthreads -= 1
+                            break
+                    finally:
+                        self.evlock.release()
+                    continue
+            else:
+                conn = self.jobs.get()
+            if conn is None:
+                break
+            self.process_connection(conn)
+
+    def process_connection(self,conn):
+        """ Adds the next parts of the response to the connection's buffer,
+        until OUTBUF_HIGHWATER bytes are waiting to be sent """
+        handler = conn.handler
+        finish = False
+        more = True
+        while more:
+            self.evlock.acquire()
+            self.running[conn] = time.time()
+            self.evlock.release()
+            try:
+                data = handler.step()
+            except Exception,e:
+                if DEBUG:
+                    print >>sys.stderr,"videoserv: Error occured while serving",currentThread().getName()
+                print_exc()
+                handler.error(e,handler.path)
+                # Cannot complete the response
+                handler.close_connection = 1
+                data = ''
+
+            more = False
+            self.evlock.acquire()
+            try:
+                del self.running[conn]
+                if data == '':
+                    # Response complete
+                    conn.handler = None
+                    if handler.close_connection:
+                        conn.close_when_done = True
+                    finish = True
+                elif data is not None:
+                    conn.outbuf.append(data)
+                    conn.outbuflen += len(data)
+                    more = not conn.closed and conn.outbuflen < OUTBUF_HIGHWATER
+                if conn.closed and conn.handler is not None:
+                    conn.handler = None
+                    finish = True
+                if not more:
+                    conn.busy = False
+            finally:
+                self.evlock.release()
+            self.wakeup()
+        if finish:
+            handler.finish()
+
+
+class VideoHTTPConnection:
+    """ State of a client connection of the VideoHTTPServer """
+
+    def __init__(self,sock,addr):
+        self.sock = sock
+        self.addr = addr
+        self.fd = sock.fileno()
+        self.inbuf = ''
+        self.outbuf = []    # strings to send
+        self.outpos = 0     # bytes of outbuf[0] already sent
+        self.outbuflen = 0  # bytes in outbuf not yet sent
+        self.handler = None # SimpleServer for the current request
+        self.nrequests = 0
+        self.busy = False    # handed to a worker
+        self.waiting = False # waiting for a stream, see try_acquire_inputstream
+        self.closed = False
+        self.broken = False
+        self.close_when_done = False
+        self.lastactive = time.time()
+
+    def fileno(self):
+        return self.fd
+
+    def find_request_end(self):
+        """ Returns the index just past the headers of the first request in
+        inbuf, or -1 if they are not complete yet """
+        end = self.inbuf.find('\r\n\r\n')
+        if end != -1:
+            end += 4
+        lfend = self.inbuf.find('\n\n')
+        if lfend != -1 and (end == -1 or lfend+2 < end):
+            end = lfend+2
+        return end
 
 
 class SimpleServer(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Handles a single request of a VideoHTTPConnection. The status line
+    and headers are written to self.wfile, the body is produced block by
+    block by the self.body generator, see step().
+    """
 
     RANGE_REQUESTS_ENABLED=True
-    """
-    def __init__(self,request, client_address, server):
-        self.count = 0
-        BaseHTTPServer.BaseHTTPRequestHandler.__init__(self,request,client_address,server)
-    """
+
+    def __init__(self,requestdata,conn,server):
+        # Not calling BaseRequestHandler.__init__, that handles the request
+        # on a blocking socket.
+        self.conn = conn
+        self.client_address = conn.addr
+        self.server = server
+        self.rfile = StringIO(requestdata)
+        self.wfile = StringIO()
+        self.path = None
+        self.body = None
+        self.locked = False
 
     def log_message(self, format, *args):
         pass
 
+    def step(self):
+        """ Returns the next part of the response, '' if the response is
+        complete, or None when the requested stream is in use by another
+        request. Called by a worker thread.
+        """
+        if self.body is None:
+            if self.path is None:
+                self.raw_requestline = self.rfile.readline()
+                self.protocol_version = 'HTTP/1.1'
+                if not self.parse_request():
+                    # Error response written by parse_request(), if any
+                    self.close_connection = 1
+                    self.body = iter([])
+                elif self.command != 'GET':
+                    self.send_error(501, "Unsupported method (%r)" % self.command)
+                    self.body = iter([])
+                # Reply in the version of the request
+                if self.request_version != 'HTTP/1.1':
+                    self.protocol_version = 'HTTP/1.0'
+                    self.close_connection = 1
+            if self.body is None:
+                if not self.do_GET():
+                    return None
+            data = self.wfile.getvalue()
+            self.wfile = None
+            if len(data) > 0:
+                return data
+
+        for data in self.body:
+            if len(data) > 0:
+                return data
+        return ''
+
     def do_GET(self):
-        """ 
+        """
         Handle HTTP GET request. See remark about VLC's use of HTTP GET RANGE
         requests above.
-        
-        Called by a separate thread for each request.
+
+        Writes the status line and headers to self.wfile and sets self.body
+        to a generator for the body. Returns False if the stream is in use
+        by another request.
         """
         global DEBUG
+        if self.path.startswith("/webUI"):
+            DEBUG = DEBUGWEBUI
+        else:
+            DEBUG = DEBUGCONTENT
+
+        if DEBUG:
+            print >>sys.stderr,"videoserv: do_GET: Got request",self.path,self.headers.getheader('range'),currentThread().getName()
+            #print >>sys.stderr,"videoserv: do_GET: Range",self.headers.getrawheader('Range'),currentThread().getName()
+
+        # 1. Get streaminfo for the data we should return in response
         try:
-            if self.path.startswith("/webUI"):
-                DEBUG = DEBUGWEBUI
+            ok,streaminfo = self.server.try_acquire_inputstream(self.path,self.conn)
+        except:
+            print_exc()
+            ok,streaminfo = True,None
+        if not ok:
+            if DEBUG:
+                print >>sys.stderr,"videoserv: do_GET: Stream busy, waiting",self.path,currentThread().getName()
+            return False
+        self.locked = streaminfo is not None and 'lock' in streaminfo
+        #print >>sys.stderr,"videoserv: do_GET: Got streaminfo",`streaminfo`
+
+        self.body = iter([])
+        if streaminfo is None or ('statuscode' in streaminfo and streaminfo['statuscode'] != 200):
+            # 2. Send error response
+            if streaminfo is None:
+                streaminfo = {'statuscode':500,'statusmsg':"Internal Server Error, couldn't find resource"}
+            if DEBUG:
+                print >>sys.stderr,"videoserv: do_GET: Returning non-200 response:",streaminfo['statuscode'],currentThread().getName()
+
+            self.send_response(streaminfo['statuscode'])
+            # Arno, 2011-01-19: Needed for XmlHttpRequest failures
+            self.send_header("Access-Control-Allow-Origin","*")
+
+            if streaminfo['statuscode'] == 301:
+                self.send_header("Location", streaminfo['statusmsg'])
+                self.send_header("Content-Length", 0)
+                self.end_headers()
             else:
-                DEBUG = DEBUGCONTENT
-            
+                self.send_header("Content-Type","text/plain")
+                self.send_header("Content-Length", len(streaminfo['statusmsg']))
+                self.end_headers()
+                self.body = iter([streaminfo['statusmsg']])
+            return True
+
+        # 2. Prepare to send stream
+        mimetype = streaminfo['mimetype']
+        stream = streaminfo['stream']
+        length = streaminfo['length']
+        if 'blocksize' in streaminfo:
+            blocksize = streaminfo['blocksize']
+        else:
+            blocksize = 65536
+        if 'svc' in streaminfo:
+            # When in SVC mode we return all data that we have
+            # currently. Subsequent requests will
+            # return the next batch of data.
+            svc = streaminfo['svc']
+        else:
+            svc = False
+
+        #mimetype = 'application/x-mms-framed'
+        #mimetype = 'video/H264'
+        if DEBUG:
+            print >>sys.stderr,"videoserv: do_GET: MIME type is",mimetype,"length",length,"blocksize",blocksize,currentThread().getName()
+
+        # 3. Support for HTTP range queries:
+        # http://tools.ietf.org/html/rfc2616#section-14.35
+        if length is not None:
+            ranges = [(0,length-1)]
+        else:
+            ranges = [(0,None)]
+        boundary = None
+
+        range = self.headers.getheader('range')
+        if self.RANGE_REQUESTS_ENABLED and length and range:
+            # Handle RANGE query
+            ranges = parse_byte_ranges(range,length)
+            if ranges is None:
+                # Send 416 - Requested Range not satisfiable and exit
+                self.send_response(416)
+                crheader = "bytes */"+str(length)
+                self.send_header("Content-Range",crheader)
+                self.send_header("Content-Length",0)
+                self.end_headers()
+                return True
+
+            self.send_response(206)
+            if len(ranges) == 1:
+                # Arno, 2010-01-08: Fixed bug, now return /length
+                firstbyte,lastbyte = ranges[0]
+                crheader = "bytes "+str(firstbyte)+"-"+str(lastbyte)+"/"+str(length)
+                self.send_header("Content-Range",crheader)
+            else:
+                # Range set, send each range as a part of a multipart message
+                boundary = "%016x" % random.getrandbits(64)
+        else:
+            # Normal GET request
+            self.send_response(200)
+
+        if DEBUG:
+            print >>sys.stderr,"videoserv: do_GET: final ranges",ranges,currentThread().getName()
+
+        # For persistent connections keep the socket alive!
+        if not self.close_connection:
+            self.send_header("Connection", "Keep-Alive")
+            self.send_header("Keep-Alive", "timeout=%d, max=%d" % (KEEPALIVE_TIMEOUT,KEEPALIVE_MAX))
+
+        # 5. Send headers
+        if boundary is None:
+            self.send_header("Content-Type", mimetype)
+        else:
+            self.send_header("Content-Type", "multipart/byteranges; boundary="+boundary)
+        self.send_header("Accept-Ranges", "bytes")
+        # Arno, 2011-1-13: Needed when retrieving metadata via
+        # XmlHttpRequest
+        self.send_header("Access-Control-Allow-Origin","*")
+
+        # Ric: bitrate needs to be detected even if the file is already completed
+        if streaminfo.has_key('bitrate') and streaminfo['bitrate'] is not None and length is not None:
+            bitrate = streaminfo['bitrate']
+            estduration = float(length) / float(bitrate)
+
+            self.send_header("X-Content-Duration", round(estduration, 2))
+
+        if svc:
+            # For SVC we send all we currently have, not blocking.
+            self.close_connection = 1
+            self.body = self.svc_body(stream)
+        elif length is None:
+            # If length unknown, use chunked encoding
+            # http://www.ietf.org/rfc/rfc2616.txt, $3.6.1
+            self.send_header("Transfer-Encoding", "chunked")
+            self.body = self.chunked_body(stream,blocksize)
+        else:
+            parts = []
+            contentlength = 0
+            for firstbyte,lastbyte in ranges:
+                if boundary is None:
+                    partheader = ''
+                else:
+                    partheader = "\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n" % (boundary,mimetype,firstbyte,lastbyte,length)
+                parts.append((partheader,firstbyte,lastbyte+1-firstbyte))
+                contentlength += len(partheader)+lastbyte+1-firstbyte
+            if boundary is None:
+                trailer = ''
+            else:
+                trailer = "\r\n--%s--\r\n" % (boundary)
+            contentlength += len(trailer)
+            self.send_header("Content-Length", contentlength)
+            self.body = self.ranges_body(stream,parts,trailer,blocksize,range is not None)
+        self.end_headers()
+        return True
+
+    def svc_body(self,stream):
+        # 6. Send body: For SVC we send all we currently have, not blocking.
+        data = stream.read()
+
+        if len(data) > 0:
+            yield data
+        elif len(data) == 0:
             if DEBUG:
-                print >>sys.stderr,"videoserv: do_GET: Got request",self.path,self.headers.getheader('range'),currentThread().getName()
-                #print >>sys.stderr,"videoserv: do_GET: Range",self.headers.getrawheader('Range'),currentThread().getName()
-                
-            # 1. Get streaminfo for the data we should return in response
-            nbytes2send = None
-            nbyteswritten= 0
+                print >>sys.stderr,"videoserv: svc: stream.read() no data"
+
+    def chunked_body(self,stream,blocksize):
+        # 6. Send body: an infinite stream in chunked encoding
+        try:
+            stream.seek(0)
+        except:
+            # Arno, 2010-10-17: Live will throw harmless exception,
+            # Ogg live needs it to reset to "send header" first state.
+            # Better solution is to have OggMagicStream with
+            # ControlledStream in BackgroundProcess.py
+            print_exc()
+
+        while True:
+            data = stream.read(blocksize)
+            if not data:
+                if DEBUG:
+                    print >>sys.stderr,"videoserv: do_GET: stream reached EOF",currentThread().getName()
+                yield "0\r\n\r\n"
+                break
+            yield "%x\r\n%s\r\n" % (len(data),data)
+
+    def ranges_body(self,stream,parts,trailer,blocksize,isrange):
+        # 6. Send body: the complete stream or the requested ranges
+        for partheader,firstbyte,nbytes2send in parts:
+            yield partheader
+
+            # Seek in stream to desired offset
             try:
-                streaminfo = self.server.acquire_inputstream(self.path)
+                stream.seek(firstbyte)
             except:
+                # Arno, 2010-10-17: Live will throw harmless exception,
+                # Ogg live needs it to reset to "send header" first state.
                 print_exc()
-                streaminfo = None
-            #print >>sys.stderr,"videoserv: do_GET: Got streaminfo",`streaminfo`
-            
-            # Ric: modified to create a persistent connection in case it's requested (HTML5)
-            if self.request_version == 'HTTP/1.1':
-                self.protocol_version = 'HTTP/1.1'
-                
-            try:
-                if streaminfo is None or ('statuscode' in streaminfo and streaminfo['statuscode'] != 200):
-                    # 2. Send error response
-                    if streaminfo is None:
-                        streaminfo = {'statuscode':500,'statusmsg':"Internal Server Error, couldn't find resource"}
-                    if DEBUG:
-                        print >>sys.stderr,"videoserv: do_GET: Returning non-200 response:",streaminfo['statuscode'],currentThread().getName()
-                        
-                    self.send_response(streaminfo['statuscode'])
-                    # Arno, 2011-01-19: Needed for XmlHttpRequest failures
-                    self.send_header("Access-Control-Allow-Origin","*")
-                    
-                    if streaminfo['statuscode'] == 301:
-                        self.send_header("Location", streaminfo['statusmsg'])
-                        self.end_headers()
-                    else:
-                        self.send_header("Content-Type","text/plain")
-                        self.send_header("Content-Length", len(streaminfo['statusmsg']))
-                        self.end_headers()
-                        self.wfile.write(streaminfo['statusmsg'])
-                    return
-                else:
-                    # 2. Prepare to send stream
-                    mimetype = streaminfo['mimetype']
-                    stream = streaminfo['stream']
-                    length = streaminfo['length']
-                    if 'blocksize' in streaminfo:
-                        blocksize = streaminfo['blocksize']
-                    else:
-                        blocksize = 65536
-                    if 'svc' in streaminfo:
-                        # When in SVC mode we return all data that we have 
-                        # currently. Subsequent requests will
-                        # return the next batch of data.
-                        svc = streaminfo['svc']
-                    else:
-                        svc = False
 
-        
-                #mimetype = 'application/x-mms-framed'
-                #mimetype = 'video/H264'
-                if DEBUG:
-                    print >>sys.stderr,"videoserv: do_GET: MIME type is",mimetype,"length",length,"blocksize",blocksize,currentThread().getName()
-    
-                # 3. Support for HTTP range queries: 
-                # http://tools.ietf.org/html/rfc2616#section-14.35
-                firstbyte = 0
-                if length is not None:
-                    lastbyte = length-1
-                else:
-                    lastbyte = None # to avoid print error below
-    
-                range = self.headers.getheader('range')
-                if self.RANGE_REQUESTS_ENABLED and length and range:
-                    # Handle RANGE query
-                    bad = False
-                    type, seek = string.split(range,'=')
-                    if seek.find(",") != -1:
-                        # - Range header contains set, not supported at the moment
-                        bad = True
-                    else:
-                        firstbytestr, lastbytestr = string.split(seek,'-')
-                        firstbyte = bytestr2int(firstbytestr)
-                        lastbyte = bytestr2int(lastbytestr)
-                
-                        if length is None:
-                            # - No length (live) 
-                            bad = True
-                        elif firstbyte is None and lastbyte is None:
-                            # - Invalid input
-                            bad = True
-                        elif firstbyte >= length:
-                            bad = True
-                        elif lastbyte >= length:
-                            if firstbyte is None:
-                                """ If the entity is shorter than the specified 
-                                suffix-length, the entire entity-body is used.
-                                """
-                                lastbyte = length-1
-                            else:
-                                bad = True
-                        
-                    if bad:
-                        # Send 416 - Requested Range not satisfiable and exit
-                        self.send_response(416)
-                        if length is None:
-                            crheader = "bytes */*"
-                        else:
-                            crheader = "bytes */"+str(length)
-                        self.send_header("Content-Range",crheader)
-                        self.end_headers()
-                        
-                        return
-                    
-                    if firstbyte is not None and lastbyte is None:
-                        # "100-" : byte 100 and further
-                        nbytes2send = length - firstbyte
-                        lastbyte = length - 1
-                    elif firstbyte is None and lastbyte is not None:
-                        # "-100" = last 100 bytes
-                        nbytes2send = lastbyte
-                        firstbyte = length - lastbyte
-                        lastbyte = length - 1
-                        
-                    else:
-                        nbytes2send = lastbyte+1 - firstbyte
-            
-                    # Arno, 2010-01-08: Fixed bug, now return /length
-                    crheader = "bytes "+str(firstbyte)+"-"+str(lastbyte)+"/"+str(length)
-            
-                    self.send_response(206)
-                    self.send_header("Content-Range",crheader)
-                else:
-                    # Normal GET request
-                    nbytes2send = length
-                    self.send_response(200)
-            
-            
-                if DEBUG:
-                    print >>sys.stderr,"videoserv: do_GET: final range",firstbyte,lastbyte,nbytes2send,currentThread().getName()
-            
-            
-                # 4. Seek in stream to desired offset, unless svc
-                if not svc:
-                    try:
-                        stream.seek(firstbyte)
-                    except:
-                        # Arno, 2010-10-17: Live will throw harmless exception, 
-                        # Ogg live needs it to reset to "send header" first state.
-                        # Better solution is to have OggMagicStream with
-                        # ControlledStream in BackgroundProcess.py
-                        print_exc()
-        
-                # For persistent connections keep the socket alive!
-                if self.request_version == 'HTTP/1.1':
-                    self.send_header("Connection", "Keep-Alive")
-                    # test.. to be adjusted depending on the request
-                    self.send_header("Keep-Alive", "timeout=15, max=100")
-                    
-                # 5. Send headers
-                self.send_header("Content-Type", mimetype)
-                self.send_header("Accept-Ranges", "bytes")
-                # Arno, 2011-1-13: Needed when retrieving metadata via 
-                # XmlHttpRequest
-                self.send_header("Access-Control-Allow-Origin","*")
-
-
-                # Ric: bitrate needs to be detected even if the file is already completed
-                if streaminfo.has_key('bitrate') and streaminfo['bitrate'] is not None and length is not None:
-                    bitrate = streaminfo['bitrate']
-                    estduration = float(length) / float(bitrate)
-
-                    self.send_header("X-Content-Duration", round(estduration, 2))
-
-                if length is not None:
-                    self.send_header("Content-Length", nbytes2send)
-                else:
-                    self.send_header("Transfer-Encoding", "chunked")
-                self.end_headers()
-    
-    
-                if svc:
-                    # 6. Send body: For SVC we send all we currently have, not blocking.
-                    data = stream.read()
-                    
-                    if len(data) > 0: 
-                        self.wfile.write(data)
-                    elif len(data) == 0:
-                        if DEBUG:
-                            print >>sys.stderr,"videoserv: svc: stream.read() no data" 
-                else:
-                    # 6. Send body (completely, a Range: or an infinite stream in chunked encoding
-                    done = False
-                    while True:
-                        data = stream.read(blocksize)
-                        if len(data) == 0:
-                            done = True
-                        
-                        #print >>sys.stderr,"videoserv: HTTP: read",len(data),"bytes",currentThread().getName()
-                        
-                        if length is None:
-                            # If length unknown, use chunked encoding
-                            # http://www.ietf.org/rfc/rfc2616.txt, $3.6.1 
-                            self.wfile.write("%x\r\n" % (len(data)))
-                        if len(data) > 0:
-                            # Limit output to what was asked on range queries:
-                            if length is not None and nbyteswritten+len(data) > nbytes2send:
-                                endlen = nbytes2send-nbyteswritten
-                                if endlen != 0:
-                                    self.wfile.write(data[:endlen])
-                                done = True
-                                nbyteswritten += endlen
-                            else:
-                                self.wfile.write(data)
-                                nbyteswritten += len(data)
-                            
-                            #print >>sys.stderr,"videoserv: HTTP: wrote total",nbyteswritten
-                            
-                        if length is None:
-                            # If length unknown, use chunked encoding
-                            self.wfile.write("\r\n")
-        
-                        if done:
-                            if DEBUG:
-                                print >>sys.stderr,"videoserv: do_GET: stream reached EOF or range query's send limit",currentThread().getName() 
-                            break
-                        
-                    if nbyteswritten != nbytes2send:
-                        print >>sys.stderr,"videoserv: do_GET: Sent wrong amount, wanted",nbytes2send,"got",nbyteswritten,currentThread().getName()
-
-                    # Arno, 2010-01-08: No close on Range queries
-                    if not range:
-                        stream.close()
-                        if self.server.statuscallback is not None:
-                            self.server.statuscallback("Done")
-                    
-            finally:
-                self.server.release_inputstream(self.path)
-            
-        except socket.error,e2:
-            #if DEBUG:
-            #    print >>sys.stderr,"videoserv: SocketError occured while serving",currentThread().getName()
-            pass
-        except Exception,e:
+            nbyteswritten = 0
+            while nbyteswritten < nbytes2send:
+                # Limit output to what was asked on range queries
+                data = stream.read(min(blocksize,nbytes2send-nbyteswritten))
+                if not data:
+                    break
+
+                #print >>sys.stderr,"videoserv: HTTP: read",len(data),"bytes",currentThread().getName()
+                nbyteswritten += len(data)
+                yield data
+
             if DEBUG:
-                print >>sys.stderr,"videoserv: Error occured while serving",currentThread().getName()
-            print_exc()
-            self.error(e,self.path)
+                print >>sys.stderr,"videoserv: do_GET: stream reached EOF or range query's send limit",currentThread().getName()
+            if nbyteswritten != nbytes2send:
+                print >>sys.stderr,"videoserv: do_GET: Sent wrong amount, wanted",nbytes2send,"got",nbyteswritten,currentThread().getName()
+                # Cannot complete the response
+                self.close_connection = 1
+                return
+        yield trailer
 
-        
+        # Arno, 2010-01-08: No close on Range queries
+        if not isrange:
+            stream.close()
+            if self.server.statuscallback is not None:
+                self.server.statuscallback("Done")
 
+    def finish(self):
+        """ Called when the response is complete or the connection closed.
+        Overrides StreamRequestHandler.finish() which flushes the socket. """
+        if self.locked:
+            self.locked = False
+            self.server.release_inputstream(self.path)
 
     def error(self,e,url):
         if self.server.errorcallback is not None:
@@ -554,8 +1053,12 @@ class VideoRawVLCServer:
             self.oldsid = sid
             
             streaminfo = self.get_inputstream(sid)
+            stream = streaminfo['stream']
             #print >>sys.stderr,"rawread: sid",sid,"n",buflen
-            data = streaminfo['stream'].read(buflen)
+            if hasattr(stream,'readinto'):
+                # Copy the data straight into VLC's buffer
+                return stream.readinto(bufc)
+            data = stream.read(buflen)
             size = len(data)
             #print >>sys.stderr,"rawread: sid",sid,"GOT",size
             if size == 0:
@@ -588,32 +1091,17 @@ class VideoRawVLCServer:
 
 
 
-class MultiHTTPServer(ThreadingMixIn,VideoHTTPServer):
+class MultiHTTPServer(VideoHTTPServer):
     """ MuliThreaded HTTP Server """
 
     __single = None
     
-    def __init__(self,port):
+    def __init__(self,port,nworkers=DEFAULT_NWORKERS):
         if MultiHTTPServer.__single:
             raise RuntimeError, "MultiHTTPServer is Singleton"
         MultiHTTPServer.__single = self 
 
-        self.port = port
-        BaseHTTPServer.HTTPServer.__init__( self, ("127.0.0.1",self.port), SimpleServer )
-        self.daemon_threads = True
-        self.allow_reuse_address = True
-        #self.request_queue_size = 10
-
-        self.lock = RLock()        
-        
-        self.urlpath2streaminfo = {} # Maps URL to streaminfo
-        self.mappers = [] # List of PathMappers
-        
-        self.errorcallback = None
-        self.statuscallback = None
+        self.init_server(port,nworkers)
 
     def background_serve( self ):
-        name = "MultiHTTPServerThread-1"
-        self.thread2 = Thread(target=self.serve_forever,name=name)
-        self.thread2.setDaemon(True)
-        self.thread2.start()
+        self.start_threads("MultiHTTPServer")